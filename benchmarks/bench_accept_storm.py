@@ -0,0 +1,229 @@
+#########################################
+# bench_accept_storm.py                 #
+# Accepts during a reconnect storm      #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_accept_storm.py [clients]
+# Starts run_server.py and has (default 20000) clients connect at once,
+# like every user of a server coming back after a network blip. Each
+# client waits for the username prompt, then hangs up with a reset so
+# the runs do not use up the local ports with TIME_WAIT. "legacy" is the
+# listener before the accept loop: one accept() per wakeup, the banner
+# sent on its own and Python's default listen() backlog of 128. The
+# other runs take every waiting connection per wakeup with a backlog of
+# 128 and of 4096. "overflows" is how many connections the kernel had
+# no room for in the backlog, they are retried by the client after a
+# second or more, which is where the slow tail comes from. Clients that
+# never got a prompt within the deadline count as errors. "server CPU"
+# is the server's CPU time per accepted connection, read from /proc.
+
+import multiprocessing
+import os
+import selectors
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from loadgen import HOST, percentiles  # noqa: E402
+
+PORT = 18161
+
+# Processes the clients are spread over, each has its own descriptor
+# limit
+PROCESSES = 2
+
+# Seconds a client waits for the prompt before it counts as failed
+DEADLINE = 30
+
+# Runs the server with one accept() per wakeup, as before the accept loop
+LEGACY = """
+import runpy
+
+import server.messaging
+from server import Server
+
+WELCOME = server.messaging.WELCOME
+
+# The banner was sent on its own before initialize_client()
+server.messaging.WELCOME = b""
+
+
+def legacy_accept(self, events):
+    try:
+        client_socket, client_address = self.socket.accept()
+
+    except BlockingIOError:
+        return
+
+    client_socket.send(WELCOME)
+
+    return self.admit(client_socket, client_address)
+
+
+Server.accept = legacy_accept
+
+runpy.run_path("run_server.py", run_name="__main__")
+"""
+
+
+def server_cpu(pid):
+    # User and system time of a process in seconds
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def listen_overflows():
+    # TcpExt ListenOverflows across the whole machine
+    with open("/proc/net/netstat") as netstat:
+        lines = netstat.read().splitlines()
+
+    for names, values in zip(lines[::2], lines[1::2]):
+        if names.startswith("TcpExt:"):
+            stats = dict(zip(names.split()[1:], map(int, values.split()[1:])))
+
+            return stats["ListenOverflows"]
+
+    return 0
+
+
+def storm(count, start, results):
+    # Connect every client at once and wait for each one's prompt
+    selector = selectors.DefaultSelector()
+    latencies = []
+    errors = 0
+
+    # Reset on close instead of leaving the port in TIME_WAIT
+    linger = struct.pack("ii", 1, 0)
+
+    while time.monotonic() < start:
+        time.sleep(0.001)
+
+    for index in range(count):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, linger)
+        client.setblocking(False)
+        client.connect_ex((HOST, PORT))
+
+        selector.register(client, selectors.EVENT_READ, bytearray())
+
+    left = count
+
+    while left > 0 and time.monotonic() < start + DEADLINE:
+        for key, events in selector.select(1):
+            try:
+                data = key.fileobj.recv(4096)
+
+            except OSError:
+                data = b""
+
+            key.data.extend(data)
+
+            if b"Username?" in key.data:
+                latencies.append(time.monotonic() - start)
+
+            elif len(data) > 0:
+                continue
+
+            else:
+                errors += 1
+
+            selector.unregister(key.fileobj)
+            key.fileobj.close()
+
+            left -= 1
+
+    results.put((latencies, errors + left))
+
+
+def run(count, command, backlog):
+    env = dict(os.environ, HOST=HOST, PORT=str(PORT), BACKLOG=str(backlog),
+               METRICS_PORT="0", JSON_PORT="0", DATABASE="",
+               RATE_LIMITS="off", LOG_LEVEL="off")
+    server = subprocess.Popen(command, cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL)
+
+    time.sleep(1)
+
+    overflows = listen_overflows()
+    cpu = server_cpu(server.pid)
+    start = time.monotonic() + 0.5
+
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=storm,
+                                       args=(count // PROCESSES, start,
+                                             results))
+               for _ in range(PROCESSES)]
+
+    for worker in workers:
+        worker.start()
+
+    latencies = []
+    errors = 0
+
+    try:
+        for _ in workers:
+            worker_latencies, worker_errors = results.get()
+            latencies += worker_latencies
+            errors += worker_errors
+
+        for worker in workers:
+            worker.join()
+
+        cpu = server_cpu(server.pid) - cpu
+
+    finally:
+        server.kill()
+        server.wait()
+
+    overflows = listen_overflows() - overflows
+
+    return latencies, errors, overflows, cpu
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    print(f"{count} clients reconnecting at once")
+    print(f"{'listener':>12} {'accepts/s':>10} {'p50':>9} {'p99':>9} " +
+          f"{'max':>9} {'errors':>7} {'overflows':>10} " +
+          f"{'server CPU':>11}")
+
+    script = [sys.executable, "run_server.py"]
+
+    for name, command, backlog in (
+            ("legacy", [sys.executable, "-c", LEGACY], 128),
+            ("loop, 128", script, 128),
+            ("loop, 4096", script, 4096)):
+        latencies, errors, overflows, cpu = run(count, command, backlog)
+
+        # Microseconds for percentiles()
+        histogram = {}
+
+        for latency in latencies:
+            key = int(latency * 1e6)
+            histogram[key] = histogram.get(key, 0) + 1
+
+        summary = percentiles(histogram)
+        rate = len(latencies) / max(latencies) if latencies else 0
+
+        print(f"{name:>12} {rate:>10.0f} " +
+              f"{summary.get('p50', 0):>7.0f}ms " +
+              f"{summary.get('p99', 0):>7.0f}ms " +
+              f"{summary.get('max', 0):>7.0f}ms {errors:>7} " +
+              f"{overflows:>10} " +
+              f"{cpu / max(len(latencies), 1) * 1e6:>9.0f}us")
+
+        # Let the resets settle before the next server starts
+        time.sleep(1)
+
+
+if __name__ == "__main__":
+    main()
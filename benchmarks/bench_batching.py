@@ -0,0 +1,116 @@
+#########################################
+# bench_batching.py                     #
+# Busy room with and without batching   #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_batching.py [windows in ms...]
+# Starts run_server.py once per batch window (default 0, 2, 5 and 10 ms,
+# 0 is batching off), drives the huge_room preset of loadgen.py against
+# it and prints the server's sendmsg() calls and TCP segments per second
+# next to the fan-out latency. sendmsg() calls come from the metrics
+# endpoint, segments from /proc/net/snmp (every process on the machine
+# counts, so keep it quiet).
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HOST = "127.0.0.1"
+PORT = 18131
+METRICS_PORT = 18132
+
+LOAD = ["huge_room", "--clients", "300", "--senders", "30", "--rate", "10",
+        "--duration", "10"]
+
+
+def sendmsg_calls():
+    with urllib.request.urlopen(
+            f"http://127.0.0.1:{METRICS_PORT}/metrics") as response:
+        for line in response.read().decode('utf-8').splitlines():
+            if line.startswith("chat_sendmsg_calls_total "):
+                return int(line.split()[1])
+
+    return 0
+
+
+def tcp_segments():
+    with open("/proc/net/snmp") as snmp:
+        header, values = [line.split() for line in snmp
+                          if line.startswith("Tcp:")]
+
+    return int(values[header.index("OutSegs")])
+
+
+def run(window):
+    env = dict(os.environ, HOST=HOST, PORT=str(PORT),
+               METRICS_PORT=str(METRICS_PORT), DATABASE="",
+               RATE_LIMITS="off", BATCH_WINDOW=str(window))
+    server = subprocess.Popen([sys.executable, "run_server.py"], cwd=ROOT,
+                              env=env, stdout=subprocess.DEVNULL)
+
+    # Wait for the server to listen
+    for _ in range(100):
+        try:
+            socket.create_connection((HOST, PORT)).close()
+            break
+
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+
+    try:
+        with tempfile.NamedTemporaryFile("r", suffix=".json") as output:
+            # Counted from the start of the load, connecting included, so
+            # the joins and logins add the same calls to every window
+            calls = sendmsg_calls()
+            segments = tcp_segments()
+            start = time.monotonic()
+
+            subprocess.run([sys.executable,
+                            os.path.join(ROOT, "benchmarks", "loadgen.py")] +
+                           LOAD + ["--attach", str(server.pid),
+                                   "--port", str(PORT),
+                                   "--output", output.name],
+                           check=True, stdout=subprocess.DEVNULL)
+
+            elapsed = time.monotonic() - start
+            calls = sendmsg_calls() - calls
+            segments = tcp_segments() - segments
+            report = json.load(output)
+
+    finally:
+        server.terminate()
+        server.wait()
+
+    return (calls / elapsed, segments / elapsed,
+            report["messages"]["delivered_per_second"],
+            report["messages"]["latency_ms"],
+            report["server"]["cpu_percent"])
+
+
+def main():
+    windows = [float(arg) for arg in sys.argv[1:]] or [0, 2, 5, 10]
+
+    print(" ".join(LOAD))
+    print(f"{'window':>8} {'sendmsg/s':>10} {'segments/s':>11} " +
+          f"{'delivered/s':>12} {'p50':>8} {'p99':>8} {'max':>8} " +
+          f"{'cpu':>6}")
+
+    for window in windows:
+        calls, segments, delivered, latency, cpu = run(window)
+
+        print(f"{window:>6g}ms {calls:>10.0f} {segments:>11.0f} " +
+              f"{delivered:>12.0f} {latency['p50']:>6.1f}ms " +
+              f"{latency['p99']:>6.1f}ms {latency['max']:>6.1f}ms " +
+              f"{cpu:>5.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+#########################################
+# bench_bots.py                         #
+# Bot traffic over telnet vs JSON lines #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_bots.py [messages] [listeners]
+# Starts run_server.py, puts (default 10) listening bots in a room and has
+# one more bot send (default 20000) messages to it as fast as the server
+# takes them, once over the telnet port and once over the JSON lines port.
+# The sender keeps at most a few windows of messages ahead of the slowest
+# listener, so the server never has to drop any for a slow consumer.
+# Telnet listeners strip the "<= " and "=> " decoration and split the
+# "user: text" line like a bot scraping the text protocol has to, JSON
+# listeners call json.loads(). Client CPU is the CPU time of this process
+# per delivered message, server CPU is read from /proc.
+
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from loadgen import HOST  # noqa: E402
+
+PORT = 18151
+JSON_PORT = 18152
+
+# Messages written at once, and windows the sender may be ahead of the
+# slowest listener
+PIPELINE = 500
+WINDOWS = 4
+
+
+def server_cpu(pid):
+    # User and system time of a process in seconds
+    with open(f"/proc/{pid}/stat") as stat:
+        fields = stat.read().rsplit(")", 1)[1].split()
+
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+class TelnetBot():
+
+    port = PORT
+
+    def __init__(self, username):
+        self.username = username
+
+        # Messages of the sender read so far
+        self.received = 0
+
+    def line(self, text):
+        return text.encode('utf-8') + b"\r\n"
+
+    async def login(self, room):
+        self.reader, self.writer = await asyncio.open_connection(
+            HOST, self.port, limit=1 << 20)
+
+        self.writer.write(self.line(self.username) +
+                          self.line(f"/join {room}"))
+        await self.reader.readuntil(b"End list")
+        await self.reader.readline()
+
+    def chat(self, text):
+        return self.line(text)
+
+    def parse(self, line):
+        # "\r<= bob: hello\r", maybe behind a "=> " prompt
+        prompt, found, line = line.rstrip(b"\r").partition(b"<= ")
+
+        if not found or prompt.strip(b"\r=> ") != b"":
+            return None
+
+        sender, found, text = line.decode('utf-8').partition(": ")
+
+        return (sender, text) if found else None
+
+
+class JSONBot(TelnetBot):
+
+    port = JSON_PORT
+
+    def line(self, text):
+        return json.dumps({"type": "line", "text": text}).encode(
+            'utf-8') + b"\n"
+
+    def chat(self, text):
+        return json.dumps({"type": "chat", "text": text}).encode(
+            'utf-8') + b"\n"
+
+    def parse(self, line):
+        message = json.loads(line)
+
+        if message.get("type") != "chat":
+            return None
+
+        return (message["from"], message["text"])
+
+
+async def listen(bot, sender, count, progress):
+    # Read until every message of the sender has arrived
+    buffer = b""
+
+    while bot.received < count:
+        data = await bot.reader.read(65536)
+
+        if len(data) == 0:
+            raise ConnectionError("server closed the connection")
+
+        lines = (buffer + data).split(b"\n")
+        buffer = lines.pop()
+
+        for line in lines:
+            message = bot.parse(line)
+
+            if message is not None and message[0] == sender:
+                bot.received += 1
+
+        async with progress:
+            progress.notify_all()
+
+
+async def drain(bot):
+    # The sender's own copies of its messages
+    while len(await bot.reader.read(65536)) > 0:
+        pass
+
+
+async def run(bot_class, count, listeners, pid):
+    bots = [bot_class(f"bot{index}") for index in range(listeners)]
+    sender = bot_class("sender")
+
+    for bot in bots + [sender]:
+        await bot.login("chat")
+
+    draining = asyncio.ensure_future(drain(sender))
+
+    cpu = time.process_time()
+    before = server_cpu(pid)
+    start = time.monotonic()
+
+    progress = asyncio.Condition()
+    listening = asyncio.gather(*(listen(bot, "sender", count, progress)
+                                 for bot in bots))
+
+    for index in range(0, count, PIPELINE):
+        async with progress:
+            await progress.wait_for(lambda: min(
+                bot.received for bot in bots) >= index - WINDOWS * PIPELINE)
+
+        sender.writer.write(b"".join(sender.chat(f"message {number}")
+                                     for number in range(
+                                         index, min(index + PIPELINE,
+                                                    count))))
+        await sender.writer.drain()
+
+    await listening
+
+    elapsed = time.monotonic() - start
+    cpu = time.process_time() - cpu
+    used = server_cpu(pid) - before
+
+    draining.cancel()
+
+    for bot in bots + [sender]:
+        bot.writer.close()
+
+    delivered = count * listeners
+
+    return count / elapsed, cpu / delivered * 1e6, used / delivered * 1e6
+
+
+def main():
+    count, listeners = ([int(arg) for arg in sys.argv[1:3]] +
+                        [20000, 10][len(sys.argv[1:3]):])
+
+    env = dict(os.environ, HOST=HOST, PORT=str(PORT),
+               JSON_PORT=str(JSON_PORT), METRICS_PORT="0", DATABASE="",
+               RATE_LIMITS="off", LOG_LEVEL="off")
+    server = subprocess.Popen([sys.executable, "run_server.py"], cwd=ROOT,
+                              env=env, stdout=subprocess.DEVNULL)
+
+    time.sleep(1)
+
+    print(f"{count} messages to {listeners} listening bots")
+    print(f"{'protocol':>10} {'msg/s':>8} {'client CPU':>12} " +
+          f"{'server CPU':>12}")
+
+    try:
+        for name, bot_class in (("telnet", TelnetBot),
+                                ("json", JSONBot)):
+            rate, client_cpu, used = asyncio.run(
+                run(bot_class, count, listeners, server.pid))
+
+            print(f"{name:>10} {rate:>8.0f} {client_cpu:>9.2f}us " +
+                  f"{used:>9.2f}us")
+
+            # Let the server forget the bots before the next run
+            time.sleep(0.5)
+
+    finally:
+        server.kill()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
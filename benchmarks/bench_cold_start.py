@@ -0,0 +1,90 @@
+#########################################
+# bench_cold_start.py                   #
+# Startup time of the account store     #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_cold_start.py [accounts] [rooms]
+# Fills a temporary database (default: 1M accounts and 100k rooms with
+# two admins and a ban each), then times Store.load() and how long the
+# writer thread takes to commit a burst of queued password changes
+
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from server.log import Log  # noqa: E402
+from server.storage import Store  # noqa: E402
+
+# Password changes queued at once for the write-behind measurement
+BURST = 100000
+
+
+def fill(path, accounts, rooms):
+    Store(path, Log("off")).close()
+
+    connection = sqlite3.connect(path)
+
+    with connection:
+        connection.executemany(
+            "INSERT INTO accounts VALUES (?, ?)",
+            ((f"user{index}", f"password{index}")
+             for index in range(accounts)))
+        connection.executemany(
+            "INSERT INTO rooms VALUES (?, ?)",
+            ((f"room{index}", f"user{index}") for index in range(rooms)))
+        connection.executemany(
+            "INSERT INTO admins VALUES (?, ?)",
+            ((f"room{index}", f"user{index + offset}")
+             for index in range(rooms) for offset in (1, 2)))
+        connection.executemany(
+            "INSERT INTO bans VALUES (?, ?)",
+            ((f"room{index}", f"user{index + 3}") for index in range(rooms)))
+
+    connection.close()
+
+
+def main():
+    accounts, rooms = ([int(arg) for arg in sys.argv[1:3]] or
+                       [1000000, 100000])
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "chat.db")
+
+        start = time.perf_counter()
+        fill(path, accounts, rooms)
+        print(f"filled {accounts} accounts and {rooms} rooms in " +
+              f"{time.perf_counter() - start:.2f} s " +
+              f"({os.path.getsize(path) / 1e6:.0f} MB)")
+
+        start = time.perf_counter()
+        store = Store(path, Log("off"))
+        loaded_rooms = {}
+        passwords = store.load(loaded_rooms)
+        elapsed = time.perf_counter() - start
+
+        print(f"cold start: loaded {len(passwords)} accounts and " +
+              f"{len(loaded_rooms)} rooms in {elapsed:.2f} s")
+
+        # The event loop only pays for the queue
+        start = time.perf_counter()
+
+        for index in range(BURST):
+            store.save_password(f"user{index}", f"changed{index}")
+
+        queued = time.perf_counter() - start
+
+        store.close()
+        committed = time.perf_counter() - start
+
+        print(f"write-behind: {BURST} changes queued in " +
+              f"{queued * 1000:.0f} ms, committed in {committed:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
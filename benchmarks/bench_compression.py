@@ -0,0 +1,167 @@
+#########################################
+# bench_compression.py                  #
+# Bandwidth and CPU of compression      #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_compression.py [members]
+# Puts (default 1000) telnet clients connected over loopback in one busy
+# room and has a few of them send 500 chat messages, first one per event
+# loop iteration, then 10 and 50 per iteration like a room that batches
+# (about 450 and 2200 bytes per write). Every member's output is sent as
+# it is ("off"), through its own compressor only ("per client"), or with
+# writes of 512 bytes or more, like the room's bigger batches, compressed
+# once for every member ("shared"). Reports the bytes sent per message
+# delivered and the server's CPU time per message distributed, which
+# includes the sendmsg() calls.
+
+import os
+import random
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from room import Room  # noqa: E402
+from server import Server  # noqa: E402
+from server.compression import COMPRESSION_SHARED  # noqa: E402
+from server.log import Log  # noqa: E402
+
+MESSAGES = 500
+
+# Clients that take turns sending
+SENDERS = 5
+
+WORDS = ["hello", "anyone", "around", "tonight", "the", "server", "is",
+         "fast", "what", "about", "you", "ok", "lol", "see", "later",
+         "raid", "starts", "at", "nine", "bring", "potions"]
+
+
+def build(count):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(count)
+
+    room = Room("chat", None)
+    chat_server = Server(listener, {"chat": room})
+    chat_server.logger = Log("off")
+
+    # No event loop runs timers here, batches are flushed by hand
+    chat_server.login_timeout = 0
+    chat_server.idle_timeout = 0
+
+    peers = []
+    members = []
+
+    for index in range(count + SENDERS):
+        peer = socket.create_connection(listener.getsockname())
+        member = chat_server.admit(*listener.accept())
+        chat_server.process(f"user{index}", member)
+
+        room.users[member] = None
+        member.room = room
+        member.line_mode = True
+
+        peers.append(peer)
+        members.append(member)
+
+    chat_server.flush_pending()
+
+    # The senders only send
+    for sender in members[:SENDERS]:
+        sender.closing = True
+
+    return chat_server, room, peers[SENDERS:], members[:SENDERS]
+
+
+def drain(peers):
+    # Keep the members' receive buffers from filling up
+    for peer in peers:
+        peer.setblocking(False)
+
+        try:
+            while peer.recv(65536):
+                pass
+
+        except BlockingIOError:
+            pass
+
+
+def measure(chat_server, room, peers, senders, per_write):
+    random.seed(per_write)
+    texts = [" ".join(random.choices(WORDS, k=random.randint(2, 10)))
+             for _ in range(MESSAGES)]
+
+    drain(peers)
+
+    sent = chat_server.metrics.bytes_out
+    cpu = 0
+
+    for message in range(0, MESSAGES, per_write):
+        start = time.process_time()
+
+        for index in range(message, message + per_write):
+            chat_server.distribute(texts[index], ["chat"],
+                                   senders[index % SENDERS])
+
+        chat_server.flush_batch(room)
+        chat_server.flush_pending()
+
+        cpu += time.process_time() - start
+
+        # Between loop iterations the members read what they were sent
+        drain(peers)
+
+    return chat_server.metrics.bytes_out - sent, cpu
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    chat_server, room, peers, senders = build(count)
+    members = [client for client in chat_server.clients.values()
+               if client not in senders]
+
+    deliveries = MESSAGES * count
+
+    print(f"{count} members, {MESSAGES} messages")
+    print(f"{'compression':>12} {'batch':>6} {'bytes/msg':>10} " +
+          f"{'ratio':>6} {'CPU/msg':>9}")
+
+    for per_write in (1, 10, 50):
+        room.batch_window = 0.001 if per_write > 1 else 0
+        plain = None
+
+        for name, shared in (("off", None), ("per client", 1 << 30),
+                             ("shared", COMPRESSION_SHARED)):
+            for member in members:
+                if shared is None:
+                    chat_server.end_compression(member)
+
+                else:
+                    chat_server.start_compression(member)
+
+            chat_server.compression_shared = shared or COMPRESSION_SHARED
+
+            # Send the start and end of the streams before measuring
+            chat_server.flush_pending()
+            drain(peers)
+
+            sent, cpu = measure(chat_server, room, peers, senders,
+                                per_write)
+
+            if plain is None:
+                plain = sent
+
+            print(f"{name:>12} {per_write:>6} {sent / deliveries:>10.1f} " +
+                  f"{sent / plain:>6.2f} " +
+                  f"{cpu / MESSAGES * 1000:>7.2f}ms")
+
+            for member in members:
+                chat_server.end_compression(member)
+
+
+if __name__ == "__main__":
+    main()
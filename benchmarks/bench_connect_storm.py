@@ -0,0 +1,144 @@
+#########################################
+# bench_connect_storm.py                #
+# Connect storms vs a slow stdout       #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_connect_storm.py [connections] [bytes/s]
+# Starts run_server.py with its stdout piped to a reader that drains it
+# slowly (default 100 KB/s, like a busy journald), opens a storm of
+# connections at once (default 3000), has each one pick a username and
+# times how long it takes to be welcomed. Runs with logging off, with the
+# log queue, with the log queue sampling connects and disconnects, and
+# with the print() calls the server used before the queue. "read" is the
+# log bytes that got through the pipe during the run.
+
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from loadgen import HOST, Member, Stats, percentiles  # noqa: E402
+
+PORT = 18141
+
+# Connections opened at once
+IN_FLIGHT = 500
+
+# Runs the server with print() in place of the log queue
+LEGACY = """
+import runpy
+import sys
+
+from server import Server
+
+
+def legacy_log(self, level, event, client=None, **fields):
+    # The synchronous print() calls before the log queue
+    if client is not None:
+        print(f"\\n{event} {client.address} {client.username} {fields}\\n")
+
+    else:
+        print(f"\\n{event} {fields}\\n")
+
+
+Server.log = legacy_log
+
+runpy.run_path("run_server.py", run_name="__main__")
+"""
+
+
+def drain(pipe, rate, total):
+    # Read the server's stdout at a fixed rate
+    chunk = 4096
+
+    while True:
+        data = os.read(pipe.fileno(), chunk)
+
+        if len(data) == 0:
+            return
+
+        total[0] += len(data)
+
+        time.sleep(len(data) / rate)
+
+
+async def storm(count):
+    stats = Stats()
+    members = [Member(f"storm{index}", stats) for index in range(count)]
+    gate = asyncio.Semaphore(IN_FLIGHT)
+
+    async def connect(member):
+        async with gate:
+            try:
+                await member.connect(PORT)
+
+            except (ConnectionError, asyncio.IncompleteReadError):
+                stats.errors += 1
+
+            member.close()
+
+    start = time.monotonic()
+    await asyncio.gather(*(connect(member) for member in members))
+    elapsed = time.monotonic() - start
+
+    return stats, elapsed
+
+
+def run(count, rate, command, env):
+    env = dict(os.environ, HOST=HOST, PORT=str(PORT), METRICS_PORT="0",
+               DATABASE="", RATE_LIMITS="off", **env)
+    server = subprocess.Popen(command, cwd=ROOT, env=env,
+                              stdout=subprocess.PIPE)
+
+    written = [0]
+    reader = threading.Thread(target=drain,
+                              args=(server.stdout, rate, written),
+                              daemon=True)
+    reader.start()
+
+    time.sleep(1)
+
+    try:
+        stats, elapsed = asyncio.run(storm(count))
+
+    finally:
+        server.kill()
+        server.wait()
+
+    return stats, elapsed, written[0]
+
+
+def main():
+    count, rate = ([int(arg) for arg in sys.argv[1:3]] +
+                   [3000, 100000][len(sys.argv[1:3]):])
+
+    print(f"{count} connections, stdout drained at {rate / 1000:g} KB/s")
+    print(f"{'logging':>16} {'conn/s':>8} {'p50':>9} {'p99':>9} " +
+          f"{'max':>9} {'errors':>7} {'read':>10}")
+
+    script = [sys.executable, "run_server.py"]
+
+    for name, command, env in (
+            ("off", script, {"LOG_LEVEL": "off"}),
+            ("queue", script, {}),
+            ("queue, 1 in 10", script,
+             {"LOG_SAMPLING": "connect=10,username=10,disconnect=10"}),
+            ("print()", [sys.executable, "-c", LEGACY], {})):
+        stats, elapsed, written = run(count, rate, command, env)
+        latency = percentiles(stats.connect_latency)
+
+        print(f"{name:>16} {stats.connections / elapsed:>8.0f} " +
+              f"{latency.get('p50', 0):>7.1f}ms " +
+              f"{latency.get('p99', 0):>7.1f}ms " +
+              f"{latency.get('max', 0):>7.1f}ms {stats.errors:>7} " +
+              f"{written:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#########################################
+# bench_fanout.py                       #
+# Broadcast messages/sec vs room size   #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_fanout.py [room sizes...]
+# Times distribute() alone with sockets that accept everything,
+# queues are flushed between messages outside of the timing
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from common import NullSocket  # noqa: E402
+from room import Room  # noqa: E402
+from server import Server  # noqa: E402
+from server.log import Log  # noqa: E402
+
+SECONDS = 1.0
+
+
+def legacy_distribute(self, data, rooms, client=None, except_users=[]):
+    # The fan-out before encoding once, one tag and encode per user
+    data = data.strip()
+
+    for room in rooms:
+        for user in self.rooms[room].users:
+            if client is not None:
+                if user not in except_users:
+                    send_user = client.username
+
+                    if client.username == self.rooms[room].owner:
+                        send_user += " (owner)"
+
+                    if client.username in self.rooms[room].admins:
+                        send_user += " (admin)"
+
+                    self.send(f"{send_user}: {data}", user)
+
+            else:
+                if user not in except_users:
+                    self.send(data, user)
+
+    return True
+
+
+def messages_per_second(size):
+    chat_server = Server(NullSocket(0), {"chat": Room("chat", None)},
+                         use_selector=False)
+    chat_server.logger = Log("off")
+
+    # No event loop runs timers here
+    chat_server.login_timeout = 0
+    chat_server.idle_timeout = 0
+
+    for index in range(size):
+        client = chat_server.initialize_client(NullSocket(index + 1))
+        chat_server.process(f"user{index}", client)
+        chat_server.process("/join chat", client)
+        chat_server.flush_pending()
+
+    sender = chat_server.usernames["user0"]
+    messages = 0
+    elapsed = 0
+
+    while elapsed < SECONDS:
+        start = time.perf_counter()
+        chat_server.distribute("a typical chat message of some length",
+                               ["chat"], sender)
+        elapsed += time.perf_counter() - start
+
+        chat_server.flush_pending()
+
+        messages += 1
+
+    return messages / elapsed
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10, 100, 1000, 5000]
+    encode_once = Server.distribute
+    results = []
+
+    # Keep the connection messages out of the table
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+
+    for size in sizes:
+        Server.distribute = legacy_distribute
+        before = messages_per_second(size)
+
+        Server.distribute = encode_once
+        after = messages_per_second(size)
+
+        results.append((size, before, after))
+
+    sys.stdout = stdout
+
+    print(f"{'room size':>10} {'before msg/s':>14} {'after msg/s':>14}")
+
+    for size, before, after in results:
+        print(f"{size:>10} {before:>14.0f} {after:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
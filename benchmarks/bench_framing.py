@@ -0,0 +1,102 @@
+#########################################
+# bench_framing.py                      #
+# Line framing throughput of receive()  #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_framing.py [megabytes]
+# Feeds a stream of chat lines to Server.receive() in reads of several
+# sizes and reports how fast it is split into decoded lines
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from server import Server  # noqa: E402
+from server.log import Log  # noqa: E402
+from server.messaging import SOCKET_BUFFER  # noqa: E402
+
+LINE = "a typical chat message, with an accent or two: café, naïve\r\n"
+
+
+class StreamSocket():
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.position = 0
+
+    def getsockname(self):
+        return ("127.0.0.1", 0)
+
+    def getpeername(self):
+        return ("127.0.0.1", 0)
+
+    def setblocking(self, flag):
+        pass
+
+    def recv(self, size):
+        data = self.data[self.position:self.position + size]
+        self.position += len(data)
+
+        return bytes(data)
+
+    def recv_into(self, buffer):
+        data = self.data[self.position:self.position + len(buffer)]
+        buffer[:len(data)] = data
+        self.position += len(data)
+
+        return len(data)
+
+    def sendmsg(self, buffers):
+        return sum(map(len, buffers))
+
+    def close(self):
+        pass
+
+
+def megabytes_per_second(data, size):
+    chat_server = Server(StreamSocket(b""), use_selector=False)
+    chat_server.logger = Log("off")
+
+    # No event loop runs timers here
+    chat_server.login_timeout = 0
+    chat_server.idle_timeout = 0
+
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    client = chat_server.initialize_client(StreamSocket(data))
+    sys.stdout = stdout
+
+    chat_server.receive_view = chat_server.receive_view[:size]
+    reads = len(data) // size
+    lines = 0
+
+    start = time.perf_counter()
+
+    for _ in range(reads):
+        lines += len(chat_server.receive(client))
+
+    elapsed = time.perf_counter() - start
+
+    return reads * size / elapsed / 1e6, lines / elapsed
+
+
+def main():
+    megabytes = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    line = LINE.encode('utf-8')
+    data = line * (megabytes * 1000000 // len(line))
+
+    print(f"{megabytes} MB of {len(line)} byte lines")
+    print(f"{'read size':>10} {'MB/s':>8} {'lines/s':>12}")
+
+    for size in (64, 512, SOCKET_BUFFER):
+        rate, lines = megabytes_per_second(data, size)
+
+        print(f"{size:>10} {rate:>8.1f} {lines:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
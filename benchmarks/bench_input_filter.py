@@ -0,0 +1,161 @@
+#########################################
+# bench_input_filter.py                 #
+# Throughput of the telnet input filter #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_input_filter.py [megabytes]
+# Feeds (default 4) MB of input through filter_input() in 4096 byte
+# reads, and 64 KB of it one byte per read like a client in character
+# mode, and reports MB/s. "copy" only appends the reads to a buffer, the
+# least any receive can do. "per byte" steps through every byte in
+# Python. "replace" decodes each read and calls str.replace() with every
+# sequence of the old ILLEGAL_CHARS list, which misses telnet commands
+# and sequences split across reads and does not apply backspaces.
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from server.telnet import DATA, SPECIAL, filter_input  # noqa: E402
+
+# The list in messaging.py before the filter
+ILLEGAL_CHARS = ['\x08', '\x1b[A', '\x1b[B', '\x1b[C', '\x1b[D', '\x1bOP',
+                 '\x1bOQ', '\x1bOR', '\x1bOS', '\x1b[15~', '\x1b[17~',
+                 '\x1b[18~', '\x1b[19~', '\x1b[20~', '\x1b[21~', '\x1b[23~',
+                 '\x1b[24~]', '\x1b[2~', '\x1b[1~', '\x1b[5~', '\x7f',
+                 '\x1b[4~', '\x1b[6~', '\x1b[P']
+
+WORDS = ["hello", "anyone", "around", "tonight", "the", "server", "is",
+         "fast", "what", "about", "you", "ok", "lol", "see", "later"]
+
+
+def make_input(kind, size):
+    random.seed(kind)
+    lines = []
+    total = 0
+
+    while total < size:
+        words = random.choices(WORDS, k=random.randint(3, 12))
+
+        if kind == "utf-8":
+            words = [word + "、おはよう" for word in words]
+
+        line = " ".join(words)
+
+        # Arrow keys to fix a typo and backspaces over it
+        if kind == "keys":
+            line = (line[:8] + "\x1b[D\x1b[C" + line[8:16] + "xx\x7f\x7f" +
+                    line[16:] + "\x1b[A")
+
+        data = line.encode('utf-8') + b"\r\n"
+
+        # Option negotiation and a window size report before the line
+        if kind == "telnet":
+            data = (b"\xff\xfb\x1f\xff\xfa\x1f\x00\x50\x00\x18\xff\xf0" +
+                    b"\xff\xfd\x01" + data)
+
+        lines.append(data)
+        total += len(data)
+
+    return b"".join(lines)
+
+
+def copy(reads):
+    line = bytearray()
+
+    for data in reads:
+        line += data
+
+        # Lines are taken out by receive()
+        if len(line) > 65536:
+            line.clear()
+
+
+def filtered(reads):
+    line = bytearray()
+    state = DATA
+
+    for data in reads:
+        state = filter_input(data, line, state)
+
+        if len(line) > 65536:
+            line.clear()
+
+
+def per_byte(reads):
+    line = bytearray()
+    state = DATA
+
+    for data in reads:
+        for index in range(len(data)):
+            byte = data[index]
+
+            # Ordinary bytes are appended one at a time, the rest go
+            # through the state machine
+            if state == DATA and byte not in SPECIAL:
+                line.append(byte)
+
+            else:
+                state = filter_input(data[index:index + 1], line, state)
+
+        if len(line) > 65536:
+            line.clear()
+
+
+def replace(reads):
+    line = bytearray()
+
+    for data in reads:
+        text = data.decode('utf-8', 'replace')
+
+        for sequence in ILLEGAL_CHARS:
+            text = text.replace(sequence, "")
+
+        line += text.encode('utf-8')
+
+        if len(line) > 65536:
+            line.clear()
+
+
+def timed(function, reads, size):
+    start = time.perf_counter()
+    function(reads)
+
+    return size / (time.perf_counter() - start) / 1e6
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 4
+    size = int(megabytes * 1e6)
+
+    functions = (("copy", copy), ("filter", filtered),
+                 ("per byte", per_byte), ("replace", replace))
+
+    print(f"MB/s, {megabytes:g} MB in 4096 byte reads and 64 KB in one " +
+          "byte reads")
+    print(f"{'input':>8} {'read':>6} " +
+          " ".join(f"{name:>9}" for name, function in functions))
+
+    for kind in ("chat", "utf-8", "keys", "telnet"):
+        data = make_input(kind, size)
+        chunked = [data[index:index + 4096]
+                   for index in range(0, len(data), 4096)]
+
+        bytewise = [data[index:index + 1] for index in range(65536)]
+
+        for read, reads, total in (("4096", chunked, len(data)),
+                                   ("1", bytewise, len(bytewise))):
+            results = [timed(function, reads, total)
+                       for name, function in functions]
+
+            print(f"{kind:>8} {read:>6} " +
+                  " ".join(f"{result:>9.1f}" for result in results))
+
+
+if __name__ == "__main__":
+    main()
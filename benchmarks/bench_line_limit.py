@@ -0,0 +1,127 @@
+#########################################
+# bench_line_limit.py                   #
+# Unfinished lines held in memory       #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_line_limit.py [clients]
+# Connects (default 100) telnet clients over loopback that each send 1 MB
+# of one line without a newline, in 4 KB writes, and then a newline. The
+# server reads everything with receive(), once with no line limit and
+# once with LINE_LIMIT. Reports the most bytes of unfinished lines held
+# for all the clients together and the server's CPU time per MB read.
+
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from server import Server  # noqa: E402
+from server.log import Log  # noqa: E402
+from server.memory import LINE_LIMIT  # noqa: E402
+
+LINE = 1024 * 1024
+
+CHUNK = b"x" * 4096
+
+
+def build(count):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(count)
+
+    chat_server = Server(listener, {})
+    chat_server.logger = Log("off")
+
+    # No event loop runs timers here
+    chat_server.login_timeout = 0
+    chat_server.idle_timeout = 0
+    chat_server.memory_budget = 0
+
+    peers = []
+    clients = []
+
+    for index in range(count):
+        peer = socket.create_connection(listener.getsockname())
+        client = chat_server.admit(*listener.accept())
+        chat_server.process(f"user{index}", client)
+
+        peers.append(peer)
+        clients.append(client)
+
+    chat_server.flush_pending()
+
+    for client in clients:
+        client.socket.setblocking(False)
+
+    return chat_server, peers, clients
+
+
+def drain(peers):
+    # Throw away what the server sent back
+    for peer in peers:
+        peer.setblocking(False)
+
+        try:
+            while peer.recv(65536):
+                pass
+
+        except BlockingIOError:
+            pass
+
+
+def measure(chat_server, peers, clients):
+    held = 0
+    cpu = 0
+
+    for sent in range(0, LINE, len(CHUNK)):
+        for peer in peers:
+            peer.sendall(CHUNK)
+
+        start = time.process_time()
+
+        for client in clients:
+            chat_server.receive(client)
+
+        cpu += time.process_time() - start
+
+        held = max(held, sum(len(client.received) for client in clients))
+
+    for peer in peers:
+        peer.sendall(b"\n")
+
+    start = time.process_time()
+
+    for client in clients:
+        chat_server.receive(client)
+
+    cpu += time.process_time() - start
+
+    chat_server.flush_pending()
+    drain(peers)
+
+    return held, cpu
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+    chat_server, peers, clients = build(count)
+    read = count * LINE / (1024 * 1024)
+
+    print(f"{count} clients, {LINE // 1024} KB lines")
+    print(f"{'limit':>10} {'most held':>12} {'CPU/MB':>9}")
+
+    for name, limit in (("none", 1 << 62), ("LINE_LIMIT", LINE_LIMIT)):
+        chat_server.line_limit = limit
+
+        held, cpu = measure(chat_server, peers, clients)
+
+        print(f"{name:>10} {held:>12} {cpu / read * 1000:>7.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#########################################
+# bench_line_mode.py                    #
+# Bytes and packets of line mode        #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_line_mode.py [members]
+# Puts (default 1000) telnet clients connected over loopback in one room
+# and has one of them send 200 messages, one per event loop iteration,
+# then 200 more in a room that batches 10 messages per write. The bytes
+# and packets sent to the members are compared between clients in
+# character mode, which get every message behind a carriage return and
+# the prompt re-printed after it, and clients in line mode, which edit
+# lines themselves and get neither. Packets are the TCP segments the
+# server's end of each connection sent, read with TCP_INFO.
+
+import os
+import socket
+import struct
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from room import Room  # noqa: E402
+from server import Server  # noqa: E402
+from server.log import Log  # noqa: E402
+
+MESSAGES = 200
+
+# Messages per write in the batched room
+BATCHED = 10
+
+TEXT = "anyone around tonight?"
+
+# Where tcpi_segs_out is in struct tcp_info on Linux
+SEGS_OUT = 136
+
+
+def segments(members):
+    # TCP segments sent to every member
+    return sum(struct.unpack_from("I", member.socket.getsockopt(
+        socket.IPPROTO_TCP, socket.TCP_INFO, 256), SEGS_OUT)[0]
+        for member in members)
+
+
+def build(count):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(count)
+
+    room = Room("chat", None)
+    chat_server = Server(listener, {"chat": room})
+    chat_server.logger = Log("off")
+
+    # No event loop runs timers here, batches are flushed by hand
+    chat_server.login_timeout = 0
+    chat_server.idle_timeout = 0
+
+    peers = []
+    members = []
+
+    for index in range(count + 1):
+        peer = socket.create_connection(listener.getsockname())
+        member = chat_server.admit(*listener.accept())
+        chat_server.process(f"user{index}", member)
+
+        room.users[member] = None
+        member.room = room
+
+        peers.append(peer)
+        members.append(member)
+
+    chat_server.flush_pending()
+
+    # The first client only sends
+    return chat_server, room, peers[1:], members[0], members[1:]
+
+
+def drain(peers):
+    # Keep the members' receive buffers from filling up
+    for peer in peers:
+        peer.setblocking(False)
+
+        try:
+            while peer.recv(65536):
+                pass
+
+        except BlockingIOError:
+            pass
+
+
+def measure(chat_server, room, peers, sender, members, per_write):
+    drain(peers)
+
+    sent = chat_server.metrics.bytes_out
+    packets = segments(members)
+
+    for message in range(0, MESSAGES, per_write):
+        for _ in range(per_write):
+            chat_server.distribute(TEXT, ["chat"], sender)
+
+        chat_server.flush_batch(room)
+        chat_server.flush_pending()
+
+        # Between loop iterations the members read what they were sent
+        if message % 20 == 0:
+            drain(peers)
+
+    packets = segments(members) - packets
+    sent = chat_server.metrics.bytes_out - sent
+
+    drain(peers)
+
+    return sent, packets
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    chat_server, room, peers, sender, members = build(count)
+
+    # Keep the sender's own copies out of the count
+    sender.closing = True
+
+    deliveries = MESSAGES * count
+
+    print(f"{count} members, {MESSAGES} messages of {len(TEXT)} " +
+          "characters")
+    print(f"{'mode':>10} {'batch':>6} {'bytes':>10} {'per msg':>8} " +
+          f"{'packets':>8} {'per member':>11}")
+
+    for per_write in (1, BATCHED):
+        room.batch_window = 0.001 if per_write > 1 else 0
+        results = {}
+
+        for mode, line_mode in (("character", False), ("line", True)):
+            for member in members:
+                member.line_mode = line_mode
+
+            sent, packets = measure(chat_server, room, peers, sender,
+                                    members, per_write)
+            results[mode] = sent
+
+            print(f"{mode:>10} {per_write:>6} {sent:>10} " +
+                  f"{sent / deliveries:>8.1f} {packets:>8} " +
+                  f"{packets / count:>11.1f}")
+
+        saved = 1 - results["line"] / results["character"]
+
+        print(f"{'':>10} {'':>6} {saved:>10.1%} fewer bytes in line mode")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#########################################
+# bench_listings.py                     #
+# /rooms with many rooms                #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_listings.py [rooms]
+# Creates (default 10000) rooms with a user in each and times /rooms
+# through the server, counting the writes queued for the client and the
+# bytes they hold. "legacy" is /rooms before it was paginated, sending
+# every room as its own line. "cached" asks again with nothing changed,
+# "churn" has someone join or leave a room before every /rooms, so the
+# directory is rebuilt each time.
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from common import NullSocket  # noqa: E402
+from room import Room  # noqa: E402
+from server import Server  # noqa: E402
+from server.commands import show_rooms  # noqa: E402
+from server.log import Log  # noqa: E402
+
+CALLS = 200
+
+
+def legacy_rooms(self, args, client):
+    # /rooms before the directory was cached and paginated
+    self.send("Available rooms:", client)
+
+    for room in self.rooms:
+        room_str = f" * {room} ({len(self.rooms[room].users)})"
+        room = self.rooms[room]
+
+        if client.username in room.admins:
+            room_str += " (admin)"
+
+        if client.username == room.owner:
+            room_str += " (owner)"
+
+        if client.room == room:
+            room_str += " (current)"
+
+        if client.username in room.banned:
+            room_str += " (banned)"
+
+        self.send(room_str, client)
+
+    self.send("End list", client)
+
+    return True
+
+
+def build(count):
+    rooms = {f"room{index}": Room(f"room{index}", None)
+             for index in range(count)}
+    chat_server = Server(NullSocket(0), rooms, use_selector=False)
+    chat_server.logger = Log("off")
+
+    # No event loop runs timers here
+    chat_server.login_timeout = 0
+    chat_server.idle_timeout = 0
+
+    asker = chat_server.initialize_client(NullSocket(1))
+    chat_server.process("asker", asker)
+
+    for index, room in enumerate(rooms.values()):
+        member = chat_server.initialize_client(NullSocket(index + 2))
+        chat_server.process(f"user{index}", member)
+
+        room.users[member] = None
+        member.room = room
+
+    # Someone who keeps joining and leaving the first room
+    churner = chat_server.initialize_client(NullSocket(count + 2))
+    chat_server.process("churner", churner)
+
+    chat_server.flush_pending()
+
+    return chat_server, asker, churner
+
+
+def measure(chat_server, asker, churner, handler, churn):
+    writes = 0
+    size = 0
+
+    start = time.perf_counter()
+
+    for call in range(CALLS):
+        if churn:
+            if churner.room is None:
+                chat_server.command("/join room0", churner)
+
+            else:
+                chat_server.command("/leave", churner)
+
+        # Only count what the asker was sent
+        asker.outbound.clear()
+        asker.outbound_size = 0
+
+        handler(chat_server, [], asker)
+
+        writes += len(asker.outbound)
+        size += asker.outbound_size
+
+    elapsed = time.perf_counter() - start
+
+    chat_server.flush_pending()
+
+    return elapsed / CALLS * 1000, writes / CALLS, size / CALLS
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    chat_server, asker, churner = build(count)
+
+    # Keep the whole listing in the queue
+    chat_server.high_water = 1 << 30
+
+    print(f"/rooms with {count} rooms, {CALLS} calls")
+    print(f"{'':>8} {'per call':>10} {'writes':>8} {'bytes':>9}")
+
+    for name, handler, churn in (("legacy", legacy_rooms, False),
+                                 ("cached", show_rooms, False),
+                                 ("churn", show_rooms, True)):
+        elapsed, writes, size = measure(chat_server, asker, churner,
+                                        handler, churn)
+
+        print(f"{name:>8} {elapsed:>8.3f}ms {writes:>8.0f} {size:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
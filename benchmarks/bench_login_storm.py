@@ -0,0 +1,173 @@
+#########################################
+# bench_login_storm.py                  #
+# Chat latency during a login storm     #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_login_storm.py [logins/s] [seconds] [cost]
+# Starts run_server.py with a database of accounts, keeps two rooms of
+# ten members chatting and measures their message latency while new
+# connections log in with a password at the given rate (default 2000/s
+# for 5 s at HASH_COST 14). Runs once hashing on the event loop
+# (HASH_WORKERS=0) and once on the hashing threads.
+
+import asyncio
+import collections
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from loadgen import HOST, Member, Stats, percentiles  # noqa: E402
+from server.hashing import HASH_WORKERS, hash_password  # noqa: E402
+from server.log import Log  # noqa: E402
+from server.storage import Store  # noqa: E402
+
+PORT = 18121
+ROOMS = ("chat", "hottub")
+MEMBERS = 10
+RATE = 2.0
+
+# Logins waiting for an answer before new ones are skipped
+IN_FLIGHT = 500
+
+
+def make_database(path, accounts, cost):
+    Store(path, Log("off")).close()
+
+    # Every account shares one hash, hashing each would take minutes
+    hashed = hash_password("password", cost)
+
+    connection = sqlite3.connect(path)
+
+    with connection:
+        connection.executemany("INSERT INTO accounts VALUES (?, ?)",
+                               ((f"storm{index}", hashed)
+                                for index in range(accounts)))
+
+    connection.close()
+
+
+async def log_in(index, stats, latencies):
+    start = time.monotonic_ns()
+
+    try:
+        reader, writer = await asyncio.open_connection(HOST, PORT)
+
+        writer.write(f"storm{index}\r\npassword\r\n".encode('utf-8'))
+        await reader.readuntil(b"Welcome back")
+
+        latencies[(time.monotonic_ns() - start) // 1000] += 1
+        writer.close()
+
+    except (ConnectionError, asyncio.IncompleteReadError):
+        stats.errors += 1
+
+
+async def storm(rate, seconds, stats, latencies):
+    tasks = set()
+    start = time.monotonic()
+    skipped = 0
+
+    for index in range(int(rate * seconds)):
+        await asyncio.sleep(max(0, start + index / rate - time.monotonic()))
+
+        if len(tasks) >= IN_FLIGHT:
+            skipped += 1
+
+            continue
+
+        task = asyncio.ensure_future(log_in(index, stats, latencies))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    await asyncio.gather(*tasks)
+
+    return skipped
+
+
+async def run(rate, seconds):
+    stats = Stats()
+    members = []
+
+    for room in ROOMS:
+        for index in range(MEMBERS):
+            member = Member(f"{room}{index}", stats)
+            await member.connect(PORT)
+            await member.join(room)
+            members.append(member)
+
+    listeners = [asyncio.ensure_future(member.listen())
+                 for member in members]
+
+    deadline = time.monotonic() + seconds
+    talkers = [member.talk(RATE, 0, deadline, random.Random(index))
+               for index, member in enumerate(members)]
+
+    login_latency = collections.Counter()
+
+    start = time.monotonic()
+    results = await asyncio.gather(storm(rate, seconds, stats,
+                                         login_latency), *talkers)
+    elapsed = time.monotonic() - start
+
+    await asyncio.sleep(0.5)
+
+    for listener in listeners:
+        listener.cancel()
+
+    for member in members:
+        member.close()
+
+    logins = sum(login_latency.values())
+
+    return (percentiles(stats.message_latency), logins / elapsed,
+            results[0], percentiles(login_latency))
+
+
+def main():
+    rate, seconds, cost = ([float(arg) for arg in sys.argv[1:4]] +
+                           [2000, 5, 14][len(sys.argv[1:4]):])
+
+    print(f"{rate:.0f} logins/s for {seconds:.0f} s at HASH_COST " +
+          f"{cost:.0f}, {len(ROOMS)} rooms of {MEMBERS} chatting")
+    print(f"{'hashing':>16} {'chat p50':>9} {'chat p99':>9} " +
+          f"{'logins/s':>9} {'skipped':>8} {'login p99':>10}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "chat.db")
+        make_database(path, int(rate * seconds), int(cost))
+
+        for name, workers, storm_rate in (
+                ("no storm", HASH_WORKERS, 0.001),
+                ("event loop", 0, rate),
+                (f"{HASH_WORKERS} threads", HASH_WORKERS, rate)):
+            env = dict(os.environ, HOST=HOST, PORT=str(PORT),
+                       METRICS_PORT="0", DATABASE=path, RATE_LIMITS="off",
+                       HASH_COST=str(int(cost)), HASH_WORKERS=str(workers))
+            server = subprocess.Popen([sys.executable, "run_server.py"],
+                                      cwd=ROOT, env=env,
+                                      stdout=subprocess.DEVNULL)
+            time.sleep(1)
+
+            try:
+                chat, logins, skipped, login = asyncio.run(
+                    run(storm_rate, seconds))
+
+            finally:
+                server.terminate()
+                server.wait()
+
+            print(f"{name:>16} {chat['p50']:>7.1f}ms " +
+                  f"{chat['p99']:>7.1f}ms {logins:>9.0f} {skipped:>8} " +
+                  f"{login.get('p99', 0):>8.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
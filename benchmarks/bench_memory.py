@@ -0,0 +1,174 @@
+#########################################
+# bench_memory.py                       #
+# Bytes per idle connection             #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_memory.py [connections]
+# Connects (default 100000) clients that log in with a username and then
+# sit idle, and measures the Python memory they hold with tracemalloc,
+# once with the old Client (a __dict__, an address formatted from two
+# getsockname() calls and a deque for held input made up front) and once
+# with the current one. Sockets are stand-ins with no file descriptor,
+# so neither the socket objects nor the kernel's socket buffers and epoll
+# entries are counted, they are the same for both.
+
+import collections
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import client  # noqa: E402
+import server.messaging  # noqa: E402
+from common import NullSocket  # noqa: E402
+from server import Server  # noqa: E402
+from server.log import Log  # noqa: E402
+
+
+# What the allocations of each file are for
+GROUPS = {"client.py": "client and buffers",
+          "bench_memory.py": "client and buffers",
+          "ratelimit.py": "token buckets",
+          "messaging.py": "server tables",
+          "outbound.py": "server tables"}
+
+
+class LegacyClient():
+    # The Client before __slots__, with the attributes it has today
+
+    def __init__(self, client_socket):
+        self.socket = client_socket
+
+        self.address = (f"{client_socket.getsockname()[0]}:" +
+                        f"{client_socket.getsockname()[1]}")
+
+        self.username = None
+        self.room = None
+        self.received = bytearray()
+        self.overlong = False
+        self.input_state = 0
+        self.commands = None
+        self.line_mode = None
+        self.window = None
+        self.options = None
+        self.outbound = collections.deque()
+        self.outbound_size = 0
+        self.outbound_sent = 0
+        self.outbound_compressed = 0
+        self.compressing = False
+        self.compressor = None
+        self.adler = 1
+        self.slow = False
+        self.blocked = False
+        self.needs_prompt = False
+        self.closing = False
+        self.logging_in = False
+        self.parked = False
+        self.held = collections.deque()
+        self.buckets = {}
+        self.user_buckets = self.buckets
+        self.throttled = False
+        self.active = 0.0
+        self.probed = 0
+        self.deadline = None
+        self.json = False
+        self.setting_password = 0
+
+    typing = client.Client.typing
+
+
+def measure(count):
+    chat_server = Server(NullSocket(0), use_selector=False)
+    chat_server.logger = Log("off")
+
+    # No event loop runs timers here
+    chat_server.login_timeout = 0
+    chat_server.idle_timeout = 0
+
+    sockets = [NullSocket(port) for port in range(count)]
+
+    # Keep the connection messages out of the table
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+
+    for index, client_socket in enumerate(sockets):
+        new_client = chat_server.initialize_client(client_socket)
+        chat_server.process(f"user{index}", new_client)
+
+    chat_server.flush_pending()
+
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    sys.stdout = stdout
+
+    # Bytes by what allocated them
+    groups = collections.Counter()
+
+    for stat in after.compare_to(before, "filename"):
+        name = os.path.basename(stat.traceback[0].filename)
+        groups[GROUPS.get(name, "other")] += stat.size_diff
+
+    sample = next(iter(chat_server.clients.values()))
+
+    return groups, sample
+
+
+def parts(sample):
+    # Bytes of each piece of one client, the address of the current
+    # Client only exists once something has asked for it
+    address = getattr(sample, "peer", sample.address)
+
+    return {"object": sys.getsizeof(sample),
+            "__dict__": sys.getsizeof(vars(sample))
+            if hasattr(sample, "__dict__") else 0,
+            "address": sys.getsizeof(address) if address else 0,
+            "received": sys.getsizeof(sample.received),
+            "outbound": sys.getsizeof(sample.outbound),
+            "held": sys.getsizeof(sample.held)
+            if sample.held is not None else 0,
+            "buckets": sys.getsizeof(sample.buckets) +
+            sum(map(sys.getsizeof, sample.buckets.values()))}
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    results = {}
+
+    for name, client_class in (("legacy", LegacyClient),
+                               ("slots", client.Client)):
+        server.messaging.Client = client_class
+        results[name] = measure(count)
+
+    server.messaging.Client = client.Client
+
+    print(f"{count} idle clients, bytes per connection")
+    print(f"{'':>22} {'legacy':>8} {'slots':>8}")
+
+    for group in sorted(set(GROUPS.values())) + ["other"]:
+        print(f"{group:>22} {results['legacy'][0][group] / count:>8.0f} " +
+              f"{results['slots'][0][group] / count:>8.0f}")
+
+    totals = [sum(results[name][0].values()) / count
+              for name in ("legacy", "slots")]
+
+    print(f"{'total':>22} {totals[0]:>8.0f} {totals[1]:>8.0f} " +
+          f"({100 * (1 - totals[1] / totals[0]):.0f}% less)")
+
+    print("\nOne client, sys.getsizeof()")
+
+    legacy = parts(results["legacy"][1])
+    slots = parts(results["slots"][1])
+
+    for part in legacy:
+        print(f"{part:>22} {legacy[part]:>8} {slots[part]:>8}")
+
+
+if __name__ == "__main__":
+    main()
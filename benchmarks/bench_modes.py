@@ -0,0 +1,98 @@
+#########################################
+# bench_modes.py                        #
+# Throughput of each server mode        #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_modes.py [members] [senders] [messages]
+# Starts each server mode on a local port, joins every member to one
+# room and has the senders chat in a closed loop (send, wait for echo)
+# The cluster mode uses WORKERS processes (default: one per core)
+
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOST = "127.0.0.1"
+
+MODES = {"select": ("run_server.py", 18101),
+         "asyncio": ("run_server_async.py", 18102),
+         "cluster": ("run_cluster.py", 18103)}
+
+
+async def login(index, port):
+    reader, writer = await asyncio.open_connection(HOST, port)
+
+    writer.write(f"bench{index}\r\n".encode('utf-8'))
+    await reader.readuntil(b"Welcome,")
+
+    writer.write(b"/join chat\r\n")
+    await reader.readuntil(b"End list")
+
+    return reader, writer
+
+
+async def receive(reader, expected):
+    received = 0
+
+    while received < expected:
+        line = await reader.readuntil(b"\r\n")
+        received += b": msg " in line
+
+
+async def chat(reader, writer, index, messages):
+    for number in range(messages):
+        tag = f"msg {index} {number}".encode('utf-8')
+        writer.write(tag + b"\r\n")
+        await reader.readuntil(tag)
+
+
+async def run(port, members, senders, messages):
+    clients = [await login(index, port) for index in range(members)]
+    listeners = clients[senders:]
+    total = senders * messages
+
+    start = time.perf_counter()
+
+    await asyncio.gather(
+        *[chat(*clients[index], index, messages)
+          for index in range(senders)],
+        *[receive(reader, total) for reader, writer in listeners])
+
+    elapsed = time.perf_counter() - start
+
+    for reader, writer in clients:
+        writer.close()
+
+    return total / elapsed, total * members / elapsed
+
+
+def main():
+    members, senders, messages = ([int(arg) for arg in sys.argv[1:4]] or
+                                  [100, 10, 200])
+
+    print(f"{members} members, {senders} senders, {messages} messages each")
+    print(f"{'mode':>8} {'messages/s':>12} {'deliveries/s':>14}")
+
+    for mode, (script, port) in MODES.items():
+        env = dict(os.environ, HOST=HOST, PORT=str(port), DATABASE="",
+                   METRICS_PORT="0", RATE_LIMITS="off")
+        server = subprocess.Popen([sys.executable, script], cwd=ROOT,
+                                  env=env, stdout=subprocess.DEVNULL)
+        time.sleep(1)
+
+        try:
+            sent, delivered = asyncio.run(run(port, members, senders,
+                                              messages))
+            print(f"{mode:>8} {sent:>12.0f} {delivered:>14.0f}")
+
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#########################################
+# bench_room_churn.py                   #
+# Join/leave churn in very large rooms  #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_room_churn.py [room sizes...]
+# Fills a room, then has random members leave and rejoin through the
+# server, checking that /who order still follows join order
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from common import NullSocket  # noqa: E402
+from room import Room  # noqa: E402
+from server import Server  # noqa: E402
+from server.log import Log  # noqa: E402
+
+CHURN = 2000
+
+
+def churn(size):
+    room = Room("chat", None)
+    chat_server = Server(NullSocket(0), {"chat": room}, use_selector=False)
+    chat_server.logger = Log("off")
+
+    # No event loop runs timers here
+    chat_server.login_timeout = 0
+    chat_server.idle_timeout = 0
+
+    for index in range(size):
+        client = chat_server.initialize_client(NullSocket(index + 1))
+        chat_server.process(f"user{index}", client)
+
+        # Join directly, a /join would send every member list
+        room.users[client] = None
+        client.room = room
+
+    chat_server.flush_pending()
+
+    members = list(room.users)
+    random.seed(size)
+    leavers = random.sample(members, CHURN)
+
+    start = time.perf_counter()
+
+    for client in leavers:
+        del room.users[client]
+        client.room = None
+
+    for client in leavers:
+        room.users[client] = None
+        client.room = room
+
+    # Admin and ban checks done for every message and join
+    for client in leavers:
+        client.username in room.admins
+        client.username in room.banned
+        client in room.users
+
+    elapsed = time.perf_counter() - start
+
+    # Members who never left keep their join order, rejoiners go last
+    stayed = [client for client in members if client not in set(leavers)]
+    assert list(room.users) == stayed + leavers
+
+    # The same churn on the lists rooms used before
+    users = list(members)
+    admins = []
+    start = time.perf_counter()
+
+    for client in leavers:
+        users.remove(client)
+
+    for client in leavers:
+        users.append(client)
+
+    for client in leavers:
+        client.username in admins
+        client in users
+
+    before = time.perf_counter() - start
+
+    return before / (CHURN * 2) * 1e6, elapsed / (CHURN * 2) * 1e6
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 50000, 100000]
+    results = []
+
+    # Keep the connection messages out of the table
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+
+    for size in sizes:
+        results.append((size, churn(size)))
+
+    sys.stdout = stdout
+
+    print("microseconds per join or leave")
+    print(f"{'room size':>10} {'lists':>10} {'dict/sets':>10}")
+
+    for size, (before, after) in results:
+        print(f"{size:>10} {before:>10.2f} {after:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#########################################
+# bench_syscalls.py                     #
+# Send system calls per broadcast       #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_syscalls.py [members] [messages]
+# Counts send()/sendmsg() calls made while broadcasting to one room,
+# comparing the old two-sends-per-line path with the coalesced path
+
+import os
+import socket
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from room import Room  # noqa: E402
+from server import Server  # noqa: E402
+from server.log import Log  # noqa: E402
+
+SYSCALLS = [0]
+
+
+class CountingSocket(socket.socket):
+
+    def send(self, data, *args):
+        SYSCALLS[0] += 1
+
+        return super().send(data, *args)
+
+    def sendmsg(self, buffers, *args):
+        SYSCALLS[0] += 1
+
+        return super().sendmsg(buffers, *args)
+
+
+def legacy_send(self, data, client):
+    # The send path before coalescing, two blocking writes per line
+    client.socket.setblocking(True)
+    client.socket.send((f"\r<= {data}\r\n").encode('utf-8'))
+    client.socket.send(("=> " + client.typing).encode('utf-8'))
+
+    return True
+
+
+def drain(peers):
+    for peer in peers:
+        try:
+            while peer.recv(1 << 20):
+                pass
+
+        except BlockingIOError:
+            pass
+
+
+def run(members, messages, per_tick):
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(members)
+
+    chat_server = Server(listener, {"chat": Room("chat", None)})
+    chat_server.logger = Log("off")
+    peers = []
+
+    for index in range(members):
+        peer = socket.create_connection(listener.getsockname())
+        peer.setblocking(False)
+        peers.append(peer)
+
+        accepted, address = listener.accept()
+        client_socket = CountingSocket(fileno=accepted.detach())
+
+        client = chat_server.initialize_client(client_socket)
+        chat_server.process(f"user{index}", client)
+        chat_server.process("/join chat", client)
+
+        chat_server.flush_pending()
+        drain(peers)
+
+    sender = chat_server.usernames["user0"]
+
+    SYSCALLS[0] = 0
+
+    for number in range(messages):
+        chat_server.process(f"message number {number}", sender)
+
+        # One event loop iteration every per_tick messages
+        if (number + 1) % per_tick == 0:
+            chat_server.flush_pending()
+            drain(peers)
+
+    chat_server.process("/who", sender)
+    chat_server.flush_pending()
+
+    for peer in peers:
+        peer.close()
+
+    listener.close()
+
+    return SYSCALLS[0]
+
+
+def main():
+    members, messages = [int(arg) for arg in sys.argv[1:3]] or [200, 100]
+    coalesced_send = Server.send
+
+    print(f"{members} members, {messages} broadcasts and one /who")
+    print(f"{'path':>28} {'syscalls':>10} {'per message':>12}")
+
+    for name, per_tick, legacy in (("before (2 sends per line)", 1, True),
+                                   ("after, 1 message per tick", 1, False),
+                                   ("after, 10 messages per tick", 10,
+                                    False)):
+        Server.send = legacy_send if legacy else coalesced_send
+
+        syscalls = run(members, messages, per_tick)
+
+        print(f"{name:>28} {syscalls:>10} {syscalls / messages:>12.1f}")
+
+    Server.send = coalesced_send
+
+
+if __name__ == "__main__":
+    main()
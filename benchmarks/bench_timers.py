@@ -0,0 +1,116 @@
+#########################################
+# bench_timers.py                       #
+# Timing wheel vs a heap of deadlines   #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_timers.py [connections]
+# Puts every connection (default 100000) in the timing wheel, spread over
+# an hour, and times adding, re-adding (a deadline moved by new input),
+# removing and one tick of the wheel. The heap column does the same with
+# heapq and lazy deletion, where moving a deadline pushes a new entry.
+
+import heapq
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from server.timers import TimingWheel  # noqa: E402
+
+
+class Key():
+    pass
+
+
+def timed(function, count):
+    start = time.perf_counter()
+    function()
+
+    return (time.perf_counter() - start) / count * 1e9
+
+
+def bench_wheel(keys, deadlines, now):
+    wheel = TimingWheel()
+    moved = [due + 60 for due in deadlines]
+    results = {}
+
+    def add(times):
+        for key, due in zip(keys, times):
+            wheel.schedule(key, due)
+
+    results["add"] = timed(lambda: add(deadlines), len(keys))
+    results["move"] = timed(lambda: add(moved), len(keys))
+
+    # Every connection is spread over 3600 ticks, one tick expires ~1/3600
+    start = time.perf_counter()
+    expired = wheel.expire(now + 1)
+    results["tick"] = (time.perf_counter() - start) * 1e6
+    results["expired"] = len(expired)
+
+    results["remove"] = timed(lambda: [wheel.cancel(key) for key in keys],
+                              len(keys))
+
+    return results
+
+
+def bench_heap(keys, deadlines, now):
+    heap = []
+    current = {}
+    moved = [due + 60 for due in deadlines]
+    results = {}
+
+    def add(times):
+        for key, due in zip(keys, times):
+            current[key] = due
+            heapq.heappush(heap, (due, id(key), key))
+
+    results["add"] = timed(lambda: add(deadlines), len(keys))
+    results["move"] = timed(lambda: add(moved), len(keys))
+
+    def tick():
+        expired = []
+
+        while len(heap) > 0 and heap[0][0] <= now + 1:
+            due, number, key = heapq.heappop(heap)
+
+            # Skip deadlines that were moved or removed
+            if current.get(key) == due:
+                expired.append(key)
+
+        return expired
+
+    start = time.perf_counter()
+    expired = tick()
+    results["tick"] = (time.perf_counter() - start) * 1e6
+    results["expired"] = len(expired)
+
+    results["remove"] = timed(lambda: [current.pop(key) for key in keys],
+                              len(keys))
+
+    return results
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    now = time.monotonic()
+    keys = [Key() for _ in range(count)]
+    deadlines = [now + random.uniform(0, 3600) for _ in range(count)]
+
+    print(f"{count} connections, deadlines spread over an hour")
+    print(f"{'':>6} {'add':>9} {'move':>9} {'remove':>9} {'tick':>10} " +
+          f"{'expired':>8}")
+
+    for name, bench in (("wheel", bench_wheel), ("heap", bench_heap)):
+        results = bench(keys, deadlines, now)
+
+        print(f"{name:>6} {results['add']:>7.0f}ns " +
+              f"{results['move']:>7.0f}ns {results['remove']:>7.0f}ns " +
+              f"{results['tick']:>8.0f}us {results['expired']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#########################################
+# bench_wakeup.py                       #
+# Wakeup cost with idle connections     #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/bench_wakeup.py [idle counts...]
+# Each idle connection is a socket pair, so the open file limit must
+# be at least twice the largest count
+
+import resource
+import select
+import selectors
+import socket
+import sys
+import time
+
+WAKEUPS = 2000
+
+
+def raise_file_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    return hard
+
+
+def time_select(active, idle):
+    """
+    Returns the microseconds per wakeup of the old main loop, which
+    rebuilds the descriptor list on every call
+    """
+
+    sockets = [active[1]] + idle
+
+    start = time.perf_counter()
+
+    for _ in range(WAKEUPS):
+        active[0].send(b"x")
+        read_sockets, _, _ = select.select(sockets, [], sockets)
+        read_sockets[0].recv(1)
+
+    return (time.perf_counter() - start) / WAKEUPS * 1e6
+
+
+def time_selector(active, idle):
+    """
+    Returns the microseconds per wakeup of the selector event engine
+    """
+
+    selector = selectors.DefaultSelector()
+
+    for sock in idle:
+        selector.register(sock, selectors.EVENT_READ)
+
+    selector.register(active[1], selectors.EVENT_READ)
+
+    start = time.perf_counter()
+
+    for _ in range(WAKEUPS):
+        active[0].send(b"x")
+        for key, events in selector.select():
+            key.fileobj.recv(1)
+
+    elapsed = time.perf_counter() - start
+
+    selector.close()
+
+    return elapsed / WAKEUPS * 1e6
+
+
+def main():
+    counts = [int(arg) for arg in sys.argv[1:]] or [1000, 10000, 50000]
+    limit = raise_file_limit()
+
+    print(f"{'idle':>8} {'select (us)':>14} " +
+          f"{selectors.DefaultSelector.__name__ + ' (us)':>22}")
+
+    for count in counts:
+        if count * 2 + 16 > limit:
+            print(f"{count:>8} skipped, open file limit is {limit}")
+            continue
+
+        pairs = [socket.socketpair() for _ in range(count)]
+        idle = [pair[1] for pair in pairs]
+        active = socket.socketpair()
+
+        try:
+            select_us = f"{time_select(active, idle):.1f}"
+
+        # select() cannot watch descriptors past FD_SETSIZE
+        except ValueError:
+            select_us = "FD_SETSIZE"
+
+        print(f"{count:>8} {select_us:>14} " +
+              f"{time_selector(active, idle):>22.1f}")
+
+        for pair in pairs + [active]:
+            pair[0].close()
+            pair[1].close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+#########################################
+# common.py                             #
+# Helpers shared by the benchmarks      #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Imported by the benchmarks run as scripts from this directory
+
+
+class NullSocket():
+    # A connected socket with no file descriptor that takes every write
+    # whole, so the server's own work is all that is measured
+
+    def __init__(self, port):
+        self.port = port
+
+    def getsockname(self):
+        return ("127.0.0.1", self.port)
+
+    def getpeername(self):
+        return ("127.0.0.1", self.port)
+
+    def setblocking(self, flag):
+        pass
+
+    def send(self, data):
+        return len(data)
+
+    def sendmsg(self, buffers):
+        return sum(map(len, buffers))
+
+    def close(self):
+        pass
@@ -0,0 +1,618 @@
+#########################################
+# loadgen.py                            #
+# End-to-end load generator             #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+# Usage: python benchmarks/loadgen.py [preset] [options]
+#        python benchmarks/loadgen.py --help
+# Starts run_server.py on a local port (or attaches to a running server
+# with --attach), connects simulated clients from several processes,
+# logs them in with a username, puts them in rooms with /join and has
+# them chat at a fixed rate. Prints the results as JSON.
+#
+# Presets:
+#   small_rooms  many rooms of ten chatting members
+#   huge_room    one room holding every client, a few of them talking
+#   commands     half of all input is /rooms and /who
+#   churn        clients connect, log in, join, talk and /exit in a loop
+#
+# Fan-out latency is measured from the moment a message is written to
+# the moment each other member of the room reads it. Every process uses
+# the same monotonic clock, so senders and receivers in different
+# processes can be compared.
+
+import argparse
+import asyncio
+import collections
+import json
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HOST = "127.0.0.1"
+
+# Marker of a timed chat message: "lg <sender> <monotonic ns>"
+TAG = b": lg "
+
+# Password the room owners set before creating their room
+PASSWORD = "loadgen"
+
+# Connections each process opens at once while setting up
+CONNECT_CONCURRENCY = 100
+
+# Seconds to keep reading after the senders stop
+GRACE = 1.0
+
+# Settings of each preset, see parse_arguments() for what they mean
+PRESETS = {"small_rooms": {"clients": 2000, "room_size": 10, "senders": 0,
+                           "rate": 1.0, "commands": 0.0},
+           "huge_room": {"clients": 1000, "room_size": 0, "senders": 10,
+                         "rate": 5.0, "commands": 0.0},
+           "commands": {"clients": 500, "room_size": 50, "senders": 0,
+                        "rate": 2.0, "commands": 0.5},
+           "churn": {"clients": 200, "room_size": 0, "senders": 0,
+                     "rate": 0.0, "commands": 0.0}}
+
+
+###############################################################################
+#                                 Statistics                                  #
+###############################################################################
+
+
+class Stats():
+    """
+    Counters and latency histograms of one load generator process
+    """
+
+    def __init__(self):
+        # Counters with a latency in microseconds as the key and the
+        # number of samples as the value
+        self.message_latency = collections.Counter()
+        self.command_latency = collections.Counter()
+        self.connect_latency = collections.Counter()
+
+        self.sent = 0
+        self.delivered = 0
+        self.commands = 0
+        self.connections = 0
+        self.errors = 0
+
+    def merge(self, other):
+        for name, value in vars(other).items():
+            if isinstance(value, collections.Counter):
+                getattr(self, name).update(value)
+
+            else:
+                setattr(self, name, getattr(self, name) + value)
+
+
+def record(histogram, start):
+    histogram[(time.monotonic_ns() - start) // 1000] += 1
+
+
+def percentiles(histogram):
+    """
+    Description:
+        Summarizes a latency histogram
+    Arguments:
+        A Counter of microseconds
+    Return Value:
+        A dictionary of p50, p95, p99 and max latencies in milliseconds
+    """
+
+    total = sum(histogram.values())
+    summary = {"samples": total}
+
+    if total == 0:
+        return summary
+
+    latencies = sorted(histogram.items())
+    targets = [("p50", 0.50), ("p95", 0.95), ("p99", 0.99)]
+    seen = 0
+
+    for latency, count in latencies:
+        seen += count
+
+        while len(targets) > 0 and seen >= targets[0][1] * total:
+            summary[targets.pop(0)[0]] = latency / 1000
+
+    summary["max"] = latencies[-1][0] / 1000
+
+    return summary
+
+
+###############################################################################
+#                                   Clients                                   #
+###############################################################################
+
+
+class Member():
+    """
+    One simulated chat client
+    """
+
+    def __init__(self, username, stats):
+        self.username = username
+        self.tag = f"lg {username} ".encode('utf-8')
+        self.stats = stats
+
+        self.reader = None
+        self.writer = None
+
+        # Send times of commands waiting for their "End list"
+        self.commands = collections.deque()
+
+    async def expect(self, data):
+        await self.reader.readuntil(data)
+
+    def write(self, line):
+        self.writer.write(line.encode('utf-8') + b"\r\n")
+
+    async def connect(self, port):
+        start = time.monotonic_ns()
+
+        self.reader, self.writer = await asyncio.open_connection(
+            HOST, port, limit=1 << 20)
+
+        # The set_username() flow
+        self.write(self.username)
+        await self.expect(b"Welcome,")
+
+        record(self.stats.connect_latency, start)
+        self.stats.connections += 1
+
+    async def create(self, room):
+        # Only users with a password can create rooms
+        self.write("/setpassword")
+        await self.expect(b"New password:")
+        self.write(PASSWORD)
+        await self.expect(b"Confirm password:")
+        self.write(PASSWORD)
+        await self.expect(b"Password set")
+
+        self.write(f"/new {room}")
+        await self.expect(b"You created a room")
+
+    async def join(self, room):
+        self.write(f"/join {room}")
+
+        # The join ends with the /who listing
+        await self.expect(b"End list")
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+    async def listen(self):
+        buffer = b""
+
+        try:
+            while True:
+                data = await self.reader.read(65536)
+
+                if len(data) == 0:
+                    return
+
+                lines = (buffer + data).split(b"\n")
+                buffer = lines.pop()
+
+                for line in lines:
+                    self.received(line)
+
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+
+    def received(self, line):
+        index = line.find(TAG)
+
+        if index != -1:
+            fields = line[index + len(TAG):].split()
+
+            # A member's own messages do not count as fan-out
+            if len(fields) == 2 and fields[0] != self.username.encode():
+                record(self.stats.message_latency, int(fields[1]))
+                self.stats.delivered += 1
+
+        elif b"End list" in line and len(self.commands) > 0:
+            record(self.stats.command_latency, self.commands.popleft())
+
+    async def talk(self, rate, commands, deadline, rng):
+        # Spread the first messages over one interval
+        next_time = time.monotonic() + rng.random() / rate
+
+        while next_time < deadline:
+            await asyncio.sleep(max(0, next_time - time.monotonic()))
+            next_time += 1 / rate
+
+            if rng.random() < commands:
+                self.commands.append(time.monotonic_ns())
+                self.write(rng.choice(("/rooms", "/who")))
+                self.stats.commands += 1
+
+            else:
+                self.write(f"lg {self.username} {time.monotonic_ns()}")
+                self.stats.sent += 1
+
+            await self.writer.drain()
+
+
+async def churn(username, port, deadline, stats):
+    cycle = 0
+
+    while time.monotonic() < deadline:
+        member = Member(f"{username}_{cycle}", stats)
+        cycle += 1
+
+        try:
+            await member.connect(port)
+            await member.join("chat")
+
+            # Wait for our own message to come back before leaving
+            member.write(f"lg {member.username} {time.monotonic_ns()}")
+            stats.sent += 1
+            await member.expect(member.tag)
+
+            member.write("/exit")
+            await member.reader.read()
+
+        except (ConnectionError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError):
+            stats.errors += 1
+
+        finally:
+            member.close()
+
+
+###############################################################################
+#                                   Workers                                   #
+###############################################################################
+
+
+async def guarded(semaphore, stats, coroutine):
+    try:
+        if semaphore is None:
+            await coroutine
+
+        else:
+            async with semaphore:
+                await coroutine
+
+    except (ConnectionError, asyncio.IncompleteReadError,
+            asyncio.LimitOverrunError):
+        stats.errors += 1
+
+
+async def run_worker(plan, options, barrier):
+    stats = Stats()
+    loop = asyncio.get_running_loop()
+    rng = random.Random(plan["number"])
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    await loop.run_in_executor(None, barrier.wait)
+
+    # Set up: log in, create the rooms, then join them
+    members = []
+    talkers = []
+
+    async def set_up(room, usernames, owner):
+        group = [Member(username, stats) for username in usernames]
+        members.extend(group)
+
+        if owner:
+            await guarded(semaphore, stats, group[0].connect(options.port))
+
+            if group[0].writer is not None:
+                await guarded(semaphore, stats, group[0].create(room))
+
+        await asyncio.gather(*[guarded(semaphore, stats,
+                                       member.connect(options.port))
+                               for member in group[owner:]])
+        await asyncio.gather(*[guarded(semaphore, stats, member.join(room))
+                               for member in group])
+
+        senders = options.senders or len(group)
+        talkers.extend(group[:senders])
+
+    if options.preset != "churn":
+        await asyncio.gather(*[set_up(*room) for room in plan["rooms"]])
+
+    await loop.run_in_executor(None, barrier.wait)
+
+    # Traffic
+    deadline = time.monotonic() + options.duration
+    listeners = [asyncio.ensure_future(member.listen())
+                 for member in members if member.writer is not None]
+
+    if options.preset == "churn":
+        tasks = [churn(username, options.port, deadline, stats)
+                 for username in plan["usernames"]]
+
+    else:
+        tasks = [guarded(None, stats,
+                         member.talk(options.rate, options.commands,
+                                     deadline, rng))
+                 for member in talkers if member.writer is not None]
+
+    await asyncio.gather(*tasks)
+    await loop.run_in_executor(None, barrier.wait)
+
+    # Collect what is still in flight
+    await asyncio.sleep(GRACE)
+
+    for listener in listeners:
+        listener.cancel()
+
+    for member in members:
+        member.close()
+
+    return stats
+
+
+def worker(plan, options, barrier, results):
+    raise_file_limit()
+
+    results.put(asyncio.run(run_worker(plan, options, barrier)))
+
+
+def make_plans(options, run):
+    """
+    Description:
+        Splits the simulated clients between the worker processes
+        A room created by the load generator belongs to one process
+    Arguments:
+        The parsed options
+        A short tag to keep usernames and rooms unique between runs
+    Return Value:
+        A list of plans, one for each process
+    """
+
+    plans = [{"number": number, "rooms": [], "usernames": []}
+             for number in range(options.processes)]
+
+    usernames = [f"{run}u{index}" for index in range(options.clients)]
+
+    if options.preset == "churn":
+        for index, username in enumerate(usernames):
+            plans[index % options.processes]["usernames"].append(username)
+
+    # Everyone in the server's own chat room, spread over the processes
+    elif options.room_size == 0:
+        for number, plan in enumerate(plans):
+            plan["rooms"].append(("chat", usernames[number::len(plans)],
+                                  False))
+
+    else:
+        for start in range(0, options.clients, options.room_size):
+            room = f"{run}r{start // options.room_size}"
+            group = usernames[start:start + options.room_size]
+
+            plans[(start // options.room_size) % options.processes][
+                "rooms"].append((room, group, True))
+
+    return plans
+
+
+###############################################################################
+#                                   Server                                    #
+###############################################################################
+
+
+def raise_file_limit():
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def start_server(options):
+    env = dict(os.environ, HOST=HOST, PORT=str(options.port), DATABASE="",
+               METRICS_PORT="0", RATE_LIMITS="off")
+    server = subprocess.Popen([sys.executable, options.script], cwd=ROOT,
+                              env=env, stdout=subprocess.DEVNULL,
+                              preexec_fn=raise_file_limit)
+
+    # Wait for the server to listen
+    for _ in range(100):
+        try:
+            socket.create_connection((HOST, options.port)).close()
+
+            return server
+
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+
+    server.terminate()
+
+    raise RuntimeError(f"{options.script} did not start listening")
+
+
+def process_tree(pid):
+    # The server and its children, for cluster mode
+    pids = [pid]
+
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as stat:
+                    fields = stat.read().rsplit(")", 1)[1].split()
+
+            except OSError:
+                continue
+
+            if int(fields[1]) == pid:
+                pids.append(int(entry))
+
+    return pids
+
+
+def cpu_seconds(pids):
+    ticks = 0
+
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as stat:
+                fields = stat.read().rsplit(")", 1)[1].split()
+
+        except OSError:
+            continue
+
+        # utime and stime
+        ticks += int(fields[11]) + int(fields[12])
+
+    return ticks / os.sysconf("SC_CLK_TCK")
+
+
+def memory_kib(pids):
+    memory = {"rss_kib": 0, "peak_rss_kib": 0}
+
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        memory["rss_kib"] += int(line.split()[1])
+
+                    elif line.startswith("VmHWM:"):
+                        memory["peak_rss_kib"] += int(line.split()[1])
+
+        except OSError:
+            continue
+
+    return memory
+
+
+###############################################################################
+#                                    Main                                     #
+###############################################################################
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(
+        description="End-to-end load generator for the chat server")
+
+    parser.add_argument("preset", nargs="?", default="small_rooms",
+                        choices=PRESETS)
+    parser.add_argument("--clients", type=int,
+                        help="number of simulated clients")
+    parser.add_argument("--room-size", type=int,
+                        help="members per room, 0 puts everyone in one room")
+    parser.add_argument("--senders", type=int,
+                        help="members of each room that talk, 0 for all")
+    parser.add_argument("--rate", type=float,
+                        help="messages per second from each sender")
+    parser.add_argument("--commands", type=float,
+                        help="fraction of input that is /rooms or /who")
+    parser.add_argument("--duration", type=float, default=10.0,
+                        help="seconds of traffic")
+    parser.add_argument("--processes", type=int,
+                        default=max(1, (os.cpu_count() or 2) // 2),
+                        help="load generator processes")
+    parser.add_argument("--port", type=int, default=18111)
+    parser.add_argument("--script", default="run_server.py",
+                        help="server script to start")
+    parser.add_argument("--attach", type=int, metavar="PID",
+                        help="use a server already running as PID")
+    parser.add_argument("--output", help="also write the JSON to a file")
+
+    options = parser.parse_args()
+
+    for name, value in PRESETS[options.preset].items():
+        if getattr(options, name) is None:
+            setattr(options, name, value)
+
+    return options
+
+
+def main():
+    options = parse_arguments()
+    run = f"{os.getpid() % 10000}x"
+
+    raise_file_limit()
+
+    server = None if options.attach else start_server(options)
+    pids = process_tree(options.attach or server.pid)
+
+    plans = make_plans(options, run)
+    barrier = multiprocessing.Barrier(options.processes + 1)
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=worker,
+                                       args=(plan, options, barrier, results))
+               for plan in plans]
+
+    try:
+        for process in workers:
+            process.start()
+
+        # Connect and join
+        barrier.wait()
+        start = time.monotonic()
+        barrier.wait()
+        connect_seconds = time.monotonic() - start
+
+        # Traffic
+        cpu_start = cpu_seconds(pids)
+        start = time.monotonic()
+        barrier.wait()
+        traffic_seconds = time.monotonic() - start
+        cpu = cpu_seconds(pids) - cpu_start
+        memory = memory_kib(pids)
+
+        stats = Stats()
+
+        for process in workers:
+            stats.merge(results.get())
+
+        for process in workers:
+            process.join()
+
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    if options.preset == "churn":
+        connect_rate = stats.connections / traffic_seconds
+
+    else:
+        connect_rate = stats.connections / connect_seconds
+
+    report = {
+        "preset": options.preset,
+        "config": {name: getattr(options, name)
+                   for name in ("clients", "room_size", "senders", "rate",
+                                "commands", "duration", "processes",
+                                "script")},
+        "server": dict(memory,
+                       cpu_seconds=round(cpu, 3),
+                       cpu_percent=round(100 * cpu / traffic_seconds, 1)),
+        "connect": {"connections": stats.connections,
+                    "setup_seconds": round(connect_seconds, 3),
+                    "per_second": round(connect_rate, 1),
+                    "latency_ms": percentiles(stats.connect_latency)},
+        "messages": {"sent": stats.sent,
+                     "sent_per_second": round(stats.sent / traffic_seconds,
+                                              1),
+                     "delivered": stats.delivered,
+                     "delivered_per_second": round(
+                         stats.delivered / traffic_seconds, 1),
+                     "latency_ms": percentiles(stats.message_latency)},
+        "commands": {"sent": stats.commands,
+                     "latency_ms": percentiles(stats.command_latency)},
+        "errors": stats.errors}
+
+    output = json.dumps(report, indent=2)
+    print(output)
+
+    if options.output:
+        with open(options.output, "w") as file:
+            file.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
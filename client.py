@@ -4,28 +4,134 @@
 # by Kenji Takahashi-Rial               #
 #########################################
 
+import collections
 import socket
+import time
 
 
 class Client():
 
+    # No __dict__, an idle connection is mostly these slots
+    __slots__ = ("socket", "peer", "username", "room", "received",
+                 "outbound", "outbound_size", "outbound_sent", "slow",
+                 "blocked", "needs_prompt", "closing", "logging_in",
+                 "parked", "held", "buckets", "user_buckets", "throttled",
+                 "active", "probed", "deadline", "setting_password",
+                 "json", "input_state", "commands", "line_mode", "window",
+                 "options", "outbound_compressed", "compressing",
+                 "compressor", "adler", "overlong")
+
     def __init__(self, client_socket):
         self.socket = client_socket
 
-        self.address = (f"{client_socket.getsockname()[0]}:" +
-                        f"{client_socket.getsockname()[1]}")
+        # The "host:port" string of the other end, looked up the first
+        # time the address is needed
+        self.peer = None
 
         self.username = None
 
         # The room object the client is currently in
         self.room = None
 
-        # A buffer for a message before the client hits enter
-        self.typing = ""
+        # The bytes of a message before the client hits enter
+        self.received = bytearray()
+
+        # Indicates whether the rest of a line that was too long is being
+        # thrown away until the next newline
+        self.overlong = False
+
+        # Where the input filter is inside a telnet command or an escape
+        # sequence split across reads (see telnet.py)
+        self.input_state = 0
+
+        # Bytes of the telnet commands the client sent that were not
+        # answered yet, only made once it sends one (see telnet.py)
+        self.commands = None
+
+        # Indicates whether the client sends whole lines it edited and
+        # echoed itself, so nothing is re-printed for it
+        # None until the client agrees to LINEMODE or its reads show it,
+        # a guess from the reads can change on the next one
+        self.line_mode = None
+
+        # The (width, height) the client reported for its window, None
+        # if it did not
+        self.window = None
+
+        # Set of telnet options the client turned on at its end, only
+        # made once it turns one on (see telnet.py)
+        self.options = None
+
+        # Bytes waiting to be sent, flushed when the socket is writable
+        self.outbound = collections.deque()
+
+        # Total bytes waiting in the outbound queue
+        self.outbound_size = 0
+
+        # Bytes of the first queued message that were already sent
+        self.outbound_sent = 0
+
+        # Queued messages at the front that are already compressed, or
+        # from before compression started, and go out as they are
+        self.outbound_compressed = 0
+
+        # Indicates whether everything sent to the client is one zlib
+        # stream (see compression.py)
+        self.compressing = False
+
+        # The client's own zlib compressor, made when it is needed, and
+        # the Adler-32 checksum of everything compressed for it so far
+        self.compressor = None
+        self.adler = 1
+
+        # Indicates whether new messages are being dropped until the
+        # outbound queue drains
+        self.slow = False
+
+        # Indicates whether the socket buffer is full and the client is
+        # waiting for the socket to be writable
+        self.blocked = False
+
+        # Indicates whether the prompt should be re-printed after the
+        # queued messages
+        self.needs_prompt = False
+
+        # Indicates whether the client is waiting to be disconnected
+        self.closing = False
 
         # Indicates whether the user is currently logging in
         self.logging_in = False
 
+        # Indicates whether the client is waiting for a password hash,
+        # input is held until it is done
+        self.parked = False
+
+        # Deque of messages received while parked, only made once there
+        # is one to hold
+        self.held = None
+
+        # Dictionaries with the kind of input as the key and the token
+        # bucket of the connection or of the username as the value
+        # (see ratelimit.py)
+        self.buckets = {}
+        self.user_buckets = self.buckets
+
+        # Indicates whether the client's last line was rate limited
+        self.throttled = False
+
+        # time.monotonic() times of the last input and the last keepalive
+        # probe (see timers.py)
+        self.active = time.monotonic()
+        self.probed = 0
+
+        # time.monotonic() time by which the client has to finish logging
+        # in or setting a password, None if there is nothing to finish
+        self.deadline = None
+
+        # Indicates whether the client speaks the JSON lines protocol
+        # (see jsonlines.py) instead of telnet text
+        self.json = False
+
         # Indicates whether the user is setting a password
         # 0 if not settings a password
         # 1 if typing current password
@@ -33,6 +139,28 @@ class Client():
         # A string of the new password if confirming new password
         self.setting_password = 0
 
+    @property
+    def address(self):
+        if self.peer is None:
+            try:
+                host, port = self.socket.getpeername()[:2]
+                self.peer = f"{host}:{port}"
+
+            # Already disconnected
+            except OSError:
+                self.peer = "unknown"
+
+        return self.peer
+
+    @property
+    def typing(self):
+        # The end of the buffer may be part of a character
+        return self.received.decode('utf-8', 'ignore')
+
+    @typing.setter
+    def typing(self, message):
+        self.received = bytearray(message.encode('utf-8'))
+
     def __str__(self):
         socket_str = f"socket: {self.socket}\n\n"
         address_str = f"address: {self.address}\n\n"
@@ -4,6 +4,8 @@
 # by Kenji Takahashi-Rial               #
 #########################################
 
+import collections
+
 
 class Room():
 
@@ -17,20 +19,40 @@ class Room():
         else:
             self.owner = client.username
 
-        # List of admin usernames
-        self.admins = []
+        # Set of admin usernames
+        self.admins = set()
+
+        # Dictionary with client objects as the keys and None as the
+        # values, used as a set that keeps join order
+        self.users = {}
+
+        # Set of banned usernames
+        self.banned = set()
+
+        # Deque of the most recent messages as encoded for the users
+        # in the room, oldest first
+        self.history = collections.deque()
+
+        # Total bytes of the messages in the history
+        self.history_size = 0
+
+        # Seconds messages are collected before they are written to the
+        # members together, 0 writes every message right away
+        self.batch_window = 0
 
-        # List of client objects
-        self.users = []
+        # Lists of encoded messages waiting for the batch window, as
+        # telnet bytes and as JSON lines frames
+        self.batch = []
+        self.batch_frames = []
 
-        # List of banned usernames
-        self.banned = []
+        # Total bytes of the messages in the batch
+        self.batch_size = 0
 
     def __str__(self):
         name_str = f"name: {self.name}\n\n"
         owner_str = f"owner: {self.owner}\n\n"
         admins_str = f"admins: {self.admins}\n\n"
-        users_str = f"users: {self.users}\n\n"
+        users_str = f"users: {list(self.users)}\n\n"
 
         return (name_str +
                 owner_str +
@@ -0,0 +1,185 @@
+#########################################
+# run_cluster.py                        #
+# The code to run the chat server as    #
+# one worker process per core           #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+import os
+import signal
+import socket
+import tempfile
+
+from room import Room
+from server import Server
+from server.config import configure
+from server.listener import LISTEN_BACKLOG
+from server.cluster import Bus, Hub
+from server.storage import Store
+
+
+###############################################################################
+#                                Initial Setup                                #
+###############################################################################
+
+
+IP_ADDRESS = os.environ.get("HOST",
+                            socket.gethostbyname(socket.gethostname()))
+PORT = int(os.environ.get("PORT", 1081))
+
+# Local port of the first worker's metrics endpoint, each worker serves
+# its own metrics on the next port, 0 turns them off
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 1082))
+
+# Port of the JSON lines listener for bots, 0 turns it off, clear of
+# the workers' metrics ports
+JSON_PORT = int(os.environ.get("JSON_PORT", 1091))
+
+# Connections the kernel queues until the server accepts them
+BACKLOG = int(os.environ.get("BACKLOG", LISTEN_BACKLOG))
+
+# SQLite file accounts and rooms are saved to, empty keeps them in memory
+# Every worker loads it and saves the changes its own users make
+DATABASE = os.environ.get("DATABASE", "chat.db")
+
+# Number of worker processes sharing the port
+WORKERS = int(os.environ.get("WORKERS", os.cpu_count()))
+
+# Unix socket the workers use to reach the hub
+HUB_PATH = os.path.join(tempfile.mkdtemp(prefix="chat-cluster-"), "hub")
+
+
+###############################################################################
+#                                   Worker                                    #
+###############################################################################
+
+
+def run_worker(number):
+    """
+    Description:
+        Runs one worker, a full Server on the shared port connected to
+        the other workers through the hub
+    Arguments:
+        The worker number
+    Return Value:
+        None
+    """
+
+    # Set up the server socket and start listening
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    # Allows reuse of address/port, the kernel spreads new connections
+    # across every worker listening on the port
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+    server_socket.bind((IP_ADDRESS, PORT))
+
+    rooms = {"chat": Room("chat", None),
+             "hottub": Room("hottub", None),
+             "PAD": Room("PAD", None),
+             "anime": Room("anime", None)}
+
+    # Create the server object
+    chat_server = Server(server_socket, rooms)
+
+    # Load the saved accounts and rooms
+    if DATABASE:
+        chat_server.store = Store(DATABASE, chat_server.logger)
+        chat_server.passwords = chat_server.store.load(rooms)
+
+    chat_server.backlog = BACKLOG
+
+    # Every other setting read from the environment (see server/config.py)
+    configure(chat_server)
+
+    if METRICS_PORT:
+        chat_server.serve_metrics(("127.0.0.1", METRICS_PORT + number))
+
+    # Wait for every worker before taking connections
+    chat_server.bus = Bus(HUB_PATH)
+    chat_server.bus.wait_ready()
+    chat_server.register(chat_server.bus.socket, chat_server.bus.read)
+
+    server_socket.listen(BACKLOG)
+
+    if JSON_PORT:
+        chat_server.serve_json((IP_ADDRESS, JSON_PORT), reuse_port=True)
+
+    print(f"\nWorker {number} listening for connections on " +
+          f"{IP_ADDRESS}:{PORT}...\n")
+
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        chat_server.serve_forever()
+
+    finally:
+        # Commit the changes still waiting to be written
+        if chat_server.store is not None:
+            chat_server.store.close()
+
+        # Write the log records still waiting
+        chat_server.logger.close()
+
+
+###############################################################################
+#                                  Launcher                                   #
+###############################################################################
+
+
+def start(function, *args):
+    """
+    Description:
+        Runs a function in a child process
+    Arguments:
+        The function to run
+        The arguments to pass to the function
+    Return Value:
+        The process id of the child
+    """
+
+    pid = os.fork()
+
+    if pid == 0:
+        try:
+            function(*args)
+
+        finally:
+            os._exit(0)
+
+    return pid
+
+
+def stop(signal_number, frame):
+    raise SystemExit
+
+
+if __name__ == "__main__":
+    # Listen before any worker tries to connect
+    hub = Hub(HUB_PATH, WORKERS)
+
+    children = [start(hub.serve_forever)]
+    hub.socket.close()
+
+    children += [start(run_worker, number) for number in range(WORKERS)]
+
+    signal.signal(signal.SIGTERM, stop)
+
+    try:
+        # The cluster stops when any process exits
+        os.wait()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+
+            except ProcessLookupError:
+                pass
+
+        os.unlink(HUB_PATH)
+        os.rmdir(os.path.dirname(HUB_PATH))
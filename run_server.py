@@ -5,11 +5,14 @@
 #########################################
 
 import os
-import select
+import signal
 import socket
 
 from room import Room
 from server import Server
+from server.config import configure
+from server.listener import LISTEN_BACKLOG
+from server.storage import Store
 
 
 ###############################################################################
@@ -17,9 +20,22 @@ from server import Server
 ###############################################################################
 
 
-IP_ADDRESS = socket.gethostbyname(socket.gethostname())
+IP_ADDRESS = os.environ.get("HOST",
+                            socket.gethostbyname(socket.gethostname()))
 PORT = int(os.environ.get("PORT", 1081))
 
+# Local port of the plaintext metrics endpoint, 0 turns it off
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 1082))
+
+# Port of the JSON lines listener for bots, 0 turns it off
+JSON_PORT = int(os.environ.get("JSON_PORT", 1091))
+
+# Connections the kernel queues until the server accepts them
+BACKLOG = int(os.environ.get("BACKLOG", LISTEN_BACKLOG))
+
+# SQLite file accounts and rooms are saved to, empty keeps them in memory
+DATABASE = os.environ.get("DATABASE", "chat.db")
+
 # Set up the server socket and start listening
 server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
@@ -27,7 +43,7 @@ server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
 
 server_socket.bind((IP_ADDRESS, PORT))
-server_socket.listen()
+server_socket.listen(BACKLOG)
 
 print(f"\nListening for connections on {IP_ADDRESS}:{PORT}...\n")
 
@@ -39,37 +55,48 @@ rooms = {"chat": Room("chat", None),
 # Create the server object
 chat_server = Server(server_socket, rooms)
 
+# Load the saved accounts and rooms
+if DATABASE:
+    chat_server.store = Store(DATABASE, chat_server.logger)
+    chat_server.passwords = chat_server.store.load(rooms)
+
+chat_server.backlog = BACKLOG
+
+# Every other setting read from the environment (see server/config.py)
+configure(chat_server)
+
+if METRICS_PORT:
+    chat_server.serve_metrics(("127.0.0.1", METRICS_PORT))
+
+    print(f"\nServing metrics on 127.0.0.1:{METRICS_PORT}...\n")
+
+if JSON_PORT:
+    chat_server.serve_json((IP_ADDRESS, JSON_PORT))
+
+    print(f"\nListening for JSON lines on {IP_ADDRESS}:{JSON_PORT}...\n")
+
 
 ###############################################################################
 #                                  Main Loop                                  #
 ###############################################################################
 
 
-while True:
-    # Get the ready sockets
-    read_sockets, write_sockets, error_sockets = (
-        select.select(chat_server.sockets, [], chat_server.sockets))
-
-    for ready_socket in read_sockets:
-        # New connection
-        if ready_socket == chat_server.socket:
-            client_socket, client_address = chat_server.socket.accept()
+def stop(signal_number, frame):
+    raise SystemExit
 
-            client_socket.send(f"<= Welcome to the GungHo chat server\r\n"
-                               .encode('utf-8'))
 
-            chat_server.initialize_client(client_socket)
+signal.signal(signal.SIGTERM, stop)
 
-        else:
-            # Get client object
-            client = chat_server.clients[ready_socket]
+try:
+    chat_server.serve_forever()
 
-            # Get data and process it
-            data = chat_server.receive(client)
+except KeyboardInterrupt:
+    pass
 
-            if data is not None and data is not False:
-                chat_server.process(data, client)
+finally:
+    # Commit the changes still waiting to be written
+    if chat_server.store is not None:
+        chat_server.store.close()
 
-    # Error handling
-    for ready_socket in error_sockets:
-        chat_server.connection_terminated(chat_server.clients[ready_socket])
+    # Write the log records still waiting
+    chat_server.logger.close()
@@ -0,0 +1,333 @@
+#########################################
+# run_server_async.py                   #
+# The code to run the chat server on    #
+# an asyncio event loop                 #
+# by Kenji Takahashi-Rial               #
+#########################################
+
+import asyncio
+import os
+import signal
+import socket
+
+from room import Room
+from server import Server
+from server.config import configure
+from server.listener import LISTEN_BACKLOG
+from server.messaging import SOCKET_BUFFER
+from server.metrics import REQUEST_BUFFER
+from server.storage import Store
+
+# Bytes the transport may buffer before sends report a full socket
+WRITE_BUFFER_LIMIT = 64 * 1024
+
+
+###############################################################################
+#                                Stream Socket                                #
+###############################################################################
+
+
+class StreamSocket():
+    """
+    Gives an asyncio stream the parts of the socket interface that the
+    Server object uses, so the same handlers run unchanged
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+
+        # Data read by the connection task, handed out by recv()
+        self.pending = b""
+
+        # Task waiting for the transport to drain, if any
+        self.drain_task = None
+
+    def send(self, data):
+        # Behave like a full non-blocking socket so the server queues
+        # the data instead of growing the transport buffer forever
+        if self.writer.transport.get_write_buffer_size() >= \
+                WRITE_BUFFER_LIMIT:
+            raise BlockingIOError
+
+        self.writer.write(data)
+
+        return len(data)
+
+    def sendmsg(self, buffers):
+        if self.writer.transport.get_write_buffer_size() >= \
+                WRITE_BUFFER_LIMIT:
+            raise BlockingIOError
+
+        self.writer.writelines(buffers)
+
+        return sum(map(len, buffers))
+
+    def notify_writable(self, callback, *args):
+        if self.drain_task is None:
+            self.drain_task = asyncio.ensure_future(
+                self.wait_writable(callback, *args))
+
+    async def wait_writable(self, callback, *args):
+        try:
+            await self.writer.drain()
+
+        except ConnectionError:
+            pass
+
+        self.drain_task = None
+
+        callback(*args)
+
+    def setblocking(self, flag):
+        pass
+
+    def recv(self, size):
+        data = self.pending[:size]
+        self.pending = self.pending[size:]
+
+        return data
+
+    def recv_into(self, buffer):
+        data = self.recv(len(buffer))
+        buffer[:len(data)] = data
+
+        return len(data)
+
+    def getsockname(self):
+        return self.writer.get_extra_info('sockname')
+
+    def getpeername(self):
+        return self.writer.get_extra_info('peername')
+
+    def setsockopt(self, *args):
+        self.writer.get_extra_info('socket').setsockopt(*args)
+
+    def fileno(self):
+        return self.writer.get_extra_info('socket').fileno()
+
+    def close(self):
+        self.writer.close()
+
+
+###############################################################################
+#                                Initial Setup                                #
+###############################################################################
+
+
+IP_ADDRESS = os.environ.get("HOST",
+                            socket.gethostbyname(socket.gethostname()))
+PORT = int(os.environ.get("PORT", 1081))
+
+# Local port of the plaintext metrics endpoint, 0 turns it off
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 1082))
+
+# Port of the JSON lines listener for bots, 0 turns it off
+JSON_PORT = int(os.environ.get("JSON_PORT", 1091))
+
+# Connections the kernel queues until the server accepts them
+BACKLOG = int(os.environ.get("BACKLOG", LISTEN_BACKLOG))
+
+# SQLite file accounts and rooms are saved to, empty keeps them in memory
+DATABASE = os.environ.get("DATABASE", "chat.db")
+
+rooms = {"chat": Room("chat", None),
+         "hottub": Room("hottub", None),
+         "PAD": Room("PAD", None),
+         "anime": Room("anime", None)}
+
+# Created once the listening socket exists
+chat_server = None
+
+
+###############################################################################
+#                               Connection Task                               #
+###############################################################################
+
+
+async def handle_connection(reader, writer, json=False):
+    """
+    Description:
+        Reads from one client until it disconnects, dispatching through
+        the same Server functions as the select loop
+    Arguments:
+        The asyncio StreamReader of the connection
+        The asyncio StreamWriter of the connection
+        Whether the client speaks the JSON lines protocol
+    Return Value:
+        None
+    """
+
+    client_socket = StreamSocket(reader, writer)
+
+    # The event loop accepted the connection, the server still checks it
+    # against the connection caps
+    client = chat_server.admit(client_socket,
+                               writer.get_extra_info('peername'), json)
+
+    if client is None:
+        return
+
+    chat_server.flush_pending()
+
+    # Run until the server drops the client
+    while client_socket in chat_server.clients:
+        try:
+            client_socket.pending = await reader.read(SOCKET_BUFFER)
+
+        # The server is shutting down, drop the client like a hang-up
+        except (ConnectionError, asyncio.CancelledError):
+            client_socket.pending = b""
+
+        # Get data and process it
+        messages = chat_server.receive(client)
+
+        if messages is not False:
+            for data in messages:
+                # Stop after commands like /quit
+                if client.closing:
+                    break
+
+                chat_server.process(data, client)
+
+        # Send everything queued for every client, one write each
+        chat_server.flush_pending()
+
+        # Disconnect clients that failed or could not keep up
+        chat_server.close_pending()
+
+        # Wait for this client's buffered replies to go out
+        try:
+            await writer.drain()
+
+        except ConnectionError:
+            pass
+
+
+async def handle_json(reader, writer):
+    await handle_connection(reader, writer, True)
+
+
+def hashed():
+    """
+    Description:
+        Hands finished password hashes back to the clients waiting for
+        them and sends the replies
+    Arguments:
+        None
+    Return Value:
+        None
+    """
+
+    chat_server.hasher.ready()
+
+    chat_server.flush_pending()
+    chat_server.close_pending()
+
+
+async def handle_metrics(reader, writer):
+    """
+    Description:
+        Answers one request to the plaintext metrics endpoint
+    Arguments:
+        The asyncio StreamReader of the connection
+        The asyncio StreamWriter of the connection
+    Return Value:
+        None
+    """
+
+    try:
+        await reader.read(REQUEST_BUFFER)
+
+        body = chat_server.metrics.render(chat_server)
+
+        writer.write(b"HTTP/1.0 200 OK\r\n" +
+                     b"Content-Type: text/plain; version=0.0.4\r\n" +
+                     f"Content-Length: {len(body)}\r\n\r\n"
+                     .encode('utf-8') + body)
+        await writer.drain()
+
+    except ConnectionError:
+        pass
+
+    writer.close()
+
+
+async def main():
+    global chat_server
+
+    listener = await asyncio.start_server(handle_connection,
+                                          IP_ADDRESS, PORT,
+                                          reuse_address=True,
+                                          backlog=BACKLOG)
+
+    # Create the server object
+    chat_server = Server(listener.sockets[0], rooms, use_selector=False)
+
+    # Load the saved accounts and rooms
+    if DATABASE:
+        chat_server.store = Store(DATABASE, chat_server.logger)
+        chat_server.passwords = chat_server.store.load(rooms)
+
+    chat_server.backlog = BACKLOG
+
+    # Every other setting read from the environment (see server/config.py)
+    configure(chat_server)
+
+    if METRICS_PORT:
+        await asyncio.start_server(handle_metrics, "127.0.0.1",
+                                   METRICS_PORT, reuse_address=True)
+
+        print(f"\nServing metrics on 127.0.0.1:{METRICS_PORT}...\n")
+
+    if JSON_PORT:
+        json_listener = await asyncio.start_server(handle_json, IP_ADDRESS,
+                                                   JSON_PORT,
+                                                   reuse_address=True,
+                                                   backlog=BACKLOG)
+
+        print(f"\nListening for JSON lines on {IP_ADDRESS}:{JSON_PORT} " +
+              "(asyncio)...\n")
+
+    print(f"\nListening for connections on {IP_ADDRESS}:{PORT} " +
+          "(asyncio)...\n")
+
+    loop = asyncio.get_running_loop()
+
+    # Finished password hashes wake the loop through a socket pair
+    loop.add_reader(chat_server.hasher.socket, hashed)
+
+    # Stop cleanly on SIGTERM so queued changes are saved
+    stopped = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stopped.set)
+
+    try:
+        async with listener:
+            await stopped.wait()
+
+    finally:
+        if JSON_PORT:
+            json_listener.close()
+
+        # Commit the changes still waiting to be written
+        if chat_server.store is not None:
+            chat_server.store.close()
+
+        # Write the log records still waiting
+        chat_server.logger.close()
+
+
+if __name__ == "__main__":
+    # Use the faster event loop when it is installed
+    try:
+        import uvloop
+        uvloop.install()
+
+    except ImportError:
+        pass
+
+    try:
+        asyncio.run(main())
+
+    except KeyboardInterrupt:
+        pass
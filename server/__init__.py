@@ -4,22 +4,71 @@
 # by Kenji Takahashi-Rial                                                     #
 ###############################################################################
 
+import collections
+import itertools
+import selectors
+
+from .compression import COMPRESSION, COMPRESSION_LEVEL, \
+    COMPRESSION_SHARED
+from .hashing import Hasher
+from .history import HISTORY_COUNT, HISTORY_BYTES, HISTORY_BUDGET, \
+    HISTORY_REPLAY
+from .listener import LISTEN_BACKLOG, MAX_CONNECTIONS, MAX_PER_ADDRESS, \
+    TCP_NODELAY, TCP_KEEPALIVE, SEND_BUFFER, RECEIVE_BUFFER
+from .log import Log
+from .memory import LINE_LIMIT, MEMORY_BUDGET, MEMORY_INTERVAL
+from .messaging import SOCKET_BUFFER
+from .metrics import Metrics
+from .outbound import OUTBOUND_HIGH_WATER, OUTBOUND_LOW_WATER, SLOW_POLICIES
+from .ratelimit import RATE_LIMITS, RATE_PENALTIES
+from .telnet import TELNET_NEGOTIATION
+from .timers import TimingWheel, LOGIN_TIMEOUT, IDLE_TIMEOUT, KEEPALIVE
+
 
 class Server():
 
     from .commands import command
-    from .messaging import send, receive, connection_terminated, \
-        initialize_client, set_username, process, distribute
+    from .events import register, unregister, set_writable, poll, \
+        call_later, run_timers, accept, serve_forever
+    from .cluster import relay
+    from .batching import batch, flush_batch
+    from .compression import start_compression, end_compression, \
+        compress_outbound
+    from .directory import room_directory
+    from .timers import watch, turn_wheel
+    from .history import remember, replay, clear_history
+    from .jsonlines import serve_json, unframe
+    from .listener import accept_all, admit, release_address
+    from .log import log
+    from .memory import memory_usage, check_memory, line_too_long
+    from .telnet import negotiate
+    from .metrics import serve_metrics
+    from .ratelimit import make_buckets, rate_limited, assign_buckets, \
+        release_buckets, expire_buckets
+    from .outbound import write, prompt, flush, flush_pending, \
+        close_later, close_pending
+    from .messaging import send, send_lines, receive, \
+        connection_terminated, initialize_client, set_username, process, \
+        resume, distribute, online, notify
 
-    def __init__(self, server_socket, rooms={}):
+    def __init__(self, server_socket, rooms={}, use_selector=True):
         self.socket = server_socket
 
         self.address = (f"{server_socket.getsockname()[0]}:" +
                         f"{server_socket.getsockname()[1]}")
 
-        # A list of all sockets connected to the server
+        # Watches every socket connected to the server
         # including the server socket, itself
-        self.sockets = [server_socket]
+        # Uses epoll on Linux, so there is no limit on descriptors
+        # None when another event loop (asyncio) owns the sockets
+        self.selector = None
+
+        if use_selector:
+            self.selector = selectors.DefaultSelector()
+
+            # accept() takes connections until the backlog is empty
+            server_socket.setblocking(False)
+            self.register(server_socket, self.accept)
 
         # A dictionary with the client socket as the key
         # and the client object as the value
@@ -41,14 +90,156 @@ class Server():
         # and a room object as a value
         self.rooms = rooms
 
+        # The " * room (users)" lines of /rooms, None until they are
+        # needed again after a room or its members changed
+        # (see directory.py)
+        self.directory = None
+
+        # Every read goes into this buffer before it is split into lines
+        self.receive_buffer = bytearray(SOCKET_BUFFER)
+        self.receive_view = memoryview(self.receive_buffer)
+
+        # Outbound queue limits in bytes and the policy for clients
+        # that cannot keep up (see outbound.py)
+        self.high_water = OUTBOUND_HIGH_WATER
+        self.low_water = OUTBOUND_LOW_WATER
+        self.slow_policy = SLOW_POLICIES[0]
+
+        # A dictionary with the policy as the key and the number of
+        # times it was applied as the value
+        self.slow_counts = {policy: 0 for policy in SLOW_POLICIES}
+
+        # The listen() backlog of the listening sockets the server opens
+        # itself, and the caps on connections at once and from one IP
+        # address, 0 is no cap (see listener.py)
+        self.backlog = LISTEN_BACKLOG
+        self.max_connections = MAX_CONNECTIONS
+        self.max_per_address = MAX_PER_ADDRESS
+
+        # A Counter with the host as the key and the number of its
+        # connections as the value
+        self.addresses = collections.Counter()
+
+        # Socket options of every new connection, 0 buffer sizes keep the
+        # kernel's defaults
+        self.tcp_nodelay = TCP_NODELAY
+        self.tcp_keepalive = TCP_KEEPALIVE
+        self.socket_send_buffer = SEND_BUFFER
+        self.socket_receive_buffer = RECEIVE_BUFFER
+
+        # Whether new telnet connections are asked to edit lines
+        # themselves and report their window size (see telnet.py)
+        self.telnet_negotiation = TELNET_NEGOTIATION
+
+        # Whether clients may have what they are sent compressed, the zlib
+        # level and the size of writes compressed once for every client
+        # they are queued for (see compression.py)
+        self.compression = COMPRESSION
+        self.compression_level = COMPRESSION_LEVEL
+        self.compression_shared = COMPRESSION_SHARED
+
+        # A dictionary with the id() of a shared write as the key and a
+        # (write, compressed blocks, Adler-32) tuple as the value, emptied
+        # every loop iteration
+        self.shared_blocks = {}
+
+        # Bytes of one line of input, and the bytes held for every
+        # connection and the history together, 0 is no budget
+        # (see memory.py)
+        self.line_limit = LINE_LIMIT
+        self.memory_budget = MEMORY_BUDGET
+        self.memory_interval = MEMORY_INTERVAL
+
+        # When the budget was last checked and whether the server was
+        # over it then
+        self.memory_checked = 0
+        self.over_budget = False
+
+        # A set of client objects with messages queued since the last
+        # flush_pending()
+        self.pending = set()
+
+        # A list of client objects to disconnect after the current event
+        self.closing = []
+
+        # Counters and histograms for /stats and the metrics endpoint
+        # (see metrics.py)
+        self.metrics = Metrics()
+
+        # Set of usernames allowed to use server owner commands like
+        # /stats once they have set a password
+        self.owners = set()
+
+        # A dictionary with the kind of input as the key and a tuple of
+        # (tokens per second, burst) as the value, kinds left out are not
+        # limited, and the penalty for clients out of tokens
+        # (see ratelimit.py)
+        self.rate_limits = dict(RATE_LIMITS)
+        self.rate_penalty = RATE_PENALTIES[0]
+
+        # A dictionary with the kind of input as the key and the number
+        # of lines that were rate limited as the value
+        self.rate_limit_counts = {kind: 0 for kind in RATE_LIMITS}
+
+        # A dictionary with the username as the key and a dictionary of
+        # that user's token buckets as the value, kept after the user
+        # disconnects until the buckets are full again
+        self.user_buckets = {}
+
+        # A heap of (time, sequence, callback, arguments) tuples of
+        # callbacks waiting to run (see call_later())
+        self.timers = []
+        self.timer_sequence = itertools.count()
+
+        # Connection timeouts in seconds (see timers.py), 0 turns idle
+        # timeouts and keepalive probes off
+        self.login_timeout = LOGIN_TIMEOUT
+        self.idle_timeout = IDLE_TIMEOUT
+        self.keepalive = KEEPALIVE
+
+        # Every client with a timeout, turned once a tick by call_later()
+        # while it holds any
+        self.wheel = TimingWheel()
+        self.wheel_turning = False
+
+        # Room history limits (see history.py), messages and bytes per
+        # room, bytes across every room and messages replayed on join
+        self.history_count = HISTORY_COUNT
+        self.history_bytes = HISTORY_BYTES
+        self.history_budget = HISTORY_BUDGET
+        self.history_replay = HISTORY_REPLAY
+
+        # Total bytes of history across every room
+        self.history_size = 0
+
+        # An ordered dictionary with the room objects that have history
+        # as the keys (least recently active first) and None as the values
+        self.history_rooms = collections.OrderedDict()
+
+        # Writes log records from a thread so a slow stdout never
+        # blocks the event loop (see log.py)
+        self.logger = Log()
+
+        # Hashes passwords off the event loop (see hashing.py)
+        self.hasher = Hasher(self.logger)
+
+        if use_selector:
+            self.register(self.hasher.socket, self.hasher.ready)
+
+        # The database accounts and rooms are saved to (see storage.py),
+        # None keeps everything in memory only
+        self.store = None
+
+        # The connection to the other workers when running as a cluster
+        # (see cluster.py), None when running as a single process
+        self.bus = None
+
     def __str__(self):
         server_socket_str = f"server socket: {self.socket}\n\n"
-        sockets_str = f"sockets: {self.sockets}\n\n"
         clients_str = f"clients: {self.clients}\n\n"
         rooms_str = f"rooms: {self.rooms}\n\n"
 
         return (server_socket_str +
-                sockets_str +
                 clients_str +
                 rooms_str +
                 header_str)
@@ -0,0 +1,94 @@
+###############################################################################
+# batching.py                                                                 #
+# The broadcast batching functions for the server object                      #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+# A room with a batch window does not write each message to its members.
+# Messages are collected for up to the window and then written as one
+# buffer, shared by every member, so a busy room costs one send per member
+# per window instead of one per message. Membership changes flush the
+# batch first, so every member gets exactly the messages sent while they
+# were in the room.
+
+# Longest batch window a room can have in seconds
+MAX_BATCH_WINDOW = 0.05
+
+# Bytes collected before a batch is flushed without waiting for its window
+BATCH_BYTES = 16 * 1024
+
+
+def batch(self, room, payload, framed):
+    """
+    Description:
+        Adds an encoded message to a room's batch, flushing it once the
+        batch is full or its window has passed
+    Arguments:
+        A Server object
+        The room object with a batch window
+        The encoded message
+        The message as a JSON lines frame
+    Return Value:
+        None
+    """
+
+    # The first message of a batch sets the deadline for the whole batch
+    if len(room.batch) == 0:
+        self.call_later(room.batch_window, self.flush_batch, room)
+
+    room.batch.append(payload)
+    room.batch_frames.append(framed)
+    room.batch_size += len(payload)
+
+    if room.batch_size >= BATCH_BYTES:
+        self.flush_batch(room)
+
+
+def flush_batch(self, room):
+    """
+    Description:
+        Writes a room's batched messages to every member as one buffer
+    Arguments:
+        A Server object
+        The room object
+    Return Value:
+        None
+    """
+
+    if len(room.batch) == 0:
+        return
+
+    if len(room.batch) == 1:
+        data = room.batch[0]
+
+    else:
+        data = b"".join(room.batch)
+
+    # Only joined once a JSON lines member, or a member that edits
+    # lines itself and needs them without carriage returns, needs them
+    frames = room.batch_frames
+    framed = None
+    payloads = room.batch
+    plain = None
+
+    room.batch = []
+    room.batch_frames = []
+    room.batch_size = 0
+
+    for user in room.users:
+        user.needs_prompt = True
+
+        if user.json:
+            if framed is None:
+                framed = b"".join(frames)
+
+            self.write(framed, user)
+
+        elif user.line_mode:
+            if plain is None:
+                plain = b"".join(payload[1:] for payload in payloads)
+
+            self.write(plain, user)
+
+        else:
+            self.write(data, user)
@@ -0,0 +1,408 @@
+###############################################################################
+# cluster.py                                                                  #
+# The cluster functions for the server object                                 #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+# Each worker process runs its own Server on a shared SO_REUSEPORT port and
+# keeps a Bus connection to the hub process. Workers publish room traffic
+# and directory changes to the hub, which relays them to every other worker.
+# Usernames and new room names are claimed through the hub, which answers
+# every claim in order, so uniqueness holds across the whole cluster.
+
+import collections
+import json
+import selectors
+import socket
+
+from room import Room
+
+from .commands import set_batch_window
+
+# Bytes read from a cluster socket at once
+BUS_BUFFER = 65536
+
+
+def encode(message):
+    """
+    Description:
+        Encodes a cluster message as one line of JSON
+    Arguments:
+        A list starting with the message type
+    Return Value:
+        The encoded bytes
+    """
+
+    return (json.dumps(message) + "\n").encode('utf-8')
+
+
+###############################################################################
+#                                     Bus                                     #
+###############################################################################
+
+
+class Bus():
+    """
+    A worker's connection to the hub
+    """
+
+    def __init__(self, path):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+
+        # Bytes of a message that has not been completely received
+        self.buffer = b""
+
+        # Messages from other workers waiting to be handled by relay()
+        self.inbox = collections.deque()
+
+        # Answers from the hub to claim requests
+        self.replies = collections.deque()
+
+        # Set of usernames logged in on any worker
+        self.users = set()
+
+        # A dictionary with the room name as the key and a dictionary
+        # with the usernames in the room on any worker as the keys
+        # (in join order) and None as the values
+        self.members = collections.defaultdict(dict)
+
+    def send(self, *message):
+        # The hub never blocks on a worker, so this cannot deadlock
+        self.socket.sendall(encode(list(message)))
+
+    def read(self, events=selectors.EVENT_READ):
+        data = self.socket.recv(BUS_BUFFER)
+
+        if len(data) == 0:
+            raise ConnectionError("cluster hub closed the connection")
+
+        lines = (self.buffer + data).split(b"\n")
+        self.buffer = lines.pop()
+
+        for line in lines:
+            message = json.loads(line)
+
+            if message[0] == "reply":
+                self.replies.append(message[1])
+
+            else:
+                self.inbox.append(message)
+
+    def request(self, *message):
+        self.send(*message)
+
+        # Messages read while waiting are kept for relay()
+        while len(self.replies) == 0:
+            self.read()
+
+        return self.replies.popleft()
+
+    def wait_ready(self):
+        while ["ready"] not in self.inbox:
+            self.read()
+
+        self.inbox.remove(["ready"])
+
+    def claim(self, kind, name):
+        return self.request("claim", kind, name)
+
+    def release(self, kind, name):
+        self.send("release", kind, name)
+
+    def logged_in(self, username):
+        self.users.add(username)
+        self.send("online", username, True)
+
+    def logged_out(self, username):
+        self.users.discard(username)
+        self.send("online", username, False)
+
+    def joined(self, room, username):
+        self.members[room][username] = None
+        self.send("member", room, username, True)
+
+    def left(self, room, username):
+        self.members[room].pop(username, None)
+        self.send("member", room, username, False)
+
+
+###############################################################################
+#                                     Hub                                     #
+###############################################################################
+
+
+class Hub():
+    """
+    The broker process that relays messages between workers
+    """
+
+    def __init__(self, path, workers):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.bind(path)
+        self.socket.listen(workers)
+
+        # The number of workers to wait for before starting
+        self.workers = workers
+
+        self.selector = selectors.DefaultSelector()
+
+        # A dictionary with the worker socket as the key and a list of
+        # [bytes of an incomplete message, bytearray of queued output]
+        self.connections = {}
+
+        # A dictionary with a (kind, name) tuple as the key and the
+        # socket of the worker holding the claim as the value
+        self.claims = {}
+
+    def queue(self, worker, data):
+        output = self.connections[worker][1]
+
+        if len(output) == 0:
+            self.selector.modify(worker,
+                                 selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+        output += data
+
+    def flush(self, worker):
+        output = self.connections[worker][1]
+
+        try:
+            del output[:worker.send(output)]
+
+        except BlockingIOError:
+            pass
+
+        if len(output) == 0:
+            self.selector.modify(worker, selectors.EVENT_READ)
+
+    def handle(self, worker, line):
+        message = json.loads(line)
+
+        if message[0] == "claim":
+            key = (message[1], message[2])
+            granted = self.claims.setdefault(key, worker) is worker
+
+            self.queue(worker, encode(["reply", granted]))
+
+        elif message[0] == "release":
+            key = (message[1], message[2])
+
+            if self.claims.get(key) is worker:
+                del self.claims[key]
+
+        # Everything else goes to every other worker, in order
+        else:
+            for other in self.connections:
+                if other is not worker:
+                    self.queue(other, line + b"\n")
+
+    def lost(self, worker):
+        self.selector.unregister(worker)
+        del self.connections[worker]
+        worker.close()
+
+        # Users of a failed worker are gone everywhere
+        usernames = []
+
+        for key, owner in list(self.claims.items()):
+            if owner is worker:
+                del self.claims[key]
+
+                if key[0] == "user":
+                    usernames.append(key[1])
+
+        for other in self.connections:
+            self.queue(other, encode(["lost", usernames]))
+
+    def serve_forever(self):
+        # Wait for every worker so none of them misses a message
+        while len(self.connections) < self.workers:
+            worker, address = self.socket.accept()
+            worker.setblocking(False)
+
+            self.connections[worker] = [b"", bytearray()]
+            self.selector.register(worker, selectors.EVENT_READ)
+
+        for worker in self.connections:
+            self.queue(worker, encode(["ready"]))
+
+        while len(self.connections) > 0:
+            for key, events in self.selector.select():
+                worker = key.fileobj
+
+                if events & selectors.EVENT_WRITE:
+                    self.flush(worker)
+
+                if not events & selectors.EVENT_READ:
+                    continue
+
+                try:
+                    data = worker.recv(BUS_BUFFER)
+
+                except ConnectionError:
+                    data = b""
+
+                if len(data) == 0:
+                    self.lost(worker)
+
+                    continue
+
+                lines = (self.connections[worker][0] + data).split(b"\n")
+                self.connections[worker][0] = lines.pop()
+
+                for line in lines:
+                    self.handle(worker, line)
+
+
+###############################################################################
+#                              Server Functions                               #
+###############################################################################
+
+
+def relay(self):
+    """
+    Description:
+        Handles the messages other workers sent through the hub
+        Called once per event loop iteration
+    Arguments:
+        A Server object
+    Return Value:
+        None
+    """
+
+    while len(self.bus.inbox) > 0:
+        message = self.bus.inbox.popleft()
+
+        HANDLERS[message[0]](self, *message[1:])
+
+
+def relayed_distribute(self, room, data, except_usernames, history, chat):
+    if room in self.rooms:
+        except_users = {self.usernames[username]
+                        for username in except_usernames
+                        if username in self.usernames}
+
+        self.distribute(data, [room], None, except_users, False, history,
+                        chat)
+
+
+def relayed_send(self, username, data):
+    if username in self.usernames:
+        self.send(data, self.usernames[username])
+
+
+def relayed_remove(self, username, room, data):
+    # Only the worker the user is connected to can remove them
+    user = self.usernames.get(username)
+
+    if user is None or user.room is None or user.room.name != room:
+        return
+
+    self.flush_batch(user.room)
+
+    del user.room.users[user]
+    self.directory = None
+    user.room = None
+    user.typing = ""
+
+    self.bus.left(room, username)
+
+    self.send(data, user)
+
+
+def relayed_member(self, room, username, joined):
+    # /rooms counts the users on every worker
+    self.directory = None
+
+    if joined:
+        self.bus.members[room][username] = None
+
+    else:
+        self.bus.members[room].pop(username, None)
+
+
+def relayed_online(self, username, online):
+    if online:
+        self.bus.users.add(username)
+
+    else:
+        self.bus.users.discard(username)
+
+
+def relayed_lost(self, usernames):
+    self.directory = None
+
+    for username in usernames:
+        self.bus.users.discard(username)
+
+        for members in self.bus.members.values():
+            members.pop(username, None)
+
+
+def relayed_new(self, name, owner):
+    self.rooms[name] = Room(name, None)
+    self.rooms[name].owner = owner
+    self.directory = None
+
+
+def relayed_delete(self, name):
+    room = self.rooms.pop(name, None)
+
+    if room is None:
+        return
+
+    self.directory = None
+
+    self.flush_batch(room)
+    self.clear_history(room)
+
+    for user in room.users:
+        user.room = None
+        user.typing = ""
+
+        self.send(f"The room was deleted: {room.name}", user)
+
+    self.bus.members.pop(name, None)
+
+
+def relayed_batch(self, room, window):
+    if room in self.rooms:
+        set_batch_window(self, self.rooms[room], window)
+
+
+def relayed_admin(self, room, username, admin):
+    if room in self.rooms:
+        if admin:
+            self.rooms[room].admins.add(username)
+
+        else:
+            self.rooms[room].admins.discard(username)
+
+
+def relayed_ban(self, room, username, banned):
+    if room in self.rooms:
+        if banned:
+            self.rooms[room].banned.add(username)
+
+        else:
+            self.rooms[room].banned.discard(username)
+
+
+def relayed_password(self, username, password):
+    self.passwords[username] = password
+
+
+# Cluster message cases dictionary
+HANDLERS = {"distribute": relayed_distribute,
+            "send": relayed_send,
+            "remove": relayed_remove,
+            "member": relayed_member,
+            "online": relayed_online,
+            "lost": relayed_lost,
+            "new": relayed_new,
+            "delete": relayed_delete,
+            "batch": relayed_batch,
+            "admin": relayed_admin,
+            "ban": relayed_ban,
+            "password": relayed_password}
@@ -5,14 +5,21 @@
 ###############################################################################
 
 import socket
+import time
 
 from room import Room
 
+from .batching import MAX_BATCH_WINDOW
+from .directory import list_options, list_page, page_footer
+from .memory import client_usage
+
 
 def show_rooms(self, args, client):
     """
     Description:
         Display the available rooms
+        "page <n>" shows another page, "prefix <text>" only the rooms
+        whose name starts with the text
     Arguments:
         A Server object
         A list of arguments
@@ -22,13 +29,37 @@ def show_rooms(self, args, client):
         False if an error occurred
     """
 
-    self.send("Available rooms:", client)
+    options = list_options(args)
+
+    if options is None or len(options[0]) > 0:
+        self.send("Usage: /rooms [page <n>] [prefix <text>]", client)
+
+        return False
+
+    args, page, prefix = options
+
+    rooms = self.room_directory()
+
+    if prefix:
+        rooms = [room for room in rooms if room[0].startswith(prefix)]
+
+        if len(rooms) == 0:
+            self.send(f"No rooms start with: {prefix}", client)
 
-    for room in self.rooms:
-        room_str = f" * {room} ({len(self.rooms[room].users)})"
+            return True
 
+    shown, pages = list_page(rooms, page)
+
+    if len(shown) == 0:
+        self.send(f"No page {page}, there are {pages}", client)
+
+        return False
+
+    lines = ["Available rooms:"]
+
+    for name, room_str in shown:
         # Get room object
-        room = self.rooms[room]
+        room = self.rooms[name]
 
         # Tag room appropriately
         if client.username in room.admins:
@@ -43,9 +74,16 @@ def show_rooms(self, args, client):
         if client.username in room.banned:
             room_str += " (banned)"
 
-        self.send(room_str, client)
+        lines.append(room_str)
 
-    self.send("End list", client)
+    if pages > 1:
+        lines.append(page_footer("/rooms prefix " + prefix if prefix
+                                 else "/rooms", page, pages))
+
+    lines.append("End list")
+
+    # The whole page goes out as one write
+    self.send_lines(lines, client)
 
     return True
 
@@ -91,11 +129,20 @@ def join(self, args, client):
 
         return False
 
+    # Messages batched before the user joined are not for them
+    self.flush_batch(room)
+
     # Add the username to the rooms dictionary
     # and the room to the client object
-    room.users.append(client)
+    room.users[client] = None
     client.room = room
 
+    # /rooms shows the new number of users
+    self.directory = None
+
+    if self.bus is not None:
+        self.bus.joined(room.name, client.username)
+
     # Tag user appropriately
     join_user = client.username
     if client.username == room.owner:
@@ -106,11 +153,14 @@ def join(self, args, client):
 
     # Notify other users that a new user has joined
     self.distribute(f"{join_user} joined the room", [args[0]],
-                    None, [client])
+                    None, {client})
 
     # Notify the user that they joined the room
     self.send(f"Joined the room: {args[0]}", client)
 
+    # Catch the user up on the conversation
+    self.replay(client, room, self.history_replay)
+
     # Show the client who else is in the room
     return who(self, [], client)
 
@@ -120,6 +170,8 @@ def who(self, args, client):
     Description:
         Displays who is in a room
         No arguments defaults to the user's current room
+        "page <n>" shows another page, "prefix <text>" only the users
+        whose name starts with the text
     Arguments:
         A Server object
         A list of arguments
@@ -129,6 +181,15 @@ def who(self, args, client):
         False if an error occurred
     """
 
+    options = list_options(args)
+
+    if options is None:
+        self.send("Usage: /who [room] [page <n>] [prefix <text>]", client)
+
+        return False
+
+    args, page, prefix = options
+
     # Multiple arguments
     if len(args) > 1:
         self.send("Room name cannot contain spaces", client)
@@ -150,32 +211,64 @@ def who(self, args, client):
 
         return False
 
+    # Usernames in join order, from every worker when running as a cluster
+    if self.bus is not None:
+        usernames = list(self.bus.members[args[0]])
+
+    else:
+        usernames = [user.username for user in self.rooms[args[0]].users]
+
     # Room is empty
-    if len(self.rooms[args[0]].users) == 0:
+    if len(usernames) == 0:
         self.send(f"No users in: {args[0]}", client)
 
         return True
 
-    # Iterate through users in room
-    self.send(f"Users in: {args[0]} ({len(self.rooms[args[0]].users)})",
-              client)
+    total = len(usernames)
+
+    if prefix:
+        usernames = [username for username in usernames
+                     if username.startswith(prefix)]
+
+        if len(usernames) == 0:
+            self.send(f"No users in {args[0]} start with: {prefix}",
+                      client)
+
+            return True
 
-    for user in self.rooms[args[0]].users:
-        who_user = user.username
+    shown, pages = list_page(usernames, page)
+
+    if len(shown) == 0:
+        self.send(f"No page {page}, there are {pages}", client)
+
+        return False
+
+    lines = [f"Users in: {args[0]} ({total})"]
+
+    # Iterate through users on the page
+    for username in shown:
+        who_user = username
 
         # Tag user appropriately
-        if user.username == self.rooms[args[0]].owner:
+        if username == self.rooms[args[0]].owner:
             who_user += " (owner)"
 
-        if user.username in self.rooms[args[0]].admins:
+        if username in self.rooms[args[0]].admins:
             who_user += " (admin)"
 
-        if user.username == client.username:
+        if username == client.username:
             who_user += " (you)"
 
-        self.send(f" * {who_user}", client)
+        lines.append(f" * {who_user}")
 
-    self.send("End list", client)
+    if pages > 1:
+        lines.append(page_footer(f"/who {args[0]} prefix {prefix}" if prefix
+                                 else f"/who {args[0]}", page, pages))
+
+    lines.append("End list")
+
+    # The whole page goes out as one write
+    self.send_lines(lines, client)
 
     return True
 
@@ -208,13 +301,20 @@ def leave(self, args, client, exit=False):
         leave_user += " (admin)"
 
     self.distribute(f"{leave_user} left the room", [client.room.name],
-                    None, [client])
+                    None, {client})
 
     # Don't print the leave message when exiting
     if not exit:
         self.send(f"Left the room: {client.room.name}", client)
 
-    client.room.users.remove(client)
+    self.flush_batch(client.room)
+
+    del client.room.users[client]
+    self.directory = None
+
+    if self.bus is not None:
+        self.bus.left(client.room.name, client.username)
+
     client.room = None
 
     return True
@@ -241,23 +341,22 @@ def private(self, args, client):
 
         return False
 
-    if args[0] not in self.usernames:
+    if not self.online(args[0]):
         self.send(f"User not found: {args[0]}", client)
 
         return False
 
-    send_to = self.usernames[args[0]]
-
     # No message to deliver, so do nothing
     if len(args) == 1:
-        client.socket.send("=> ".encode('utf-8'))
+        self.prompt(client)
 
         return True
 
     # Reconstruct message from args
     message = " ".join(args[1:])
 
-    sent_to = self.send(f"{client.username} (private): {message}", send_to)
+    # The user may be connected to another cluster worker
+    sent_to = self.notify(args[0], f"{client.username} (private): {message}")
     sent_from = self.send(f"{client.username} (private): {message}",
                           client)
 
@@ -287,6 +386,12 @@ def password(self, args, client):
 
     # Ask for old password or new password
     if client.setting_password == 0:
+        # Give up on the change if the user walks away
+        if self.login_timeout > 0:
+            client.deadline = time.monotonic() + self.login_timeout
+
+            self.watch(client)
+
         if client.username in self.passwords:
             self.send("Old password:", client)
 
@@ -298,17 +403,12 @@ def password(self, args, client):
             client.setting_password = 2
 
     elif client.setting_password == 1:
-        if args != self.passwords[client.username]:
-            self.send("Incorrect password", client)
-
-            client.setting_password = 0
-
-            return False
-
-        else:
-            self.send("New password:", client)
+        # Check the old password off the event loop, the client waits
+        client.parked = True
 
-            client.setting_password = 2
+        if not self.hasher.verify(args, self.passwords[client.username],
+                                  old_password_checked, self, client):
+            return hasher_busy(self, client)
 
     elif client.setting_password == 2:
         self.send("Confirm password:", client)
@@ -324,15 +424,97 @@ def password(self, args, client):
             return False
 
         else:
-            self.passwords[client.username] = args
-
-            self.send("Password set", client)
+            # Hash the new password off the event loop, the client waits
+            client.parked = True
 
-            client.setting_password = 0
+            if not self.hasher.hash(args, password_hashed, self, client):
+                return hasher_busy(self, client)
 
     return True
 
 
+def old_password_checked(self, client, correct):
+    """
+    Description:
+        Continues /setpassword once the old password has been checked
+    Arguments:
+        A Server object
+        The client object setting a password
+        True if the old password was correct
+    Return Value:
+        None
+    """
+
+    # Disconnected while waiting
+    if client.closing:
+        return
+
+    if not correct:
+        self.send("Incorrect password", client)
+
+        client.setting_password = 0
+
+    else:
+        self.send("New password:", client)
+
+        client.setting_password = 2
+
+    self.resume(client)
+
+
+def password_hashed(self, client, hashed):
+    """
+    Description:
+        Saves a new password once it has been hashed
+    Arguments:
+        A Server object
+        The client object setting a password
+        The hashed password (None if hashing failed)
+    Return Value:
+        None
+    """
+
+    if client.closing:
+        return
+
+    if hashed is None:
+        self.send("Password could not be set", client)
+
+    else:
+        self.passwords[client.username] = hashed
+
+        if self.bus is not None:
+            self.bus.send("password", client.username, hashed)
+
+        if self.store is not None:
+            self.store.save_password(client.username, hashed)
+
+        self.send("Password set", client)
+
+    client.setting_password = 0
+
+    self.resume(client)
+
+
+def hasher_busy(self, client):
+    """
+    Description:
+        Gives up on a password when too many are waiting to be hashed
+    Arguments:
+        A Server object
+        The client object that was waiting
+    Return Value:
+        False
+    """
+
+    self.send("Server busy, try again later", client)
+
+    client.setting_password = 0
+    client.parked = False
+
+    return False
+
+
 def new(self, args, client):
     """
     Description:
@@ -361,12 +543,21 @@ def new(self, args, client):
 
         return False
 
-    if args[0] in self.rooms:
+    # Another cluster worker may be creating the same room
+    if args[0] in self.rooms or (self.bus is not None and
+                                 not self.bus.claim("room", args[0])):
         self.send(f"Room already exists: {args[0]} ", client)
 
         return False
 
     self.rooms[args[0]] = Room(args[0], client)
+    self.directory = None
+
+    if self.bus is not None:
+        self.bus.send("new", args[0], client.username)
+
+    if self.store is not None:
+        self.store.save_room(self.rooms[args[0]])
 
     self.send(f"You created a room: {args[0]}", client)
 
@@ -409,7 +600,7 @@ def admin(self, args, client):
     for username in args:
 
         if username not in self.passwords:
-            if username not in self.usernames:
+            if not self.online(username):
                 self.send(f"User does not exist: {username}", client)
 
             else:
@@ -419,8 +610,8 @@ def admin(self, args, client):
             no_errors = False
             continue
 
-        # Get user object
-        user = self.usernames[username]
+        # Get user object, None if on another cluster worker or offline
+        user = self.usernames.get(username)
 
         # Already admin
         if username in client.room.admins:
@@ -437,16 +628,23 @@ def admin(self, args, client):
             continue
 
         # Promote the user
-        client.room.admins.append(user.username)
+        client.room.admins.add(username)
+
+        if self.bus is not None:
+            self.bus.send("admin", client.room.name, username, True)
+
+        if self.store is not None:
+            self.store.save_admin(client.room.name, username, True)
 
         # Notify all parties that a user was kicked
-        self.send(f"You were promoted to admin in: {client.room.name}",
-                  user)
+        self.notify(username,
+                    f"You were promoted to admin in: {client.room.name}")
 
         self.send(f"Made admin: {username}", client)
 
         self.distribute(f"{username} was promoted to admin",
-                        [client.room.name], None, [client, user])
+                        [client.room.name], None,
+                        {client} if user is None else {client, user})
 
     return no_errors
 
@@ -486,7 +684,7 @@ def cancel_admin(self, args, client):
 
     for username in args:
 
-        if username not in self.usernames and username not in self.passwords:
+        if not self.online(username) and username not in self.passwords:
             self.send(f"User does not exist: {username}", client)
 
             no_errors = False
@@ -500,15 +698,20 @@ def cancel_admin(self, args, client):
 
         client.room.admins.remove(username)
 
+        if self.bus is not None:
+            self.bus.send("admin", client.room.name, username, False)
+
+        if self.store is not None:
+            self.store.save_admin(client.room.name, username, False)
+
         # Notify all parties that a user was banned
-        if username in self.usernames:
-            self.send(f"You were demoted from admin in: {client.room.name}",
-                      self.usernames[username])
+        self.notify(username,
+                    f"You were demoted from admin in: {client.room.name}")
 
         self.send(f"Revoked admin: {username}", client)
 
         self.distribute(f"{username} was demoted from admin",
-                        [client.room.name], None, [client])
+                        [client.room.name], None, {client})
 
     return no_errors
 
@@ -549,16 +752,23 @@ def kick(self, args, client):
 
     for username in args:
 
-        if username not in self.usernames and username not in self.passwords:
+        if not self.online(username) and username not in self.passwords:
             self.send(f"User does not exist: {username}", client)
 
             no_errors = False
             continue
 
-        # Get user object
-        user = self.usernames[username]
+        # Get user object, None if on another cluster worker or offline
+        user = self.usernames.get(username)
+
+        if user is None:
+            in_room = (self.bus is not None and
+                       username in self.bus.members[client.room.name])
 
-        if user not in client.room.users:
+        else:
+            in_room = user in client.room.users
+
+        if not in_room:
             self.send(f"User not in room: {username}", client)
 
             no_errors = False
@@ -588,19 +798,31 @@ def kick(self, args, client):
             no_errors = False
             continue
 
+        # The worker the user is connected to removes them
+        if user is None:
+            self.bus.send("remove", username, client.room.name,
+                          f"You were kicked from: {client.room.name}")
+
         # Actually remove the user
-        user.room = None
-        user.typing = ""
-        client.room.users.remove(user)
+        else:
+            user.room = None
+            user.typing = ""
+            self.flush_batch(client.room)
 
-        # Notify all parties that a user was kicked
-        self.send(f"You were kicked from: {client.room.name}",
-                  user)
+            del client.room.users[user]
+            self.directory = None
+
+            if self.bus is not None:
+                self.bus.left(client.room.name, username)
+
+            # Notify all parties that a user was kicked
+            self.send(f"You were kicked from: {client.room.name}",
+                      user)
 
         self.send(f"Kicked user: {username}", client)
 
         self.distribute(f"{username} was kicked",
-                        [client.room.name], None, [client])
+                        [client.room.name], None, {client})
 
     return no_errors
 
@@ -641,7 +863,7 @@ def ban(self, args, client):
 
     for username in args:
 
-        if username not in self.usernames and username not in self.passwords:
+        if not self.online(username) and username not in self.passwords:
             self.send(f"User does not exist: {username}", client)
 
             no_errors = False
@@ -677,26 +899,43 @@ def ban(self, args, client):
             no_errors = False
             continue
 
-        # Get user object
-        user = self.usernames[username]
+        # Get user object, None if on another cluster worker or offline
+        user = self.usernames.get(username)
 
         # Remove the user first
-        if user in client.room.users:
+        if user is not None and user in client.room.users:
             user.room = None
             user.typing = ""
-            client.room.users.remove(user)
+            self.flush_batch(client.room)
 
-        client.room.banned.append(user.username)
+            del client.room.users[user]
+            self.directory = None
+
+            if self.bus is not None:
+                self.bus.left(client.room.name, username)
+
+        client.room.banned.add(username)
+
+        if self.bus is not None:
+            self.bus.send("ban", client.room.name, username, True)
+
+        if self.store is not None:
+            self.store.save_ban(client.room.name, username, True)
 
         # Notify all parties that a user was banned
-        if username in self.usernames:
-            self.send(f"You were banned from: {client.room.name}",
-                      user)
+        # The worker the user is connected to removes them
+        if (user is None and self.bus is not None and
+                username in self.bus.members[client.room.name]):
+            self.bus.send("remove", username, client.room.name,
+                          f"You were banned from: {client.room.name}")
+
+        else:
+            self.notify(username, f"You were banned from: {client.room.name}")
 
         self.send(f"Banned user: {username}", client)
 
         self.distribute(f"{username} was banned",
-                        [client.room.name], None, [client])
+                        [client.room.name], None, {client})
 
     return no_errors
 
@@ -737,7 +976,7 @@ def unban(self, args, client):
 
     for username in args:
 
-        if username not in self.usernames and username not in self.passwords:
+        if not self.online(username) and username not in self.passwords:
             self.send(f"User does not exist: {username}", client)
 
             no_errors = False
@@ -760,15 +999,19 @@ def unban(self, args, client):
 
         client.room.banned.remove(username)
 
+        if self.bus is not None:
+            self.bus.send("ban", client.room.name, username, False)
+
+        if self.store is not None:
+            self.store.save_ban(client.room.name, username, False)
+
         # Notify all parties that a user was banned
-        if username in self.usernames:
-            self.send(f"Your were unbanned from: {client.room.name}",
-                      self.usernames[username])
+        self.notify(username, f"Your were unbanned from: {client.room.name}")
 
         self.send(f"Unbanned user: {username}", client)
 
         self.distribute(f"{username} was unbanned",
-                        [client.room.name], None, [client])
+                        [client.room.name], None, {client})
 
     return no_errors
 
@@ -808,6 +1051,8 @@ def delete(self, args, client):
     # Get the room object
     room = self.rooms[args[0]]
 
+    self.flush_batch(room)
+
     for user in room.users:
         user.room = None
         user.typing = ""
@@ -816,12 +1061,224 @@ def delete(self, args, client):
             self.send(f"The room was deleted: {room.name}", user)
 
     del self.rooms[args[0]]
+    self.directory = None
+
+    self.clear_history(room)
+
+    if self.bus is not None:
+        self.bus.members.pop(args[0], None)
+        self.bus.release("room", args[0])
+        self.bus.send("delete", args[0])
+
+    if self.store is not None:
+        self.store.delete_room(args[0])
 
     self.send(f"Deleted room: {args[0]}", client)
 
     return True
 
 
+def history(self, args, client):
+    """
+    Description:
+        Displays recent messages of the user's current room
+        No arguments shows every message the room keeps
+    Arguments:
+        A Server object
+        A list of arguments
+        The client object that issued the command
+    Return Value:
+        True if the command was carried out
+        False if an error occurred
+    """
+
+    if client.room is None:
+        self.send("Not in a room", client)
+
+        return False
+
+    if len(args) > 1 or (len(args) == 1 and
+                         (not args[0].isdigit() or int(args[0]) == 0)):
+        self.send("Usage: /history [n]", client)
+
+        return False
+
+    count = int(args[0]) if len(args) == 1 else self.history_count
+
+    self.send(f"Recent messages in: {client.room.name}", client)
+    self.replay(client, client.room, count)
+    self.send("End list", client)
+
+    return True
+
+
+def stats(self, args, client):
+    """
+    Description:
+        Displays the server metrics
+        Only server owners with a password can see them
+    Arguments:
+        A Server object
+        A list of arguments
+        The client object that issued the command
+    Return Value:
+        True if the command was carried out
+        False if an error occurred
+    """
+
+    if (client.username not in self.owners or
+            client.username not in self.passwords):
+        self.send("Only server owners can see stats", client)
+
+        return False
+
+    self.send_lines(["Server stats:"] + self.metrics.summary() +
+                    ["End list"], client)
+
+    return True
+
+
+def usage(self, args, client):
+    """
+    Description:
+        Displays the memory the server holds against its budget and the
+        connections holding the most, heaviest first
+        Only server owners with a password can see it
+        "page <n>" shows another page, "prefix <text>" only the users
+        whose name starts with the text
+    Arguments:
+        A Server object
+        A list of arguments
+        The client object that issued the command
+    Return Value:
+        True if the command was carried out
+        False if an error occurred
+    """
+
+    if (client.username not in self.owners or
+            client.username not in self.passwords):
+        self.send("Only server owners can see memory usage", client)
+
+        return False
+
+    options = list_options(args)
+
+    if options is None or len(options[0]) > 0:
+        self.send("Usage: /usage [page <n>] [prefix <text>]", client)
+
+        return False
+
+    args, page, prefix = options
+
+    memory = self.memory_usage()
+    budget = (f"of {self.memory_budget} " if self.memory_budget > 0
+              else "with no budget ")
+
+    # A (bytes in, bytes out, client) tuple for every connection
+    connections = sorted(((*client_usage(user), user)
+                          for user in self.clients.values()
+                          if (user.username or "").startswith(prefix)),
+                         key=lambda connection: connection[0] +
+                         connection[1], reverse=True)
+
+    shown, pages = list_page(connections, page)
+
+    if len(shown) == 0 and page > 1:
+        self.send(f"No page {page}, there are {pages}", client)
+
+        return False
+
+    lines = [f"Memory: {sum(memory.values())} bytes {budget}" +
+             f"({memory['inbound']} in, {memory['outbound']} out, " +
+             f"{memory['history']} history)",
+             f"Connections ({len(connections)}):"]
+
+    for bytes_in, bytes_out, user in shown:
+        lines.append(f" * {user.username or '(logging in)'} " +
+                     f"{user.address}: {bytes_in} in, {bytes_out} out")
+
+    if pages > 1:
+        lines.append(page_footer("/usage prefix " + prefix if prefix
+                                 else "/usage", page, pages))
+
+    lines.append("End list")
+
+    self.send_lines(lines, client)
+
+    return True
+
+
+def batch_window(self, args, client):
+    """
+    Description:
+        Sets how long messages of the user's current room are collected
+        before they are written to its members together
+        Must have ownership of the room or be a server owner
+    Arguments:
+        A Server object
+        A list of arguments
+        The client object that issued the command
+    Return Value:
+        True if the command was carried out
+        False if an error occurred
+    """
+
+    if client.room is None:
+        self.send("Not in a room", client)
+
+        return False
+
+    if len(args) == 0:
+        if client.room.batch_window == 0:
+            self.send(f"Batching is off in: {client.room.name}", client)
+
+        else:
+            self.send(f"Batch window of {client.room.name}: " +
+                      f"{client.room.batch_window * 1000:g} ms", client)
+
+        return True
+
+    if (client.username != client.room.owner and
+            (client.username not in self.owners or
+             client.username not in self.passwords)):
+        self.send("Insufficient privileges to set the batch window",
+                  client)
+
+        return False
+
+    limit = int(MAX_BATCH_WINDOW * 1000)
+
+    if len(args) > 1 or (args[0] != "off" and
+                         (not args[0].isdigit() or int(args[0]) > limit)):
+        self.send(f"Usage: /batch <0-{limit} ms>|off", client)
+
+        return False
+
+    window = 0 if args[0] == "off" else int(args[0]) / 1000
+
+    set_batch_window(self, client.room, window)
+
+    if self.bus is not None:
+        self.bus.send("batch", client.room.name, window)
+
+    if window == 0:
+        self.send(f"Batching is off in: {client.room.name}", client)
+
+    else:
+        self.send(f"Batch window of {client.room.name}: " +
+                  f"{window * 1000:g} ms", client)
+
+    return True
+
+
+def set_batch_window(self, room, window):
+    # Messages already collected keep their place before the next ones
+    if window == 0:
+        self.flush_batch(room)
+
+    room.batch_window = window
+
+
 def client_exit(self, args, client):
     """
     Description:
@@ -841,7 +1298,11 @@ def client_exit(self, args, client):
             return False
 
     # Then disconnect the client
-    client.socket.send("Come again soon!\n\r".encode('utf-8'))
+    if client.json:
+        self.send("Come again soon!", client)
+
+    else:
+        self.write("Come again soon!\n\r".encode('utf-8'), client)
     self.connection_terminated(client)
 
     return True
@@ -861,15 +1322,20 @@ COMMANDS = {"/rooms": show_rooms, "/r": show_rooms,
             "/ban": ban, "/b": ban,
             "/unban": unban, "/u": unban,
             "/delete": delete, "/d": delete,
+            "/history": history, "/h": history,
+            "/stats": stats,
+            "/usage": usage,
+            "/batch": batch_window,
             "/exit": client_exit, "/x": client_exit,
             "/quit": client_exit, "/q": client_exit}
 
 # Descriptions of the valid commands
 VALID_COMMANDS = ("Valid commands:\n\r" +
-                  " * /rooms - See active rooms\n\r" +
+                  " * /rooms [page <n>] [prefix <text>] - See active " +
+                  "rooms\n\r" +
                   " * /join <room> - Join a room\n\r" +
-                  " * /who <room> - See who is in a room. " +
-                  "Default: current room \n\r" +
+                  " * /who <room> [page <n>] [prefix <text>] - See who " +
+                  "is in a room. Default: current room \n\r" +
                   " * /leave - Leave your current room\n\r" +
                   " * /private <user> <message> - Send a " +
                   "private message\n\r" +
@@ -887,6 +1353,14 @@ VALID_COMMANDS = ("Valid commands:\n\r" +
                   "from your current room \n\r" +
                   " * /delete <name> - Delete a room. " +
                   "Default: current room\n\r" +
+                  " * /history [n] - See the last n messages of your " +
+                  "current room. Default: all kept\n\r" +
+                  " * /stats - See server statistics " +
+                  "(server owners only)\n\r" +
+                  " * /usage [page <n>] [prefix <text>] - See the " +
+                  "memory each connection holds (server owners only)\n\r" +
+                  " * /batch <ms>|off - Send the messages of your " +
+                  "current room together every few ms (owner only)\n\r" +
                   " * /quit - Disconnect from the server\n\r" +
                   " * Typing backslash with only the first " +
                   "letter of a command works as well\n\r" +
@@ -916,9 +1390,18 @@ def command(self, input, client):
 
     # Incorrect command entered, show all valid commands
     if cmd not in COMMANDS:
+        self.metrics.invalid_commands += 1
+
         self.send(VALID_COMMANDS, client)
 
         return False
 
+    handler = COMMANDS[cmd]
+    start = time.perf_counter()
+
     # Run a command normally
-    return COMMANDS[cmd](self, args, client)
+    result = handler(self, args, client)
+
+    self.metrics.commands[handler].observe(time.perf_counter() - start)
+
+    return result
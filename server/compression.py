@@ -0,0 +1,234 @@
+###############################################################################
+# compression.py                                                              #
+# The outbound compression functions for the server object                    #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+# A client can ask for everything the server sends it to be one zlib
+# stream: telnet clients through MCCP2 (IAC DO COMPRESS2), JSON lines
+# clients with a {"type": "compress"} frame. Queued messages are
+# compressed together right before each flush(), so a client's whole
+# batch of the loop iteration ends on one sync flush point.
+#
+# Each client has its own compressor, so its small messages build on the
+# history of what it was sent before. A big write, like the batch of a
+# busy room, is shared by every member's queue, so it is compressed once
+# from a fresh state into blocks any stream can take. Those blocks do not
+# depend on what came before them in a stream, but the client's own
+# compressor no longer knows what the stream holds, so it starts over.
+# The zlib header and the Adler-32 checksum at the end of the stream are
+# added by the server.
+
+import struct
+import zlib
+
+from .jsonlines import frame
+
+# Telnet option of MCCP2, the server offers it with IAC WILL COMPRESS2
+COMPRESS2 = 86
+
+# Whether clients may turn compression on
+COMPRESSION = True
+
+# zlib compression level, 1 (fastest) to 9 (smallest)
+COMPRESSION_LEVEL = 6
+
+# Writes of at least this many bytes are compressed once for every client
+# they are queued for, smaller ones go through each client's compressor
+COMPRESSION_SHARED = 512
+
+# Window of 4 KB and memLevel 5, about 32 KB of zlib state per client
+# instead of about 256 KB, still a few hundred lines of chat history
+WINDOW_BITS = 12
+MEMORY_LEVEL = 5
+
+# Bytes of zlib state of one compressor, by zlib's own formula
+COMPRESSOR_MEMORY = (1 << (WINDOW_BITS + 2)) + (1 << (MEMORY_LEVEL + 9))
+
+# Deflate with a 32 KB window at the default level, the largest window is
+# declared so any smaller one the server uses fits
+ZLIB_HEADER = b"\x78\x9c"
+
+# Largest prime below 2 ** 16, the modulus of Adler-32
+ADLER_BASE = 65521
+
+# IAC WILL COMPRESS2, and IAC SB COMPRESS2 IAC SE right before the stream
+# starts (see telnet.py)
+OFFER = bytes((255, 251, COMPRESS2))
+START = bytes((255, 250, COMPRESS2, 255, 240))
+
+
+def adler32_combine(adler1, adler2, length2):
+    # The Adler-32 of two pieces of data joined, from the checksum of
+    # each and the length of the second, like zlib's adler32_combine()
+    remainder = length2 % ADLER_BASE
+
+    sum1 = adler1 & 0xffff
+    sum2 = (remainder * sum1) % ADLER_BASE
+
+    sum1 = (sum1 + (adler2 & 0xffff) + ADLER_BASE - 1) % ADLER_BASE
+    sum2 = ((sum2 + (adler1 >> 16) + (adler2 >> 16) + ADLER_BASE -
+             remainder) % ADLER_BASE)
+
+    return sum1 | (sum2 << 16)
+
+
+def new_compressor(self):
+    # Raw deflate, the server writes the zlib header and checksum itself
+    return zlib.compressobj(self.compression_level, zlib.DEFLATED,
+                            -WINDOW_BITS, MEMORY_LEVEL)
+
+
+###############################################################################
+#                              Server Functions                               #
+###############################################################################
+
+
+def start_compression(self, client):
+    """
+    Description:
+        Compresses everything queued for a client from now on
+    Arguments:
+        A Server object
+        A client object
+    Return Value:
+        True if compression was started
+        False if it is off or already on
+    """
+
+    if not self.compression or client.compressing:
+        return False
+
+    # The last bytes the client reads as they are
+    if client.json:
+        data = frame("compress") + ZLIB_HEADER
+
+    else:
+        data = START + ZLIB_HEADER
+
+    # Never dropped by the slow consumer policy, the stream starts here
+    client.outbound.append(data)
+    client.outbound_size += len(data)
+    client.outbound_compressed = len(client.outbound)
+
+    client.compressing = True
+    client.compressor = None
+    client.adler = 1
+
+    self.pending.add(client)
+
+    self.log("info", "compress", client)
+
+    return True
+
+
+def end_compression(self, client):
+    """
+    Description:
+        Ends a client's zlib stream, everything queued after it is sent
+        as it is
+    Arguments:
+        A Server object
+        A client object
+    Return Value:
+        None
+    """
+
+    if not client.compressing:
+        return
+
+    self.compress_outbound(client)
+
+    if client.compressor is None:
+        client.compressor = new_compressor(self)
+
+    data = (client.compressor.flush(zlib.Z_FINISH) +
+            struct.pack(">I", client.adler))
+
+    client.outbound.append(data)
+    client.outbound_size += len(data)
+    client.outbound_compressed = len(client.outbound)
+
+    client.compressing = False
+    client.compressor = None
+
+    self.pending.add(client)
+
+
+def compress_outbound(self, client):
+    """
+    Description:
+        Compresses the messages queued for a client since the last
+        flush into one write ending on a sync flush point
+    Arguments:
+        A Server object
+        A client object that is compressing
+    Return Value:
+        None
+    """
+
+    count = len(client.outbound) - client.outbound_compressed
+
+    if count <= 0:
+        return
+
+    messages = [client.outbound.pop() for _ in range(count)]
+    messages.reverse()
+
+    size = sum(map(len, messages))
+    blocks = []
+    run = []
+
+    for message in messages + [None]:
+        # Compress the small messages before a big one, or at the end,
+        # with the client's own compressor
+        if len(run) > 0 and (message is None or
+                             len(message) >= self.compression_shared):
+            data = b"".join(run)
+            run = []
+
+            if client.compressor is None:
+                client.compressor = new_compressor(self)
+
+            blocks.append(client.compressor.compress(data))
+            blocks.append(client.compressor.flush(zlib.Z_SYNC_FLUSH))
+
+            client.adler = zlib.adler32(data, client.adler)
+
+        if message is None:
+            break
+
+        if len(message) < self.compression_shared:
+            run.append(message)
+
+            continue
+
+        # The same bytes queued for many clients are compressed once per
+        # loop iteration, the message is kept so its id is not reused
+        cached = self.shared_blocks.get(id(message))
+
+        if cached is None or cached[0] is not message:
+            compressor = new_compressor(self)
+
+            cached = (message, compressor.compress(message) +
+                      compressor.flush(zlib.Z_SYNC_FLUSH),
+                      zlib.adler32(message))
+
+            self.shared_blocks[id(message)] = cached
+
+        blocks.append(cached[1])
+
+        client.adler = adler32_combine(client.adler, cached[2],
+                                       len(message))
+
+        # Its history no longer matches the stream
+        client.compressor = None
+
+    data = b"".join(blocks)
+
+    client.outbound.append(data)
+    client.outbound_size += len(data) - size
+    client.outbound_compressed = len(client.outbound)
+
+    self.metrics.compressed_in += size
+    self.metrics.compressed_out += len(data)
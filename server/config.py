@@ -0,0 +1,145 @@
+###############################################################################
+# config.py                                                                   #
+# The environment settings of the server object                               #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+# Every way of running the server (run_server.py, run_server_async.py and
+# each worker of run_cluster.py) reads the same environment variables.
+# Anything not set keeps the default the Server object starts with, and a
+# value that is not one of the choices stops the server before it starts.
+
+import os
+
+from .batching import MAX_BATCH_WINDOW
+from .log import LOG_LEVELS
+from .outbound import SLOW_POLICIES
+from .ratelimit import RATE_PENALTIES
+
+
+def choice(name, choices, default):
+    # The value of an environment variable that must be one of a few
+    value = os.environ.get(name, default)
+
+    if value not in choices:
+        raise ValueError(f"{name} must be one of {', '.join(choices)}, " +
+                         f"not {value}")
+
+    return value
+
+
+def configure(chat_server):
+    """
+    Description:
+        Applies the settings in the environment variables to a server
+    Arguments:
+        A Server object
+    Return Value:
+        None
+    """
+
+    # Caps on connections at once and from one IP address (0 is no cap)
+    chat_server.max_connections = int(os.environ.get(
+        "MAX_CONNECTIONS", chat_server.max_connections))
+    chat_server.max_per_address = int(os.environ.get(
+        "MAX_PER_ADDRESS", chat_server.max_per_address))
+
+    # Socket options of new connections, 1 or 0 for TCP_NODELAY and
+    # SO_KEEPALIVE and bytes for the buffers (0 keeps the kernel's sizes)
+    chat_server.tcp_nodelay = bool(int(os.environ.get(
+        "TCP_NODELAY", int(chat_server.tcp_nodelay))))
+    chat_server.tcp_keepalive = bool(int(os.environ.get(
+        "TCP_KEEPALIVE", int(chat_server.tcp_keepalive))))
+    chat_server.socket_send_buffer = int(os.environ.get(
+        "SEND_BUFFER", chat_server.socket_send_buffer))
+    chat_server.socket_receive_buffer = int(os.environ.get(
+        "RECEIVE_BUFFER", chat_server.socket_receive_buffer))
+
+    # 1 asks telnet clients to edit lines themselves, 0 leaves them be
+    chat_server.telnet_negotiation = bool(int(os.environ.get(
+        "TELNET_NEGOTIATION", int(chat_server.telnet_negotiation))))
+
+    # 1 lets clients ask for compression (MCCP2 or a JSON lines frame), the
+    # zlib level and the smallest write compressed once for every client
+    chat_server.compression = bool(int(os.environ.get(
+        "COMPRESSION", int(chat_server.compression))))
+    chat_server.compression_level = int(os.environ.get(
+        "COMPRESSION_LEVEL", chat_server.compression_level))
+    chat_server.compression_shared = int(os.environ.get(
+        "COMPRESSION_SHARED", chat_server.compression_shared))
+
+    # Bytes of one line of input, and bytes held for every connection and
+    # the history together (0 is no budget)
+    chat_server.line_limit = int(os.environ.get("LINE_LIMIT",
+                                                chat_server.line_limit))
+    chat_server.memory_budget = int(os.environ.get(
+        "MEMORY_BUDGET", chat_server.memory_budget))
+
+    # Outbound queue limits in bytes and the slow consumer policy
+    chat_server.high_water = int(os.environ.get("HIGH_WATER",
+                                                chat_server.high_water))
+    chat_server.low_water = int(os.environ.get("LOW_WATER",
+                                               chat_server.low_water))
+    chat_server.slow_policy = choice("SLOW_POLICY", SLOW_POLICIES,
+                                     chat_server.slow_policy)
+
+    # Rate limits as kind=rate/burst pairs like chat=5/10,private=2/5
+    # ("off" turns them off) and the penalty for clients sending too fast
+    rate_limits = os.environ.get("RATE_LIMITS", "")
+
+    if rate_limits == "off":
+        chat_server.rate_limits = {}
+
+    else:
+        for limit in filter(None, rate_limits.split(",")):
+            kind, rate, burst = limit.replace("=", "/").split("/")
+            chat_server.rate_limits[kind] = (float(rate), float(burst))
+
+    chat_server.rate_penalty = choice("RATE_PENALTY", RATE_PENALTIES,
+                                      chat_server.rate_penalty)
+
+    # Bytes of room history kept across every room and messages replayed
+    # to users joining a room
+    chat_server.history_budget = int(os.environ.get(
+        "HISTORY_BUDGET", chat_server.history_budget))
+    chat_server.history_replay = int(os.environ.get(
+        "HISTORY_REPLAY", chat_server.history_replay))
+
+    # Milliseconds messages of the starting rooms are collected before they
+    # are written to the members together, 0 writes them right away
+    batch_window = min(float(os.environ.get("BATCH_WINDOW", 0)) / 1000,
+                       MAX_BATCH_WINDOW)
+
+    for room in chat_server.rooms.values():
+        room.batch_window = batch_window
+
+    # Seconds to log in, seconds without input before a connection is
+    # closed and before a keepalive probe is sent (0 turns those two off)
+    chat_server.login_timeout = float(os.environ.get(
+        "LOGIN_TIMEOUT", chat_server.login_timeout))
+    chat_server.idle_timeout = float(os.environ.get(
+        "IDLE_TIMEOUT", chat_server.idle_timeout))
+    chat_server.keepalive = float(os.environ.get(
+        "KEEPALIVE", chat_server.keepalive))
+
+    # log2 of the password hashing cost and the number of hashing threads
+    # (0 hashes on the event loop)
+    hasher = chat_server.hasher
+    hasher.cost = int(os.environ.get("HASH_COST", hasher.cost))
+    hasher.workers = int(os.environ.get("HASH_WORKERS", hasher.workers))
+
+    # Lowest level of the log records written and the sampling of busy
+    # events as event=n pairs like connect=10,disconnect=10 (one record
+    # in every n is written)
+    logger = chat_server.logger
+    logger.level = LOG_LEVELS[os.environ.get("LOG_LEVEL", "info")]
+
+    log_sampling = os.environ.get("LOG_SAMPLING", "")
+
+    for sampling in filter(None, log_sampling.split(",")):
+        event, every = sampling.split("=")
+        logger.sampling[event] = int(every)
+
+    # Comma separated usernames allowed to use /stats and /usage
+    chat_server.owners = set(filter(None,
+                                    os.environ.get("OWNERS", "").split(",")))
@@ -0,0 +1,110 @@
+###############################################################################
+# directory.py                                                                #
+# The room directory and listing functions for the server object              #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+# /rooms and /who are written to the client as one buffer and a page at a
+# time. The " * room (users)" lines every client sees the same are kept in
+# server.directory, which is set back to None whenever a room is created
+# or deleted or someone joins or leaves one, and rebuilt on the next
+# /rooms. The tags that depend on who is asking, like "(current)", are
+# only added to the lines of the page being shown.
+
+# Lines of a listing shown at once
+LIST_PAGE = 50
+
+# Options that can follow the arguments of a listing command
+LIST_OPTIONS = ("page", "prefix")
+
+
+def list_options(args):
+    """
+    Description:
+        Splits the "page <n>" and "prefix <text>" options off the end of
+        a listing command's arguments
+    Arguments:
+        A list of arguments
+    Return Value:
+        A tuple of (the other arguments, the page, the prefix)
+        None if an option is missing its value or the page is not a
+        positive number
+    """
+
+    args = list(args)
+    page = 1
+    prefix = ""
+
+    while len(args) >= 2 and args[-2] in LIST_OPTIONS:
+        value = args.pop()
+        option = args.pop()
+
+        if option == "prefix":
+            prefix = value
+
+        elif value.isdigit() and int(value) > 0:
+            page = int(value)
+
+        else:
+            return None
+
+    if len(args) > 0 and args[-1] in LIST_OPTIONS:
+        return None
+
+    return args, page, prefix
+
+
+def list_page(lines, page):
+    """
+    Description:
+        Picks one page of a listing
+    Arguments:
+        A list of everything in the listing
+        The page to show, starting at 1
+    Return Value:
+        A tuple of (the lines on the page, the number of pages)
+    """
+
+    pages = max(1, -(-len(lines) // LIST_PAGE))
+    start = (page - 1) * LIST_PAGE
+
+    return lines[start:start + LIST_PAGE], pages
+
+
+def page_footer(command, page, pages):
+    # The line that tells the user how to get to the next page
+    if page < pages:
+        return f"Page {page} of {pages}, {command} page {page + 1} for more"
+
+    return f"Page {page} of {pages}"
+
+
+###############################################################################
+#                              Server Functions                               #
+###############################################################################
+
+
+def room_directory(self):
+    """
+    Description:
+        Gets the listing of every room, building it if a room or its
+        members changed since it was last built
+    Arguments:
+        A Server object
+    Return Value:
+        A list of (room name, " * room (users)" line) tuples in the
+        order the rooms were created
+    """
+
+    if self.directory is None:
+        # Count users on every worker when running as a cluster
+        if self.bus is not None:
+            self.directory = [(name, f" * {name} " +
+                               f"({len(self.bus.members[name])})")
+                              for name in self.rooms]
+
+        else:
+            self.directory = [(name, f" * {name} ({len(room.users)})")
+                              for name, room in self.rooms.items()]
+
+    return self.directory
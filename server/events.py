@@ -0,0 +1,222 @@
+###############################################################################
+# events.py                                                                   #
+# The event engine functions for the server object                            #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+import asyncio
+import heapq
+import selectors
+import time
+
+from client import Client
+
+
+def register(self, sock, data=None):
+    """
+    Description:
+        Starts watching a socket for read readiness
+        Registration is incremental so the kernel keeps the interest
+        set between polls instead of rebuilding it every iteration
+    Arguments:
+        A Server object
+        A socket to watch
+        The object returned with the socket's events, either the client
+        object or a function to call with the events bitmask
+    Return Value:
+        None
+    """
+
+    if self.selector is not None:
+        self.selector.register(sock, selectors.EVENT_READ, data)
+
+
+def unregister(self, sock):
+    """
+    Description:
+        Stops watching a socket
+    Arguments:
+        A Server object
+        A socket to stop watching
+    Return Value:
+        True if the socket was being watched
+        False otherwise
+    """
+
+    if self.selector is None:
+        return False
+
+    try:
+        self.selector.unregister(sock)
+
+        return True
+
+    except (KeyError, ValueError):
+        return False
+
+
+def set_writable(self, client, writable):
+    """
+    Description:
+        Turns write readiness events on or off for a client
+    Arguments:
+        A Server object
+        The client object to change
+        True to be notified when the client's socket is writable
+    Return Value:
+        None
+    """
+
+    # Another event loop owns the socket, so ask it instead
+    if self.selector is None:
+        if writable:
+            client.socket.notify_writable(self.flush, client)
+
+        return
+
+    events = selectors.EVENT_READ
+
+    if writable:
+        events |= selectors.EVENT_WRITE
+
+    # Only make the system call when the interest set changes
+    if self.selector.get_key(client.socket).events != events:
+        self.selector.modify(client.socket, events, client)
+
+
+def poll(self, timeout=None):
+    """
+    Description:
+        Waits for socket events
+    Arguments:
+        A Server object
+        The maximum number of seconds to wait (None waits forever)
+    Return Value:
+        A list of (data, events) tuples where data is the object the
+        socket was registered with and events is a bitmask of
+        selectors.EVENT_READ and selectors.EVENT_WRITE
+    """
+
+    return [(key.data, events)
+            for key, events in self.selector.select(timeout)]
+
+
+def call_later(self, delay, callback, *args):
+    """
+    Description:
+        Runs a callback on the event loop after a delay
+    Arguments:
+        A Server object
+        The number of seconds to wait
+        The function to call and its arguments
+    Return Value:
+        None
+    """
+
+    # Another event loop owns the sockets, so it keeps the time too
+    if self.selector is None:
+        def fire():
+            callback(*args)
+
+            self.flush_pending()
+            self.close_pending()
+
+        asyncio.get_running_loop().call_later(delay, fire)
+
+        return
+
+    heapq.heappush(self.timers, (time.monotonic() + delay,
+                                 next(self.timer_sequence), callback, args))
+
+
+def run_timers(self):
+    """
+    Description:
+        Runs every callback that is due
+    Arguments:
+        A Server object
+    Return Value:
+        The number of seconds until the next callback is due
+        None if no callback is waiting
+    """
+
+    now = time.monotonic()
+
+    while len(self.timers) > 0 and self.timers[0][0] <= now:
+        due, sequence, callback, args = heapq.heappop(self.timers)
+
+        callback(*args)
+
+    if len(self.timers) == 0:
+        return None
+
+    return max(0, self.timers[0][0] - now)
+
+
+def accept(self, events):
+    """
+    Description:
+        Accepts the new connections on the listening socket
+    Arguments:
+        A Server object
+        The events bitmask of the listening socket
+    Return Value:
+        The number of connections accepted
+    """
+
+    return self.accept_all(self.socket)
+
+
+def serve_forever(self):
+    """
+    Description:
+        Runs the main loop, handling socket events until the process
+        is stopped
+    Arguments:
+        A Server object
+    Return Value:
+        None
+    """
+
+    timeout = None
+
+    while True:
+        # Get the ready sockets, waking up for the next timer
+        for ready, events in self.poll(timeout):
+            # Listening and cluster sockets have their own handler
+            if not isinstance(ready, Client):
+                ready(events)
+
+                continue
+
+            client = ready
+
+            # Readable client, errors and hang-ups also show up here
+            if events & selectors.EVENT_READ and not client.closing:
+                # Get data and process it
+                messages = self.receive(client)
+
+                if messages is not False:
+                    for data in messages:
+                        # Stop after commands like /quit
+                        if client.closing:
+                            break
+
+                        self.process(data, client)
+
+            # Writable client with queued messages
+            if events & selectors.EVENT_WRITE and not client.closing:
+                self.flush(client)
+
+        # Handle messages from the other cluster workers
+        if self.bus is not None:
+            self.relay()
+
+        # Run the callbacks that are due
+        timeout = self.run_timers()
+
+        # Send everything queued by this iteration, one write per client
+        self.flush_pending()
+
+        # Disconnect clients that failed or could not keep up
+        self.close_pending()
@@ -0,0 +1,198 @@
+###############################################################################
+# hashing.py                                                                  #
+# The password hashing of the server                                          #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+# Passwords are stored as salted scrypt hashes. Hashing takes tens of
+# milliseconds, so it runs on a bounded pool of threads (hashlib releases
+# the GIL while it works) and the result is handed back to the event loop
+# through a socket pair. The client waits, parked, until it arrives.
+
+import concurrent.futures
+import hashlib
+import hmac
+import os
+import queue
+import socket
+
+# log2 of the scrypt CPU/memory cost, each step doubles the time
+HASH_COST = 14
+
+# Threads hashing at once, 0 hashes on the event loop itself
+HASH_WORKERS = os.cpu_count() or 1
+
+# Most hashes waiting for a thread before new ones are refused
+HASH_QUEUE = 1000
+
+# Bytes of random salt per password
+SALT_SIZE = 16
+
+
+def hash_password(password, cost=HASH_COST):
+    """
+    Description:
+        Hashes a password with a new random salt
+    Arguments:
+        The password
+        log2 of the scrypt cost
+    Return Value:
+        A string of the form scrypt$cost$salt$hash
+    """
+
+    salt = os.urandom(SALT_SIZE)
+
+    return f"scrypt${cost}${salt.hex()}${derive(password, salt, cost).hex()}"
+
+
+def verify_password(password, stored):
+    """
+    Description:
+        Checks a password against a stored hash in constant time
+        Passwords saved before hashing are compared as plain text
+    Arguments:
+        The password typed by the user
+        The stored hash
+    Return Value:
+        True if the password matches
+        False otherwise
+    """
+
+    if not stored.startswith("scrypt$"):
+        return hmac.compare_digest(password.encode('utf-8'),
+                                   stored.encode('utf-8'))
+
+    name, cost, salt, expected = stored.split("$")
+
+    return hmac.compare_digest(derive(password, bytes.fromhex(salt),
+                                      int(cost)),
+                               bytes.fromhex(expected))
+
+
+def derive(password, salt, cost):
+    n = 1 << cost
+
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=8,
+                          p=1, maxmem=256 * 8 * n + (1 << 20), dklen=32)
+
+
+class Hasher():
+    """
+    Runs hashes on a bounded thread pool and calls back on the event loop
+    """
+
+    def __init__(self, log, workers=HASH_WORKERS, cost=HASH_COST,
+                 limit=HASH_QUEUE):
+        # The Log object errors are written to (see log.py)
+        self.log = log
+
+        self.workers = workers
+        self.cost = cost
+        self.limit = limit
+
+        # Hashes submitted but not handed back yet
+        self.waiting = 0
+
+        # Threads are only started when the first hash is submitted
+        self.executor = None
+
+        # (callback, arguments, future) tuples of finished hashes
+        self.done = queue.SimpleQueue()
+
+        # Worker threads write a byte to wake the event loop, which
+        # watches the other end
+        self.socket, self.waker = socket.socketpair()
+        self.socket.setblocking(False)
+        self.waker.setblocking(False)
+
+    def hash(self, password, callback, *args):
+        return self.submit(hash_password, (password, self.cost),
+                           callback, args)
+
+    def verify(self, password, stored, callback, *args):
+        return self.submit(verify_password, (password, stored),
+                           callback, args)
+
+    def submit(self, function, function_args, callback, args):
+        """
+        Description:
+            Runs a function off the event loop, then calls
+            callback(*args, result) on the event loop
+        Arguments:
+            A Hasher object
+            The function to run and a tuple of its arguments
+            The callback and a tuple of its first arguments
+        Return Value:
+            True if the function was submitted
+            False if too many hashes are waiting
+        """
+
+        if self.waiting >= self.limit:
+            return False
+
+        # No pool, block the event loop instead
+        if self.workers == 0:
+            callback(*args, function(*function_args))
+
+            return True
+
+        if self.executor is None:
+            self.executor = concurrent.futures.ThreadPoolExecutor(
+                self.workers, thread_name_prefix="hasher")
+
+        self.waiting += 1
+
+        future = self.executor.submit(function, *function_args)
+        future.add_done_callback(
+            lambda future: self.finished(callback, args, future))
+
+        return True
+
+    def finished(self, callback, args, future):
+        # Runs on a worker thread
+        self.done.put((callback, args, future))
+
+        try:
+            self.waker.send(b"\0")
+
+        # The loop has not read the earlier wake-ups yet, one is enough
+        except BlockingIOError:
+            pass
+
+    def ready(self, events=None):
+        """
+        Description:
+            Calls back for every finished hash
+            Called by the event loop when the socket pair is readable
+        Arguments:
+            A Hasher object
+            The events bitmask of the socket
+        Return Value:
+            None
+        """
+
+        try:
+            while len(self.socket.recv(4096)) > 0:
+                pass
+
+        except BlockingIOError:
+            pass
+
+        while True:
+            try:
+                callback, args, future = self.done.get_nowait()
+
+            except queue.Empty:
+                return
+
+            self.waiting -= 1
+
+            try:
+                result = future.result()
+
+            except Exception as e:
+                self.log.write("error", "hash_error", error=e)
+
+                result = None
+
+            callback(*args, result)
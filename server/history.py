@@ -0,0 +1,131 @@
+###############################################################################
+# history.py                                                                  #
+# The room history functions for the server object                            #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+# Each room keeps its most recent chat messages as the bytes distribute()
+# already encoded, so history costs no extra encoding and shares the bytes
+# with the outbound queues. A room holds at most HISTORY_COUNT messages and
+# HISTORY_BYTES bytes. Past the server-wide budget, the oldest messages of
+# the least recently active rooms are dropped first.
+
+import itertools
+
+from .jsonlines import frame
+
+# Messages kept per room
+HISTORY_COUNT = 100
+
+# Bytes of messages kept per room
+HISTORY_BYTES = 64 * 1024
+
+# Bytes of messages kept across every room
+HISTORY_BUDGET = 64 * 1024 * 1024
+
+# Messages replayed to a user joining a room
+HISTORY_REPLAY = 20
+
+
+def remember(self, room, payload):
+    """
+    Description:
+        Adds a distributed message to a room's history, dropping old
+        messages to stay within the room's caps and the global budget
+    Arguments:
+        A Server object
+        The room object the message was sent to
+        The encoded message
+    Return Value:
+        None
+    """
+
+    room.history.append(payload)
+    room.history_size += len(payload)
+    self.history_size += len(payload)
+
+    while (len(room.history) > self.history_count or
+           room.history_size > self.history_bytes):
+        forget(self, room)
+
+    # Keep the rooms in order of their latest message, a message over the
+    # room's byte cap leaves nothing to keep
+    if len(room.history) > 0:
+        self.history_rooms[room] = None
+        self.history_rooms.move_to_end(room)
+
+    else:
+        self.history_rooms.pop(room, None)
+
+    while self.history_size > self.history_budget and self.history_rooms:
+        oldest = next(iter(self.history_rooms))
+
+        if len(oldest.history) > 0:
+            forget(self, oldest)
+
+        if len(oldest.history) == 0:
+            del self.history_rooms[oldest]
+
+
+def forget(self, room):
+    # Drop a room's oldest message
+    size = len(room.history.popleft())
+
+    room.history_size -= size
+    self.history_size -= size
+
+
+def replay(self, client, room, count):
+    """
+    Description:
+        Sends the latest messages of a room's history in one write
+    Arguments:
+        A Server object
+        The client object to send the messages to
+        The room object
+        The most messages to send
+    Return Value:
+        The number of messages sent
+    """
+
+    count = min(count, len(room.history))
+
+    if count == 0:
+        return 0
+
+    messages = itertools.islice(room.history, len(room.history) - count,
+                                None)
+
+    self.prompt(client)
+
+    if client.json:
+        # Strip the telnet decoration back off
+        self.write(b"".join(frame("history", room=room.name,
+                                  text=str(payload[4:-2], 'utf-8'))
+                            for payload in messages), client)
+
+    elif client.line_mode:
+        self.write(b"".join(payload[1:] for payload in messages), client)
+
+    else:
+        self.write(b"".join(messages), client)
+
+    return count
+
+
+def clear_history(self, room):
+    """
+    Description:
+        Drops the history of a deleted room
+    Arguments:
+        A Server object
+        The room object
+    Return Value:
+        None
+    """
+
+    self.history_size -= room.history_size
+    self.history_rooms.pop(room, None)
+
+    room.history.clear()
+    room.history_size = 0
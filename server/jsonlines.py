@@ -0,0 +1,226 @@
+###############################################################################
+# jsonlines.py                                                                #
+# The JSON lines protocol functions for the server object                     #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+# Bots and services connect to a second port that speaks one JSON object
+# per line instead of the telnet text with its "<= " and "=> " decoration.
+# Input frames are turned into the lines a telnet user would type, so they
+# go through the same login, command and distribute functions. Output is
+# framed where it is written: send() makes replies, distribute() makes
+# chat and event frames, encoded once per message like the telnet bytes.
+#
+# Input:  {"type": "login", "username": "bot", "password": "secret"}
+#         {"type": "chat", "text": "hello"}
+#         {"type": "command", "command": "join", "args": ["chat"]}
+#         {"type": "line", "text": "typed as is, like a password"}
+#         {"type": "compress"}
+# Output: {"type": "reply", "text": "Joined the room: chat"}
+#         {"type": "chat", "room": "chat", "from": "bob", "text": "hi"}
+#         {"type": "event", "room": "chat", "text": "bob joined the room"}
+#         {"type": "history", "room": "chat", "text": "bob: hi"}
+#         {"type": "error", "text": "Invalid JSON"}
+#         {"type": "ping"}
+#         {"type": "compress"}, everything after it is one zlib stream
+#         (see compression.py)
+
+import json
+import socket
+
+# json.dumps() with options builds a new encoder on every call
+ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+# Control characters a frame's text could smuggle in escaped, like the
+# escape sequences telnet input is filtered of, tab is kept
+CONTROL = dict.fromkeys([*range(0x09), *range(0x0a, 0x20), 0x7f])
+
+
+def frame(kind, **fields):
+    """
+    Description:
+        Encodes one output frame
+    Arguments:
+        The type of the frame
+        The other fields of the frame as keyword arguments
+    Return Value:
+        The frame as bytes, ending with a newline
+    """
+
+    return (ENCODER.encode({"type": kind, **fields}) +
+            "\n").encode('utf-8')
+
+
+def message_frame(room, message, chat):
+    """
+    Description:
+        Encodes a message distributed to a room
+    Arguments:
+        The name of the room
+        The message as the telnet users see it
+        A (username, text) tuple if a user sent the message, None if the
+        server did
+    Return Value:
+        The frame as bytes
+    """
+
+    if chat is None:
+        return frame("event", room=room, text=message)
+
+    return frame("chat", room=room, text=chat[1], **{"from": chat[0]})
+
+
+def text_field(message, name):
+    # A string field as one line of input, None if it is missing
+    value = message.get(name)
+
+    if not isinstance(value, str):
+        return None
+
+    # A frame is one line, so is what it turns into
+    return " ".join(value.splitlines()).translate(CONTROL).strip()
+
+
+###############################################################################
+#                              Server Functions                               #
+###############################################################################
+
+
+def serve_json(self, address, reuse_port=False):
+    """
+    Description:
+        Starts the JSON lines listener
+        Only used with the server's own selector, the asyncio runner
+        accepts the connections through its event loop
+    Arguments:
+        A Server object
+        A (host, port) tuple to listen on
+        Whether other processes share the port (cluster workers)
+    Return Value:
+        The listening socket
+    """
+
+    json_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    json_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+    if reuse_port:
+        json_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+
+    json_socket.bind(address)
+    json_socket.listen(self.backlog)
+    json_socket.setblocking(False)
+
+    def accept(events):
+        self.accept_all(json_socket, json=True)
+
+    self.register(json_socket, accept)
+
+    return json_socket
+
+
+def unframe(self, lines, client):
+    """
+    Description:
+        Turns the frames a JSON lines client sent into the lines a
+        telnet user would have typed, answering bad frames with errors
+    Arguments:
+        A Server object
+        A list of the received lines
+        The client object
+    Return Value:
+        A list of lines to process
+    """
+
+    typed = []
+
+    # A login earlier in these lines is not processed yet
+    logged_in = client.username is not None
+
+    for line in lines:
+        try:
+            message = json.loads(line)
+
+        except ValueError:
+            self.write(frame("error", text="Invalid JSON"), client)
+
+            continue
+
+        kind = message.get("type") if isinstance(message, dict) else None
+
+        if kind == "login":
+            username = text_field(message, "username")
+            password = text_field(message, "password")
+
+            if not username:
+                self.write(frame("error", text="Login needs a username"),
+                           client)
+
+                continue
+
+            # The username would be typed as a chat line
+            if logged_in:
+                self.write(frame("error", text="Already logged in"), client)
+
+                continue
+
+            logged_in = True
+
+            typed.append(username)
+
+            if not password:
+                continue
+
+            # Only typed when the server will ask for it, otherwise it
+            # would be taken as the next line, or the next username if
+            # the login fails
+            if username in self.passwords and not self.online(username):
+                typed.append(password)
+
+            elif username not in self.passwords:
+                self.write(frame("error", text=f"{username} has no " +
+                                 "password, it was not used"), client)
+
+        elif kind == "chat" or kind == "line":
+            text = text_field(message, "text")
+
+            if not text:
+                self.write(frame("error", text=f"{kind} needs a text"),
+                           client)
+
+                continue
+
+            # A chat message is never a command, escape it like // does
+            if kind == "chat" and text[0] == '/':
+                text = '/' + text
+
+            typed.append(text)
+
+        elif kind == "compress":
+            if not self.compression and not client.compressing:
+                self.write(frame("error", text="Compression is off"),
+                           client)
+
+            else:
+                self.start_compression(client)
+
+        elif kind == "command":
+            command = text_field(message, "command")
+            args = message.get("args", [])
+
+            if (not command or not isinstance(args, list) or
+                    not all(isinstance(arg, str) for arg in args)):
+                self.write(frame("error", text="command needs a command " +
+                                 "and a list of string args"), client)
+
+                continue
+
+            if command[0] != '/':
+                command = '/' + command
+
+            typed.append(" ".join([command] + [" ".join(arg.split())
+                                               for arg in args]))
+
+        else:
+            self.write(frame("error", text=f"Unknown type: {kind}"), client)
+
+    return typed
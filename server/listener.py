@@ -0,0 +1,220 @@
+###############################################################################
+# listener.py                                                                 #
+# The connection admission functions for the server object                    #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+# A wakeup of a listening socket accepts every connection waiting in the
+# kernel's backlog, not just one, so a reconnect storm drains as fast as
+# it arrives. Each new connection is checked against the global and the
+# per-address caps and the memory budget, turned away with a short
+# message if it is over one, and given the same socket options before the
+# server takes it on. A server out of file descriptors stops watching the
+# listening socket for a moment, the backlog it cannot take would keep it
+# readable and the loop would spin.
+
+import errno
+import socket
+
+from .jsonlines import frame
+
+# Connections the kernel queues for accept(), capped by net.core.somaxconn
+LISTEN_BACKLOG = 4096
+
+# Most connections at once, and from one IP address, 0 is no limit
+MAX_CONNECTIONS = 0
+MAX_PER_ADDRESS = 0
+
+# Send small writes right away, replies are already gathered into one
+# write per client per loop iteration (see outbound.py)
+TCP_NODELAY = True
+
+# Let the kernel notice peers that vanished without closing
+TCP_KEEPALIVE = True
+
+# Socket buffer sizes in bytes, 0 keeps the kernel's defaults
+SEND_BUFFER = 0
+RECEIVE_BUFFER = 0
+
+# Errors of accept() that only clear up once connections are closed
+EXHAUSTED = (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM)
+
+# Seconds a listening socket is not watched after one of them
+ACCEPT_BACKOFF = 0.1
+
+# Sent to connections that are turned away
+REJECTED = {"full": "The server is full, try again later",
+            "address": "Too many connections from your address",
+            "memory": "The server is busy, try again later"}
+
+
+def socket_options(self, client_socket):
+    """
+    Description:
+        Applies the server's socket options to a new connection
+    Arguments:
+        A Server object
+        The socket of the new connection
+    Return Value:
+        None
+    """
+
+    if self.tcp_nodelay:
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    if self.tcp_keepalive:
+        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+    if self.socket_send_buffer:
+        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF,
+                                 self.socket_send_buffer)
+
+    if self.socket_receive_buffer:
+        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                 self.socket_receive_buffer)
+
+
+def pause_accepting(self, listening_socket):
+    # Watch the listening socket again after the backoff, with the same
+    # callback
+    callback = self.selector.get_key(listening_socket).data
+
+    self.unregister(listening_socket)
+
+    self.call_later(ACCEPT_BACKOFF, self.register, listening_socket,
+                    callback)
+
+
+###############################################################################
+#                              Server Functions                               #
+###############################################################################
+
+
+def accept_all(self, listening_socket, json=False):
+    """
+    Description:
+        Accepts every connection waiting on a listening socket
+    Arguments:
+        A Server object
+        A non-blocking listening socket
+        Whether the connections speak the JSON lines protocol
+    Return Value:
+        The number of connections accepted
+    """
+
+    accepted = 0
+
+    while True:
+        try:
+            client_socket, client_address = listening_socket.accept()
+
+        # The backlog is empty
+        except BlockingIOError:
+            return accepted
+
+        except OSError as e:
+            self.log("error", "accept_error", error=e)
+
+            # Out of file descriptors or memory, try again once the
+            # backoff is over
+            if e.errno in EXHAUSTED:
+                pause_accepting(self, listening_socket)
+
+            # Otherwise the connection was reset before it was accepted,
+            # try again on the next wakeup
+            return accepted
+
+        self.admit(client_socket, client_address, json)
+
+        accepted += 1
+
+
+def admit(self, client_socket, address, json=False):
+    """
+    Description:
+        Checks a new connection against the connection caps and sets it
+        up as a client if it is under them
+    Arguments:
+        A Server object
+        The socket of the new connection
+        The (host, port) address of the other end
+        Whether the connection speaks the JSON lines protocol
+    Return Value:
+        The new client object
+        None if the connection was turned away
+    """
+
+    host = address[0]
+    reason = None
+
+    if self.max_connections and len(self.clients) >= self.max_connections:
+        reason = "full"
+
+    elif (self.max_per_address and
+          self.addresses[host] >= self.max_per_address):
+        reason = "address"
+
+    # Until the memory budget is checked again (see memory.py)
+    elif self.over_budget:
+        reason = "memory"
+
+    if reason is not None:
+        self.metrics.connections_rejected += 1
+
+        self.log("warning", "reject", address=f"{host}:{address[1]}",
+                 reason=reason)
+
+        if json:
+            data = frame("error", text=REJECTED[reason])
+
+        else:
+            data = f"<= {REJECTED[reason]}\r\n".encode('utf-8')
+
+        # Best effort, the socket buffer of a new connection is empty
+        try:
+            client_socket.setblocking(False)
+            client_socket.send(data)
+
+        except OSError:
+            pass
+
+        client_socket.close()
+
+        return None
+
+    try:
+        socket_options(self, client_socket)
+
+    # The other end already hung up
+    except OSError as e:
+        self.log("info", "reset", address=f"{host}:{address[1]}", error=e)
+
+        client_socket.close()
+
+        return None
+
+    self.addresses[host] += 1
+
+    return self.initialize_client(client_socket, json, address)
+
+
+def release_address(self, client):
+    """
+    Description:
+        Gives back a disconnecting client's place in its address's count
+    Arguments:
+        A Server object
+        The client object
+    Return Value:
+        None
+    """
+
+    # "host:port", the host of an IPv6 address has colons of its own
+    host = client.address.rpartition(":")[0]
+
+    # Clients made without admit() were never counted
+    if host in self.addresses:
+        self.addresses[host] -= 1
+
+        if self.addresses[host] <= 0:
+            del self.addresses[host]
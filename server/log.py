@@ -0,0 +1,222 @@
+###############################################################################
+# log.py                                                                      #
+# The logging of the server                                                   #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+# The event loop never writes to stdout itself. A record is a level, an
+# event name and a few fields put on a bounded queue. A writer thread
+# formats the records as key=value lines and writes them out in batches.
+# Records below the log level, or left out by an event's sampling, cost a
+# comparison. When stdout is slow and the queue is full, new records are
+# dropped and counted instead of waiting.
+
+import collections
+import json
+import queue
+import sys
+import threading
+import time
+
+# Records below the log level are not written, "off" writes none
+LOG_LEVELS = {"debug": 10, "info": 20, "warning": 30, "error": 40,
+              "off": 100}
+LOG_LEVEL = "info"
+
+# Records waiting for the writer thread before new ones are dropped
+LOG_QUEUE = 10000
+
+# A dictionary with the event as the key and n as the value, only one
+# record in every n of the event is written
+LOG_SAMPLING = {}
+
+# Most records written at once
+LOG_BATCH = 1000
+
+
+class Log():
+    """
+    A bounded queue of log records written out by a thread
+    """
+
+    def __init__(self, level=LOG_LEVEL, limit=LOG_QUEUE, stream=None):
+        self.level = LOG_LEVELS[level]
+        self.sampling = dict(LOG_SAMPLING)
+
+        # The file records are written to, None writes to whatever
+        # sys.stdout is at the time
+        self.stream = stream
+
+        # A Counter with the event as the key and the number of records
+        # of the event so far as the value, for sampling
+        self.seen = collections.Counter()
+
+        # Records dropped because the queue was full
+        self.dropped = 0
+
+        # Drops already reported in the log itself
+        self.reported = 0
+
+        # (time, level, event, fields) tuples waiting to be written
+        # None asks the writer thread to stop
+        self.queue = queue.Queue(limit)
+
+        # The thread is only started when the first record is put
+        self.writer = None
+
+    def enabled(self, level, event):
+        """
+        Description:
+            Checks whether a record would be written, counting it for
+            the event's sampling
+        Arguments:
+            A Log object
+            The level and the event of the record
+        Return Value:
+            True if the record should be put on the queue
+            False if it is below the log level or sampled out
+        """
+
+        if LOG_LEVELS[level] < self.level:
+            return False
+
+        every = self.sampling.get(event)
+
+        if every is not None:
+            count = self.seen[event]
+            self.seen[event] = count + 1
+
+            if count % every != 0:
+                return False
+
+        return True
+
+    def put(self, level, event, fields):
+        if self.writer is None:
+            self.writer = threading.Thread(target=self.write_behind,
+                                           name="log-writer", daemon=True)
+            self.writer.start()
+
+        try:
+            self.queue.put_nowait((time.time(), level, event, fields))
+
+            return True
+
+        except queue.Full:
+            self.dropped += 1
+
+            return False
+
+    def write(self, level, event, **fields):
+        if self.enabled(level, event):
+            self.put(level, event, fields)
+
+    def write_behind(self):
+        running = True
+
+        while running:
+            # Wait for a record, then take whatever else is queued
+            records = [self.queue.get()]
+
+            while len(records) < LOG_BATCH:
+                try:
+                    records.append(self.queue.get_nowait())
+
+                except queue.Empty:
+                    break
+
+            if None in records:
+                running = False
+                records = records[:records.index(None)]
+
+            lines = [format_record(*record) for record in records]
+
+            # The queue filled up since the last batch
+            dropped = self.dropped
+
+            if dropped > self.reported:
+                lines.append(format_record(time.time(), "warning",
+                                           "log_dropped",
+                                           {"count": dropped -
+                                            self.reported}))
+                self.reported = dropped
+
+            stream = self.stream or sys.stdout
+
+            try:
+                stream.write("".join(lines))
+                stream.flush()
+
+            # Nowhere left to write, like a closed pipe
+            except (OSError, ValueError):
+                pass
+
+    def close(self):
+        """
+        Description:
+            Writes everything still queued and stops the writer thread
+        Arguments:
+            A Log object
+        Return Value:
+            None
+        """
+
+        if self.writer is not None:
+            self.queue.put(None)
+            self.writer.join()
+
+            self.writer = None
+
+
+def format_record(timestamp, level, event, fields):
+    # 2024-01-01T12:00:00.000 INFO connect address=127.0.0.1:5555
+    seconds = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(timestamp))
+    line = [f"{seconds}.{int(timestamp * 1000) % 1000:03} " +
+            f"{level.upper()} {event}"]
+
+    for name, value in fields.items():
+        value = str(value)
+
+        # Quote values that would not read back as one word
+        if (value == "" or any(c in value for c in ' "=\\') or
+                not value.isprintable()):
+            value = json.dumps(value)
+
+        line.append(f"{name}={value}")
+
+    return " ".join(line) + "\n"
+
+
+###############################################################################
+#                              Server Functions                               #
+###############################################################################
+
+
+def log(self, level, event, client=None, **fields):
+    """
+    Description:
+        Puts a record on the log queue
+    Arguments:
+        A Server object
+        The level of the record, one of LOG_LEVELS
+        The name of the event
+        The client object the record is about, its address and username
+        (once it has one) are added to the fields, only looked up when
+        the record is kept
+        Any other fields as keyword arguments
+    Return Value:
+        None
+    """
+
+    if not self.logger.enabled(level, event):
+        return
+
+    if client is not None:
+        if client.username is None:
+            fields = dict(address=client.address, **fields)
+
+        else:
+            fields = dict(address=client.address, username=client.username,
+                          **fields)
+
+    self.logger.put(level, event, fields)
@@ -0,0 +1,174 @@
+###############################################################################
+# memory.py                                                                   #
+# The memory limit functions for the server object                            #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+# Each connection is capped on its own: an unfinished line can hold at most
+# LINE_LIMIT bytes, longer lines are dropped, and the outbound queue has
+# its high-water mark (see outbound.py). On top of that one budget covers
+# the unfinished lines, held messages and outbound queues of every
+# connection, the zlib state of compressing clients and the room history.
+# Adding all of it up is a pass over every connection, so it is done at
+# most once every MEMORY_INTERVAL seconds, at the end of a loop iteration.
+# While the server is over budget it turns new connections away and drops
+# messages for clients that are already behind, and it disconnects the
+# clients holding the most until it is back under budget.
+#
+# History shares its bytes with the outbound queues it was written to, so
+# the total can count some bytes twice and errs on the high side.
+
+import time
+
+from .compression import COMPRESSOR_MEMORY
+from .jsonlines import frame
+
+# Bytes of one line of input, longer lines are dropped
+LINE_LIMIT = 8 * 1024
+
+# Bytes held for every connection and the history together, 0 is no budget
+MEMORY_BUDGET = 256 * 1024 * 1024
+
+# Seconds between checks of the budget
+MEMORY_INTERVAL = 1.0
+
+# Clients holding less than this many bytes are never disconnected for the
+# budget, they are not what fills it
+OFFENDER_BYTES = 64 * 1024
+
+
+def client_usage(client):
+    """
+    Description:
+        Adds up the bytes the server holds for one connection
+    Arguments:
+        A client object
+    Return Value:
+        A tuple of (inbound bytes, outbound bytes), inbound being the
+        unfinished line and held messages, outbound the queue and zlib
+        state
+    """
+
+    inbound = len(client.received)
+
+    if client.held is not None:
+        inbound += sum(len(data) for data in client.held)
+
+    outbound = client.outbound_size
+
+    if client.compressor is not None:
+        outbound += COMPRESSOR_MEMORY
+
+    return inbound, outbound
+
+
+###############################################################################
+#                              Server Functions                               #
+###############################################################################
+
+
+def memory_usage(self):
+    """
+    Description:
+        Adds up the bytes the server holds for every connection and the
+        history
+    Arguments:
+        A Server object
+    Return Value:
+        A dictionary with "inbound", "outbound" and "history" as the keys
+        and the bytes as the values
+    """
+
+    inbound = 0
+    outbound = 0
+
+    for client in self.clients.values():
+        client_in, client_out = client_usage(client)
+
+        inbound += client_in
+        outbound += client_out
+
+    return {"inbound": inbound, "outbound": outbound,
+            "history": self.history_size}
+
+
+def check_memory(self, now=None):
+    """
+    Description:
+        Checks the memory budget if it was not checked for a while, and
+        disconnects the clients holding the most while over it
+        Called at the end of every event loop iteration
+    Arguments:
+        A Server object
+        The time.monotonic() time, looked up if it is not given
+    Return Value:
+        None
+    """
+
+    if self.memory_budget <= 0:
+        return
+
+    if now is None:
+        now = time.monotonic()
+
+    if now < self.memory_checked + self.memory_interval:
+        return
+
+    self.memory_checked = now
+
+    usage = self.memory_usage()
+    total = sum(usage.values())
+
+    if total <= self.memory_budget:
+        if self.over_budget:
+            self.over_budget = False
+
+            self.log("info", "memory", state="under", **usage)
+
+        return
+
+    self.over_budget = True
+
+    self.log("warning", "memory", state="over", budget=self.memory_budget,
+             **usage)
+
+    # Heaviest first, only as many as it takes to get back under budget
+    heaviest = sorted(((sum(client_usage(client)), client)
+                       for client in self.clients.values()
+                       if not client.closing),
+                      key=lambda pair: pair[0], reverse=True)
+
+    for size, client in heaviest:
+        if total <= self.memory_budget or size < OFFENDER_BYTES:
+            break
+
+        self.metrics.memory_disconnects += 1
+
+        self.log("warning", "memory_disconnect", client, bytes=size)
+
+        self.close_later(client)
+
+        total -= size
+
+
+def line_too_long(self, client):
+    """
+    Description:
+        Tells a client that the line it sent was dropped for being
+        longer than the line limit
+    Arguments:
+        A Server object
+        A client object
+    Return Value:
+        None
+    """
+
+    self.metrics.lines_too_long += 1
+
+    text = f"Line too long, the limit is {self.line_limit} bytes"
+
+    if client.json:
+        self.write(frame("error", text=text), client)
+
+    else:
+        self.send(text, client)
@@ -4,19 +4,24 @@
 # by Kenji Takahashi-Rial                                                     #
 ###############################################################################
 
+import collections
 import socket
+import time
 
 from client import Client
 from .commands import password
+from .compression import OFFER as COMPRESSION_OFFER
+from .jsonlines import frame, message_frame
+from .telnet import COMMAND_LIMIT, IAC, IN_COMMAND, LINEMODE, OFFER, \
+    filter_input
 
 SOCKET_BUFFER = 4096
 
-# Do not print backspace, arrow keys, function keys,
-ILLEGAL_CHARS = ['\x08', '\x1b[A', '\x1b[B', '\x1b[C', '\x1b[D', '\x1bOP',
-                 '\x1bOQ', '\x1bOR', '\x1bOS', '\x1b[15~', '\x1b[17~',
-                 '\x1b[18~', '\x1b[19~', '\x1b[20~', '\x1b[21~', '\x1b[23~',
-                 '\x1b[24~]', '\x1b[2~', '\x1b[1~', '\x1b[5~', '\x7f',
-                 '\x1b[4~', '\x1b[6~', '\x1b[P']
+# The first thing a telnet user sees
+WELCOME = "<= Welcome to the GungHo chat server\r\n".encode('utf-8')
+
+# Most messages held for a parked client, more are dropped
+HELD_LIMIT = 100
 
 
 def send(self, data, client):
@@ -32,80 +37,205 @@ def send(self, data, client):
         False if an error occurred
     """
 
-    try:
-        # Send the data
-        client.socket.send((f"\r<= {data}\r\n").encode('utf-8'))
+    if client.json:
+        return self.write(frame("reply", text=data), client)
 
-        # Re-print the message the user was just typing to make it
-        # seem like the user was not interruped
-        # Only works on Windows because Linux and OS X don't send
-        # continuous data!
-        client.socket.send(("=> " + client.typing).encode('utf-8'))
+    # Nothing to write over or re-print for a client that edits lines
+    # itself
+    if client.line_mode:
+        return self.write(f"<= {data}\r\n".encode('utf-8'), client)
 
-        return True
+    # Queue the data, the prompt goes out once after all of the
+    # client's messages in this event loop iteration
+    self.prompt(client)
 
-    # Catch and display exceptions without crashing
-    except Exception as e:
-        print(f"\nsend() error: {e}\n")
+    return self.write((f"\r<= {data}\r\n").encode('utf-8'), client)
 
-    #     return False
+
+def send_lines(self, lines, client):
+    """
+    Description:
+        Sends several lines to a client as one write, like a listing
+    Arguments:
+        A Server object
+        A list of lines to send
+        A client object to send the lines to
+    Return Value:
+        True if the lines were queued
+        False if an error occurred
+    """
+
+    if client.json:
+        return self.write(b"".join(frame("reply", text=line)
+                                   for line in lines), client)
+
+    if client.line_mode:
+        return self.write("".join(f"<= {line}\r\n" for line in lines).encode(
+            'utf-8'), client)
+
+    self.prompt(client)
+
+    return self.write("".join(f"\r<= {line}\r\n" for line in lines).encode(
+        'utf-8'), client)
 
 
 def receive(self, client):
     """
     Description:
         Handles receiving a data from a client
+        Reads into a buffer shared by every client and keeps the bytes
+        of an unfinished line in the client's own buffer, so a
+        character split across reads is decoded whole
     Arguments:
         A Server object
         A client object to receive a data from
     Return Value:
-        True if the client typed a message and hit enter
-        None if the client hit enter on a blank message or has not
-        hit enter yet
+        A list of every message the client typed and hit enter on, in
+        order (empty if the client has not hit enter yet)
         False if an error occurred
     """
 
     try:
-        data = client.socket.recv(SOCKET_BUFFER).decode('utf-8')
+        size = client.socket.recv_into(self.receive_view)
 
-        if len(data) == 0:
+        if size == 0:
             self.connection_terminated(client)
 
             return False
 
-        client.typing += data
+        self.metrics.bytes_in += size
+
+        # Checked when the client comes up in the timing wheel
+        client.active = time.monotonic()
+
+        # Only search the new bytes for the end of a line
+        search = len(client.received)
+
+        if client.json:
+            client.received += self.receive_view[:size]
+
+        # Leave out telnet commands and escape sequences like arrow keys
+        # and apply backspaces, which may erase part of the old bytes
+        else:
+            data = self.receive_buffer[:size]
+            commands = None
+
+            # Telnet commands are kept for the option negotiation
+            if self.telnet_negotiation:
+                if client.commands is None and data.find(IAC) != -1:
+                    client.commands = bytearray()
 
-        # The user hit enter
-        if client.typing[-1] == '\n':
-            client.typing = client.typing[:-1]
+                commands = client.commands
 
-            # For Windows remove the carriage return
-            if client.typing[-1] == '\r':
-                client.typing = client.typing[:-1]
+            client.input_state = filter_input(data, client.received,
+                                              client.input_state, commands)
+
+            # Answers to the options asked for in initialize_client(),
+            # once every command is whole
+            if commands and client.input_state not in IN_COMMAND:
+                self.negotiate(commands, client)
+
+                commands.clear()
+
+            # A subnegotiation that never ends is dropped
+            elif commands and len(commands) > COMMAND_LIMIT:
+                commands.clear()
+
+            search = min(search, len(client.received))
+
+        # The rest of a line that was too long is thrown away up to the
+        # next newline
+        if client.overlong:
+            end = client.received.find(b"\n", search)
+
+            if end == -1:
+                client.received.clear()
+
+                return []
+
+            del client.received[:end + 1]
+
+            client.overlong = False
+            search = 0
+
+        messages = []
+        start = 0
+
+        with memoryview(client.received) as received:
+            # The user hit enter, possibly several times in one read
+            end = client.received.find(b"\n", search)
+
+            while end != -1:
+                line_end = end
+
+                # For Windows remove the carriage return
+                if line_end > start and received[line_end - 1] == 13:
+                    line_end -= 1
+
+                    # Check for empty data
+                    if (line_end == start and not client.json and
+                            not client.line_mode):
+                        self.write("\r".encode('utf-8'), client)
+                        self.prompt(client)
 
                 # Check for empty data
-                if len(client.typing) == 0:
-                    client.socket.send("\r=> ".encode('utf-8'))
+                elif (line_end == start and not client.json and
+                      not client.line_mode):
+                    self.write("\r\n".encode('utf-8'), client)
+                    self.prompt(client)
+
+                # Dropped for being over the line limit
+                if line_end - start > self.line_limit:
+                    self.line_too_long(client)
+
+                # Non-empty data, decoded straight from the buffer
+                elif line_end > start:
+                    messages.append(str(received[start:line_end], 'utf-8',
+                                        'replace'))
+
+                start = end + 1
+                end = client.received.find(b"\n", start)
 
-                    return None
+        self.metrics.messages_in += len(messages)
 
-            # Check for empty data
-            if len(client.typing) == 0:
-                client.socket.send("\r\n=> ".encode('utf-8'))
+        # A client that edits lines itself sends each one whole, a read
+        # that stops in the middle of a line is from one sending every key.
+        # Only a guess, every read checks it again until the client agrees
+        # to LINEMODE (see telnet.py)
+        if not client.json and (client.options is None or
+                                LINEMODE not in client.options):
+            if len(client.received) > start:
+                client.line_mode = False
 
-                return None
+            # Enter on its own is sent whole in either mode
+            elif search == 0 and len(messages) > 0:
+                client.line_mode = True
 
-            # Non-empty data
-            message = client.typing
-            client.typing = ""
+        # Keep the line the user has not finished typing
+        if start > 0:
+            del client.received[:start]
 
-            return message
+        # An unfinished line over the limit is dropped right away, not
+        # once it ends, so it never holds much more than the limit
+        if len(client.received) > self.line_limit:
+            client.received.clear()
+            client.overlong = True
 
-        return None
+            self.line_too_long(client)
+
+        # Frames of a JSON lines client become the lines it would type
+        if client.json:
+            return self.unframe(messages, client)
+
+        return messages
+
+    # Spurious wakeup, nothing to read yet
+    except BlockingIOError:
+        return []
 
     # Catch connection forcibly closed
     except ConnectionResetError as e:
-        print(f"\nreceive() error: {e}\n")
+        self.log("info", "reset", client, error=e)
 
         self.connection_terminated(client)
 
@@ -113,7 +243,7 @@ def receive(self, client):
 
     # Catch and display exceptions without crashing
     except Exception as e:
-        print(f"\nreceive() error: {e}\n")
+        self.log("error", "receive_error", client, error=e)
 
         return False
 
@@ -130,47 +260,111 @@ def connection_terminated(self, client):
         None
     """
 
-    if client.username is not None:
-        print(f"\nConnection {client.address} terminated by client " +
-              f"{client.username}\n")
+    # Already removed
+    if client.socket not in self.clients:
+        return
+
+    self.log("info", "disconnect", client)
 
+    if client.username is not None:
         if client.room is not None:
-            client.room.users.remove(client)
+            self.flush_batch(client.room)
 
-        del self.usernames[client.username]
+            del client.room.users[client]
+            self.directory = None
 
-    else:
-        print(f"\nConnection {client.address} terminated by unnamed client\n")
+            if self.bus is not None:
+                self.bus.left(client.room.name, client.username)
+
+        # Not in usernames yet if the client was still logging in
+        if self.usernames.get(client.username) is client:
+            del self.usernames[client.username]
+
+            self.release_buckets(client)
+
+            if self.bus is not None:
+                self.bus.logged_out(client.username)
+
+        if self.bus is not None:
+            self.bus.release("user", client.username)
 
-    self.sockets.remove(client.socket)
+    # Send whatever is left without waiting, like a goodbye message
+    if not client.closing and len(client.outbound) > 0:
+        self.flush(client)
+
+    client.closing = True
+
+    self.wheel.cancel(client)
+
+    self.unregister(client.socket)
 
     client.socket.close()
 
     del self.clients[client.socket]
 
+    self.release_address(client)
 
-def initialize_client(self, client_socket):
+    self.metrics.connections_closed += 1
+
+
+def initialize_client(self, client_socket, json=False, address=None):
     """
     Description:
         Gets the client data and stores it in the server
     Agruments:
         A Server object
         A client socket to initialize
+        Whether the client speaks the JSON lines protocol
+        The (host, port) address of the other end, looked up later if
+        it is not given
     Return Value:
         A new client object
     """
 
+    # Sends are queued and flushed when the socket is writable
+    client_socket.setblocking(False)
+
     # New client object
     new_client = Client(client_socket)
+    new_client.json = json
+
+    # accept() already said who it is
+    if address is not None:
+        new_client.peer = f"{address[0]}:{address[1]}"
+
+    # Rate limits of the connection, shared with the username until
+    # the user logs in
+    new_client.buckets = self.make_buckets()
+    new_client.user_buckets = new_client.buckets
 
     # Add user data to the server
-    self.sockets.append(client_socket)
     self.clients[client_socket] = new_client
+    self.register(client_socket, new_client)
+
+    self.metrics.connections_accepted += 1
+
+    # Time out connections that never log in
+    if self.login_timeout > 0:
+        new_client.deadline = time.monotonic() + self.login_timeout
+
+    self.watch(new_client)
+
+    # Greet telnet users, queued so it goes out in the same write as the
+    # username prompt, after asking the client to edit lines itself
+    if not json:
+        if self.telnet_negotiation:
+            self.write(OFFER, new_client)
+
+        if self.compression:
+            self.write(COMPRESSION_OFFER, new_client)
+
+        self.write(WELCOME, new_client)
 
     # Prompt the user to enter a username
     self.send("Username?: ", new_client)
 
-    print(f"\nNew connection: {new_client.address}\n")
+    self.log("info", "connect", new_client,
+             protocol="json" if json else "telnet")
 
     return new_client
 
@@ -182,28 +376,106 @@ def login(self, client, password):
     Arguments:
         A Server object
         The client attempting to log in
+        The password the client typed
     Return Value:
-        True if the login was processed successfully
+        True if the password is being checked
         False if an error occurred
     """
 
-    # Check against saved password
-    if self.passwords[client.username] != password:
+    # Check against the saved hash off the event loop, the client
+    # waits until the result is back
+    client.parked = True
+
+    if not self.hasher.verify(password, self.passwords[client.username],
+                              login_checked, self, client, password):
+        client.parked = False
+
+        if self.bus is not None:
+            self.bus.release("user", client.username)
+
         client.username = None
         client.logging_in = False
 
-        self.send("Incorrect password", client)
+        self.send("Server busy, try again later", client)
         self.send("Username:", client)
 
         return False
 
+    return True
+
+
+def login_checked(self, client, password, correct):
+    """
+    Description:
+        Finishes logging in once the password has been checked
+    Arguments:
+        A Server object
+        The client attempting to log in
+        The password the client typed
+        True if the password was correct
+    Return Value:
+        None
+    """
+
+    # Disconnected while waiting, connection_terminated() already
+    # released the username
+    if client.closing:
+        return
+
+    if not correct:
+        if self.bus is not None:
+            self.bus.release("user", client.username)
+
+        client.username = None
+        client.logging_in = False
+
+        self.send("Incorrect password", client)
+        self.send("Username:", client)
+
     else:
         self.usernames[client.username] = client
         client.logging_in = False
+        client.deadline = None
+
+        self.assign_buckets(client)
+
+        if self.bus is not None:
+            self.bus.logged_in(client.username)
 
         self.send(f"Welcome back, {client.username}!", client)
 
-        return True
+        # Hash passwords saved before hashing was added
+        if not self.passwords[client.username].startswith("scrypt$"):
+            self.hasher.hash(password, password_upgraded, self,
+                             client.username, password)
+
+    self.resume(client)
+
+
+def password_upgraded(self, username, password, hashed):
+    """
+    Description:
+        Replaces a plain text password with its hash
+    Arguments:
+        A Server object
+        The username
+        The plain text password
+        The hashed password (None if hashing failed)
+    Return Value:
+        None
+    """
+
+    # The password was changed while it was being hashed
+    if hashed is None or self.passwords.get(username) != password:
+        return
+
+    self.passwords[username] = hashed
+
+    if self.bus is not None:
+        self.bus.send("password", username, hashed)
+
+    if self.store is not None:
+        self.store.save_password(username, hashed)
 
 
 def set_username(self, client, username):
@@ -248,12 +520,22 @@ def set_username(self, client, username):
 
         no_errors = False
 
+    # Check no other worker in the cluster has the username
+    if no_errors and self.bus is not None:
+        if not self.bus.claim("user", username):
+            if username in self.passwords:
+                self.send(f"User already logged in: {username}", client)
+
+            else:
+                self.send(f"Sorry, {username} is taken", client)
+
+            no_errors = False
+
     if no_errors:
         # Set the clients username for now
         client.username = username
 
-        print(f"\nClient at {client.address} set username to " +
-              f"{client.username}\n")
+        self.log("info", "username", client)
 
         if username in self.passwords:
             client.logging_in = True
@@ -262,6 +544,12 @@ def set_username(self, client, username):
 
         else:
             self.usernames[username] = client
+            client.deadline = None
+
+            self.assign_buckets(client)
+
+            if self.bus is not None:
+                self.bus.logged_in(username)
 
             self.send(f"Welcome, {username}!", client)
 
@@ -285,6 +573,19 @@ def process(self, data, client):
         False if an error occurred
     """
 
+    # Waiting for a password hash or a rate limit, keep the data until
+    # it is done
+    if client.parked:
+        if client.held is None:
+            client.held = collections.deque()
+
+        elif len(client.held) >= HELD_LIMIT:
+            return False
+
+        client.held.append(data)
+
+        return True
+
     # Client has not set username yet
     if client.username is None:
         return self.set_username(client, data)
@@ -295,6 +596,10 @@ def process(self, data, client):
     if isinstance(client.setting_password, str) or client.setting_password > 0:
         return password(self, data, client)
 
+    # Out of tokens, the rate penalty was applied
+    if self.rate_limited(data, client):
+        return False
+
     # Reroute to command function
     if data[0] == '/':
         if len(data) == 1 or data[1] != '/':
@@ -315,7 +620,28 @@ def process(self, data, client):
     return self.distribute(data, [client.room.name], client)
 
 
-def distribute(self, data, rooms, client=None, except_users=[]):
+def resume(self, client):
+    """
+    Description:
+        Unparks a client and processes what it sent while parked
+    Arguments:
+        A Server object
+        The parked client object
+    Return Value:
+        None
+    """
+
+    client.parked = False
+
+    if client.held is None:
+        return
+
+    while len(client.held) > 0 and not client.parked and not client.closing:
+        self.process(client.held.popleft(), client)
+
+
+def distribute(self, data, rooms, client=None, except_users=(),
+               relay=True, history=None, chat=None):
     """
     Description:
         Distributes data to all users in a given room
@@ -324,7 +650,12 @@ def distribute(self, data, rooms, client=None, except_users=[]):
         Data to send
         A list of rooms name to send to
         The client object who sent the data (None means the server)
-        A list of client objects not to send the message to
+        A set of client objects not to send the message to
+        Whether to pass the data on to the other cluster workers
+        Whether to keep the data in the room history (None keeps
+        messages from users but not from the server)
+        A (username, data) tuple of a user's message relayed from
+        another cluster worker, for the JSON lines frames
     Return Value:
         True if the data was distributed
         False if an error occurred
@@ -338,29 +669,128 @@ def distribute(self, data, rooms, client=None, except_users=[]):
     if len(data) == 0 or len(rooms) == 0:
         return False
 
+    if history is None:
+        history = client is not None
+
     for room in rooms:
         # Some kind of error
         if room is None:
             return False
 
-        for user in self.rooms[room].users:
-            # User sends data
-            if client is not None:
-                if user not in except_users:
-                    send_user = client.username
+        # User sends data
+        if client is not None:
+            send_user = client.username
 
-                    # Tag user appropriately
-                    if client.username == self.rooms[room].owner:
-                        send_user += " (owner)"
+            # Tag user appropriately
+            if client.username == self.rooms[room].owner:
+                send_user += " (owner)"
 
-                    if client.username in self.rooms[room].admins:
-                        send_user += " (admin)"
+            if client.username in self.rooms[room].admins:
+                send_user += " (admin)"
 
-                    self.send(f"{send_user}: {data}", user)
+            message = f"{send_user}: {data}"
+            chat = (client.username, data)
 
-            # Server sends a message
-            else:
+        # Server sends a message
+        else:
+            message = data
+
+        start = time.perf_counter()
+        recipients = 0
+
+        # Encode once, every user's queue shares the same bytes
+        payload = f"\r<= {message}\r\n".encode('utf-8')
+
+        # The JSON lines frame and the payload without the carriage
+        # return for clients that edit lines themselves, only made once
+        # a member needs them
+        framed = None
+        plain = None
+
+        # Busy rooms collect messages for every member and write them
+        # together
+        if self.rooms[room].batch_window > 0 and len(except_users) == 0:
+            self.batch(self.rooms[room], payload,
+                       message_frame(room, message, chat))
+
+            recipients = len(self.rooms[room].users)
+
+        else:
+            # Keep the order of messages waiting in a batch
+            self.flush_batch(self.rooms[room])
+
+            for user in self.rooms[room].users:
                 if user not in except_users:
-                    self.send(data, user)
+                    user.needs_prompt = True
+
+                    if user.json:
+                        if framed is None:
+                            framed = message_frame(room, message, chat)
+
+                        self.write(framed, user)
+
+                    elif user.line_mode:
+                        if plain is None:
+                            plain = payload[1:]
+
+                        self.write(plain, user)
+
+                    else:
+                        self.write(payload, user)
+
+                    recipients += 1
+
+        self.metrics.fanout.observe(recipients)
+        self.metrics.distribute.observe(time.perf_counter() - start)
+
+        if history:
+            self.remember(self.rooms[room], payload)
+
+        if relay and self.bus is not None:
+            self.bus.send("distribute", room, message,
+                          [user.username for user in except_users], history,
+                          chat)
+
+    return True
+
+
+def online(self, username):
+    """
+    Description:
+        Checks whether a user is connected, on any cluster worker
+    Arguments:
+        A Server object
+        A username
+    Return Value:
+        True if the user is logged in
+        False otherwise
+    """
+
+    if username in self.usernames:
+        return True
+
+    return self.bus is not None and username in self.bus.users
+
+
+def notify(self, username, data):
+    """
+    Description:
+        Sends data to a user by name, wherever they are connected
+    Arguments:
+        A Server object
+        The username to send the data to
+        Data to send
+    Return Value:
+        True if the data was sent or passed on to another worker
+        False if the user is not connected
+    """
+
+    if username in self.usernames:
+        return self.send(data, self.usernames[username])
+
+    if not self.online(username):
+        return False
+
+    self.bus.send("send", username, data)
 
     return True
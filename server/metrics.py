@@ -0,0 +1,311 @@
+###############################################################################
+# metrics.py                                                                  #
+# The metrics functions for the server object                                 #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+# Counters and histograms are plain integers and preallocated lists, so
+# recording an event is a bisect and an increment with nothing created.
+# They are read by the owner-only /stats command and by a plaintext
+# endpoint in the Prometheus text format that a scraper can poll.
+
+import bisect
+import selectors
+import socket
+
+from .commands import COMMANDS
+
+# Upper bounds of the latency buckets in seconds
+LATENCY_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                   0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+# Upper bounds of the fan-out buckets in recipients
+FANOUT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+                  10000)
+
+# Upper bounds of the outbound queue depth buckets in bytes
+QUEUE_BUCKETS = (0, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+# Bytes read from a metrics request, only the first line matters
+REQUEST_BUFFER = 4096
+
+
+class Histogram():
+    """
+    Counts observations in fixed buckets
+    """
+
+    __slots__ = ("bounds", "counts", "total", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+
+        # One count per bucket plus one for values past the last bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += 1
+        self.sum += value
+
+    def quantile(self, fraction):
+        # The upper bound of the bucket holding the quantile
+        target = fraction * self.total
+        seen = 0
+
+        for index, count in enumerate(self.counts):
+            seen += count
+
+            if count > 0 and seen >= target:
+                if index < len(self.bounds):
+                    return self.bounds[index]
+
+                return float("inf")
+
+        return 0
+
+
+class Metrics():
+    """
+    Every counter and histogram of one Server object
+    """
+
+    def __init__(self):
+        self.connections_accepted = 0
+        self.connections_closed = 0
+
+        # Connections turned away for being over a cap (see listener.py)
+        self.connections_rejected = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.messages_in = 0
+
+        # Bytes queued for clients that compress, before and after
+        # compression (see compression.py)
+        self.compressed_in = 0
+        self.compressed_out = 0
+
+        # Lines dropped for being over the line limit, messages dropped
+        # and clients disconnected while over the memory budget
+        # (see memory.py)
+        self.lines_too_long = 0
+        self.memory_dropped = 0
+        self.memory_disconnects = 0
+
+        # sendmsg() calls, one per client per flush at best
+        self.sends = 0
+
+        # A dictionary with the command function as the key and a
+        # histogram of its run time as the value
+        # Aliases like /j and /join share one histogram
+        self.commands = {handler: Histogram(LATENCY_BUCKETS)
+                         for handler in COMMANDS.values()}
+
+        # Unknown commands, answered with the list of valid commands
+        self.invalid_commands = 0
+
+        # Recipients and run time of each room a message went to
+        self.fanout = Histogram(FANOUT_BUCKETS)
+        self.distribute = Histogram(LATENCY_BUCKETS)
+
+        # Bytes queued for each client when its queue is flushed
+        self.queue_depth = Histogram(QUEUE_BUCKETS)
+
+    def render(self, server):
+        """
+        Description:
+            Formats every metric in the Prometheus text format
+        Arguments:
+            A Metrics object
+            The Server object the metrics belong to
+        Return Value:
+            The text as bytes
+        """
+
+        lines = []
+
+        def counter(name, value, kind="counter"):
+            lines.append(f"# TYPE chat_{name} {kind}")
+            lines.append(f"chat_{name} {value}")
+
+        def histogram(name, data, labels=""):
+            cumulative = 0
+
+            for bound, count in zip(data.bounds + ("+Inf",), data.counts):
+                cumulative += count
+                lines.append(f'chat_{name}_bucket{{{labels}le="{bound}"}} ' +
+                             f"{cumulative}")
+
+            lines.append(f"chat_{name}_sum{{{labels[:-1]}}} {data.sum}")
+            lines.append(f"chat_{name}_count{{{labels[:-1]}}} {data.total}")
+
+        counter("connections_accepted_total", self.connections_accepted)
+        counter("connections_closed_total", self.connections_closed)
+        counter("connections_rejected_total", self.connections_rejected)
+        counter("bytes_in_total", self.bytes_in)
+        counter("bytes_out_total", self.bytes_out)
+        counter("messages_in_total", self.messages_in)
+        counter("compression_in_bytes_total", self.compressed_in)
+        counter("compression_out_bytes_total", self.compressed_out)
+        counter("lines_too_long_total", self.lines_too_long)
+        counter("memory_dropped_total", self.memory_dropped)
+        counter("memory_disconnects_total", self.memory_disconnects)
+        counter("sendmsg_calls_total", self.sends)
+        counter("invalid_commands_total", self.invalid_commands)
+
+        counter("log_dropped_total", server.logger.dropped)
+
+        for policy, count in server.slow_counts.items():
+            counter(f"slow_consumer_{policy}_total", count)
+
+        for kind, count in server.rate_limit_counts.items():
+            counter(f"rate_limited_{kind}_total", count)
+
+        counter("clients", len(server.clients), "gauge")
+        counter("users", len(server.usernames), "gauge")
+        counter("rooms", len(server.rooms), "gauge")
+
+        # Bytes held for connections and history (see memory.py)
+        usage = server.memory_usage()
+
+        counter("inbound_bytes", usage["inbound"], "gauge")
+        counter("outbound_bytes", usage["outbound"], "gauge")
+        counter("history_bytes", usage["history"], "gauge")
+        counter("memory_budget_bytes", server.memory_budget, "gauge")
+
+        lines.append("# TYPE chat_command_seconds histogram")
+
+        for handler, data in self.commands.items():
+            histogram("command_seconds", data,
+                      f'command="{handler.__name__}",')
+
+        lines.append("# TYPE chat_distribute_recipients histogram")
+        histogram("distribute_recipients", self.fanout)
+
+        lines.append("# TYPE chat_distribute_seconds histogram")
+        histogram("distribute_seconds", self.distribute)
+
+        lines.append("# TYPE chat_outbound_queue_bytes histogram")
+        histogram("outbound_queue_bytes", self.queue_depth)
+
+        return ("\n".join(lines) + "\n").encode('utf-8')
+
+    def summary(self):
+        """
+        Description:
+            Describes the metrics in a few lines for the /stats command
+        Arguments:
+            A Metrics object
+        Return Value:
+            A list of strings
+        """
+
+        lines = [f"Connections: {self.connections_accepted} accepted, " +
+                 f"{self.connections_closed} closed, " +
+                 f"{self.connections_rejected} turned away",
+                 f"Bytes: {self.bytes_in} in, {self.bytes_out} out " +
+                 f"({self.sends} sendmsg calls)",
+                 f"Compression: {self.compressed_in} bytes down to " +
+                 f"{self.compressed_out}",
+                 f"Messages: {self.messages_in} in, " +
+                 f"{self.fanout.total} distributed " +
+                 f"(recipients p50 <= {self.fanout.quantile(0.5)}, " +
+                 f"p99 <= {self.fanout.quantile(0.99)})",
+                 "Distribute: p50 <= " +
+                 f"{self.distribute.quantile(0.5) * 1000:g} ms, " +
+                 f"p99 <= {self.distribute.quantile(0.99) * 1000:g} ms",
+                 "Outbound queue: p99 <= " +
+                 f"{self.queue_depth.quantile(0.99)} bytes"]
+
+        for handler, data in self.commands.items():
+            if data.total > 0:
+                lines.append(f" * {handler.__name__}: {data.total} calls, " +
+                             f"p50 <= {data.quantile(0.5) * 1000:g} ms, " +
+                             f"p99 <= {data.quantile(0.99) * 1000:g} ms")
+
+        return lines
+
+
+###############################################################################
+#                              Server Functions                               #
+###############################################################################
+
+
+def serve_metrics(self, address):
+    """
+    Description:
+        Starts the plaintext metrics endpoint on a local address
+        Only used with the server's own selector, the asyncio runner
+        serves the same text through its event loop
+    Arguments:
+        A Server object
+        A (host, port) tuple to listen on
+    Return Value:
+        The listening socket
+    """
+
+    metrics_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    metrics_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    metrics_socket.bind(address)
+    metrics_socket.listen()
+    metrics_socket.setblocking(False)
+
+    def accept(events):
+        try:
+            connection, connection_address = metrics_socket.accept()
+
+        except BlockingIOError:
+            return
+
+        connection.setblocking(False)
+
+        self.register(connection, lambda events: request(connection))
+
+    def request(connection):
+        try:
+            connection.recv(REQUEST_BUFFER)
+
+        except BlockingIOError:
+            return
+
+        except OSError:
+            self.unregister(connection)
+            connection.close()
+
+            return
+
+        body = self.metrics.render(self)
+        response = memoryview(b"HTTP/1.0 200 OK\r\n" +
+                              b"Content-Type: text/plain; version=0.0.4\r\n" +
+                              f"Content-Length: {len(body)}\r\n\r\n"
+                              .encode('utf-8') + body)
+
+        # Wait for the socket to be writable if the response is large
+        self.selector.modify(connection, selectors.EVENT_WRITE,
+                             lambda events: respond(connection, response))
+
+    def respond(connection, response):
+        try:
+            sent = connection.send(response)
+
+        except BlockingIOError:
+            return
+
+        except OSError:
+            sent = len(response)
+
+        if sent < len(response):
+            self.selector.modify(
+                connection, selectors.EVENT_WRITE,
+                lambda events: respond(connection, response[sent:]))
+
+            return
+
+        self.unregister(connection)
+        connection.close()
+
+    self.register(metrics_socket, accept)
+
+    return metrics_socket
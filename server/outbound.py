@@ -0,0 +1,278 @@
+###############################################################################
+# outbound.py                                                                 #
+# The outbound queue functions for the server object                          #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+import itertools
+
+# Most buffers one sendmsg() call accepts on Linux
+IOV_MAX = 1024
+
+# Queued bytes per client before the slow consumer policy kicks in
+OUTBOUND_HIGH_WATER = 256 * 1024
+
+# Queued bytes per client a slow consumer must drain down to
+OUTBOUND_LOW_WATER = 64 * 1024
+
+# What to do with a client whose queue reaches the high-water mark
+# drop_oldest: discard the oldest queued messages down to the low-water mark
+# drop_newest: discard new messages until the queue drains to the low-water
+#              mark
+# disconnect:  terminate the connection
+SLOW_POLICIES = ("drop_oldest", "drop_newest", "disconnect")
+
+
+def write(self, data, client):
+    """
+    Description:
+        Queues bytes for a client to be sent by flush_pending(),
+        applying the slow consumer policy when the client's queue is
+        full
+    Arguments:
+        A Server object
+        Bytes to send
+        A client object to send the bytes to
+    Return Value:
+        True if the bytes were queued
+        False if they were dropped or an error occurred
+    """
+
+    if client.closing:
+        return False
+
+    # Over the memory budget, clients that are already behind get nothing
+    # new (see memory.py)
+    if self.over_budget and client.outbound_size >= self.low_water:
+        self.metrics.memory_dropped += 1
+
+        return False
+
+    if client.slow or client.outbound_size + len(data) > self.high_water:
+        if not slow_consumer(self, len(data), client):
+            return False
+
+    client.outbound.append(data)
+    client.outbound_size += len(data)
+
+    self.pending.add(client)
+
+    return True
+
+
+def prompt(self, client):
+    """
+    Description:
+        Re-prints the prompt and what the user was typing once the
+        client's queued messages are sent
+    Arguments:
+        A Server object
+        A client object to prompt
+    Return Value:
+        None
+    """
+
+    client.needs_prompt = True
+
+    self.pending.add(client)
+
+
+def slow_consumer(self, size, client):
+    """
+    Description:
+        Applies the slow consumer policy to a client whose queue cannot
+        take any more bytes
+    Arguments:
+        A Server object
+        The number of bytes waiting to be queued
+        The slow client object
+    Return Value:
+        True if there is now room for the bytes
+        False if the bytes must be dropped
+    """
+
+    self.slow_counts[self.slow_policy] += 1
+
+    if self.slow_policy == "disconnect":
+        self.close_later(client)
+
+        return False
+
+    if self.slow_policy == "drop_newest":
+        # Keep dropping until the queue drains to the low-water mark
+        client.slow = True
+
+        return False
+
+    # Drop whole messages, oldest first, but never the one that
+    # has already been partially sent or one that is part of a
+    # compressed stream
+    keep = max(1 if client.outbound_sent > 0 else 0,
+               client.outbound_compressed)
+
+    while (len(client.outbound) > keep and
+           client.outbound_size + size > self.low_water):
+        dropped = client.outbound[keep]
+        del client.outbound[keep]
+        client.outbound_size -= len(dropped)
+
+    # What is left would be compressed onto the stream at the next flush
+    # and could never be dropped, so the queue would only grow. The stream
+    # ends here and what follows is queued as it is
+    if client.compressing:
+        self.end_compression(client)
+
+        self.log("warning", "compress_end", client, reason="slow")
+
+    return True
+
+
+def flush(self, client):
+    """
+    Description:
+        Sends as much of a client's queue as the socket will take
+        without blocking, gathering queued messages into one system
+        call and handling partial writes
+    Arguments:
+        A Server object
+        A client object to flush
+    Return Value:
+        True if no error occurred
+        False if the connection failed
+    """
+
+    client.blocked = False
+
+    # Everything queued since the last flush becomes one compressed write
+    if client.compressing:
+        self.compress_outbound(client)
+
+    try:
+        while len(client.outbound) > 0:
+            buffers = list(itertools.islice(client.outbound, IOV_MAX))
+
+            # Skip what a partial write already sent
+            if client.outbound_sent > 0:
+                buffers[0] = memoryview(buffers[0])[client.outbound_sent:]
+
+            sent = client.socket.sendmsg(buffers)
+            self.metrics.sends += 1
+
+            client.outbound_size -= sent
+            self.metrics.bytes_out += sent
+
+            # Pop every fully sent message
+            sent += client.outbound_sent
+
+            while (len(client.outbound) > 0 and
+                   sent >= len(client.outbound[0])):
+                sent -= len(client.outbound.popleft())
+
+                if client.outbound_compressed > 0:
+                    client.outbound_compressed -= 1
+
+            client.outbound_sent = sent
+
+            # Partial write, the socket buffer is full
+            if sent > 0:
+                break
+
+    # The socket buffer is full
+    except (BlockingIOError, InterruptedError):
+        pass
+
+    except Exception as e:
+        self.log("error", "send_error", client, error=e)
+
+        self.close_later(client)
+
+        return False
+
+    # A slow consumer has caught up
+    if client.slow and client.outbound_size <= self.low_water:
+        client.slow = False
+
+    # Wait for the socket to be writable only while bytes are queued
+    client.blocked = len(client.outbound) > 0
+
+    self.set_writable(client, client.blocked)
+
+    return True
+
+
+def flush_pending(self):
+    """
+    Description:
+        Sends everything queued since the last call, once per client,
+        with the prompt re-printed at the end of each client's messages
+        Called once per event loop iteration
+    Arguments:
+        A Server object
+    Return Value:
+        None
+    """
+
+    for client in self.pending:
+        if client.closing:
+            continue
+
+        # Re-print the message the user was just typing to make it
+        # seem like the user was not interruped
+        # Only works on Windows because Linux and OS X don't send
+        # continuous data!
+        if client.needs_prompt:
+            client.needs_prompt = False
+
+            # Bots have no prompt to re-print and clients that edit lines
+            # themselves already show what the user is typing
+            if not client.json and not client.line_mode:
+                data = "=> ".encode('utf-8') + client.received
+                client.outbound.append(data)
+                client.outbound_size += len(data)
+
+        self.metrics.queue_depth.observe(client.outbound_size)
+
+        # Still waiting for the socket to be writable
+        if not client.blocked:
+            self.flush(client)
+
+    self.pending.clear()
+
+    # Shared writes are only compressed once per loop iteration
+    self.shared_blocks.clear()
+
+    self.check_memory()
+
+
+def close_later(self, client):
+    """
+    Description:
+        Marks a client to be disconnected once the current event has
+        been handled, so rooms are never changed while being iterated
+    Arguments:
+        A Server object
+        A client object to disconnect
+    Return Value:
+        None
+    """
+
+    if not client.closing:
+        client.closing = True
+
+        self.closing.append(client)
+
+
+def close_pending(self):
+    """
+    Description:
+        Disconnects every client marked by close_later()
+    Arguments:
+        A Server object
+    Return Value:
+        None
+    """
+
+    while len(self.closing) > 0:
+        client = self.closing.pop()
+
+        self.connection_terminated(client)
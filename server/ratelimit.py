@@ -0,0 +1,226 @@
+###############################################################################
+# ratelimit.py                                                                #
+# The rate limiting functions for the server object                           #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+# Every connection and every username has a token bucket for each kind of
+# input: chat lines, commands and private messages. A line takes a token
+# from both of the client's buckets. The username buckets outlive the
+# connection, so reconnecting does not refill them, and are forgotten once
+# they have refilled, since new buckets would be the same. A client out
+# of tokens is penalized with the server's rate penalty.
+
+import collections
+import time
+
+# Tokens added per second and the most tokens a bucket holds (the burst)
+# for each kind of input
+RATE_LIMITS = {"chat": (5, 10),
+               "command": (5, 20),
+               "private": (2, 5)}
+
+# What to do with a line from a client that is out of tokens
+# delay: hold the client's input until a token is available
+# drop:  discard the line
+# kick:  disconnect the client
+RATE_PENALTIES = ("delay", "drop", "kick")
+
+# Commands limited by the private message budget
+PRIVATE_COMMANDS = ("/private", "/p")
+
+
+class TokenBucket():
+    """
+    A token bucket refilled continuously at a fixed rate
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        # Refill for the time since the last check
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+
+            return True
+
+        return False
+
+    def refund(self):
+        self.tokens += 1
+
+    def wait(self):
+        # Seconds until the next token
+        return (1 - self.tokens) / self.rate
+
+    def until_full(self, now):
+        # Seconds until the bucket holds its burst again
+        return ((self.burst - self.tokens) / self.rate -
+                (now - self.updated))
+
+
+def make_buckets(self):
+    """
+    Description:
+        Creates one token bucket for each rate limited kind of input
+    Arguments:
+        A Server object
+    Return Value:
+        A dictionary with the kind of input as the key and the bucket
+        as the value
+    """
+
+    return {kind: TokenBucket(rate, burst)
+            for kind, (rate, burst) in self.rate_limits.items()}
+
+
+def rate_limited(self, data, client):
+    """
+    Description:
+        Takes a token for a line of input from the client's connection
+        and username buckets, applying the rate penalty when either is
+        empty
+    Arguments:
+        A Server object
+        The line of input
+        The client object that sent it
+    Return Value:
+        True if the line must not be processed now
+        False if the line can be processed
+    """
+
+    if data[0] != '/' or data[:2] == "//":
+        kind = "chat"
+
+    else:
+        kind = "command"
+
+        # The first word, like command() splits it, without making a
+        # list of the words for every line
+        for name in PRIVATE_COMMANDS:
+            end = len(name)
+
+            if data.startswith(name) and (len(data) == end or
+                                          data[end].isspace()):
+                kind = "private"
+
+                break
+
+    connection_bucket = client.buckets.get(kind)
+
+    # Not limited
+    if connection_bucket is None:
+        return False
+
+    now = time.monotonic()
+    user_bucket = client.user_buckets[kind]
+
+    if connection_bucket.take(now):
+        if user_bucket is connection_bucket or user_bucket.take(now):
+            client.throttled = False
+
+            return False
+
+        connection_bucket.refund()
+        empty = user_bucket
+
+    else:
+        empty = connection_bucket
+
+    self.rate_limit_counts[kind] += 1
+
+    if self.rate_penalty == "kick":
+        self.send("Disconnected for sending too fast", client)
+        self.flush(client)
+        self.close_later(client)
+
+    elif self.rate_penalty == "delay":
+        # Process the line, then the rest of the input, once a token
+        # is available
+        client.parked = True
+
+        if client.held is None:
+            client.held = collections.deque()
+
+        client.held.appendleft(data)
+
+        self.call_later(empty.wait(), self.resume, client)
+
+    # Only tell the user once until a line gets through
+    elif not client.throttled:
+        self.send("You are sending too fast, message dropped", client)
+
+    client.throttled = True
+
+    return True
+
+
+def assign_buckets(self, client):
+    """
+    Description:
+        Gives a client that just logged in the buckets of its username
+    Arguments:
+        A Server object
+        The client object
+    Return Value:
+        None
+    """
+
+    if len(self.rate_limits) > 0:
+        client.user_buckets = self.user_buckets.setdefault(
+            client.username, self.make_buckets())
+
+
+def release_buckets(self, client):
+    """
+    Description:
+        Forgets the buckets of a disconnected user once they are full,
+        since a new bucket would be the same
+    Arguments:
+        A Server object
+        The disconnected client object
+    Return Value:
+        None
+    """
+
+    if self.user_buckets.get(client.username) is client.user_buckets:
+        self.expire_buckets(client.username)
+
+
+def expire_buckets(self, username):
+    """
+    Description:
+        Forgets the buckets of a username that is not logged in if they
+        are full, or checks again once they will be
+    Arguments:
+        A Server object
+        The username
+    Return Value:
+        None
+    """
+
+    buckets = self.user_buckets.get(username)
+
+    # Logged in again, checked again when that connection ends
+    if buckets is None or username in self.usernames:
+        return
+
+    now = time.monotonic()
+    wait = max(bucket.until_full(now) for bucket in buckets.values())
+
+    if wait <= 0:
+        del self.user_buckets[username]
+
+    # Every bucket spent on the way out, like the token of /quit
+    else:
+        self.call_later(wait, self.expire_buckets, username)
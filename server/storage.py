@@ -0,0 +1,175 @@
+###############################################################################
+# storage.py                                                                  #
+# The account and room store of the server                                    #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+# Passwords, created rooms, admins and bans are kept in SQLite in WAL mode.
+# The event loop only puts changes on a queue. A writer thread commits them
+# in batches, so a slow disk never stalls the chat. Everything is loaded
+# back with a few bulk queries when the server starts.
+
+import queue
+import sqlite3
+import threading
+
+from room import Room
+
+# Most changes committed in one transaction
+BATCH_SIZE = 10000
+
+SCHEMA = ("CREATE TABLE IF NOT EXISTS accounts ("
+          "username TEXT PRIMARY KEY, password TEXT NOT NULL)",
+          "CREATE TABLE IF NOT EXISTS rooms ("
+          "name TEXT PRIMARY KEY, owner TEXT NOT NULL)",
+          "CREATE TABLE IF NOT EXISTS admins ("
+          "room TEXT NOT NULL, username TEXT NOT NULL, "
+          "PRIMARY KEY (room, username))",
+          "CREATE TABLE IF NOT EXISTS bans ("
+          "room TEXT NOT NULL, username TEXT NOT NULL, "
+          "PRIMARY KEY (room, username))")
+
+SAVE_PASSWORD = ("INSERT OR REPLACE INTO accounts (username, password) "
+                 "VALUES (?, ?)")
+SAVE_ROOM = "INSERT OR REPLACE INTO rooms (name, owner) VALUES (?, ?)"
+ADD_ADMIN = "INSERT OR IGNORE INTO admins (room, username) VALUES (?, ?)"
+REMOVE_ADMIN = "DELETE FROM admins WHERE room = ? AND username = ?"
+ADD_BAN = "INSERT OR IGNORE INTO bans (room, username) VALUES (?, ?)"
+REMOVE_BAN = "DELETE FROM bans WHERE room = ? AND username = ?"
+DELETE_ROOM = ("DELETE FROM rooms WHERE name = ?",
+               "DELETE FROM admins WHERE room = ?",
+               "DELETE FROM bans WHERE room = ?")
+
+
+class Store():
+    """
+    A SQLite database with a write-behind queue
+    """
+
+    def __init__(self, path, log):
+        self.path = path
+
+        # The Log object errors are written to (see log.py)
+        self.log = log
+
+        with self.connect() as connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+        # (statement, parameters) tuples waiting to be committed
+        # None asks the writer thread to stop
+        self.queue = queue.SimpleQueue()
+
+        self.writer = threading.Thread(target=self.write_behind,
+                                       name="store-writer", daemon=True)
+        self.writer.start()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+
+        # Readers never block the writer and commits only wait for the
+        # log, cluster workers can share the same file
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+
+        return connection
+
+    def load(self, rooms):
+        """
+        Description:
+            Reads every account and room
+        Arguments:
+            A Store object
+            The dictionary of rooms to add the stored rooms to, rooms
+            already in it keep their owner but get their stored admins
+            and bans
+        Return Value:
+            A dictionary with the username as the key and the password
+            as the value
+        """
+
+        connection = self.connect()
+
+        try:
+            passwords = dict(connection.execute(
+                "SELECT username, password FROM accounts"))
+
+            for name, owner in connection.execute(
+                    "SELECT name, owner FROM rooms"):
+                if name not in rooms:
+                    rooms[name] = Room(name, None)
+                    rooms[name].owner = owner
+
+            for name, username in connection.execute(
+                    "SELECT room, username FROM admins"):
+                if name in rooms:
+                    rooms[name].admins.add(username)
+
+            for name, username in connection.execute(
+                    "SELECT room, username FROM bans"):
+                if name in rooms:
+                    rooms[name].banned.add(username)
+
+        finally:
+            connection.close()
+
+        return passwords
+
+    def save_password(self, username, password):
+        self.queue.put((SAVE_PASSWORD, (username, password)))
+
+    def save_room(self, room):
+        self.queue.put((SAVE_ROOM, (room.name, room.owner)))
+
+    def delete_room(self, name):
+        for statement in DELETE_ROOM:
+            self.queue.put((statement, (name,)))
+
+    def save_admin(self, room, username, admin):
+        self.queue.put((ADD_ADMIN if admin else REMOVE_ADMIN,
+                        (room, username)))
+
+    def save_ban(self, room, username, banned):
+        self.queue.put((ADD_BAN if banned else REMOVE_BAN, (room, username)))
+
+    def write_behind(self):
+        connection = self.connect()
+        running = True
+
+        while running:
+            # Wait for a change, then take whatever else is queued
+            batch = [self.queue.get()]
+
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+
+                except queue.Empty:
+                    break
+
+            if None in batch:
+                running = False
+                batch = batch[:batch.index(None)]
+
+            try:
+                with connection:
+                    for statement, parameters in batch:
+                        connection.execute(statement, parameters)
+
+            except sqlite3.Error as e:
+                self.log.write("error", "write_behind_error", error=e)
+
+        connection.close()
+
+    def close(self):
+        """
+        Description:
+            Commits everything still queued and stops the writer thread
+        Arguments:
+            A Store object
+        Return Value:
+            None
+        """
+
+        self.queue.put(None)
+        self.writer.join()
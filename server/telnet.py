@@ -0,0 +1,418 @@
+###############################################################################
+# telnet.py                                                                   #
+# The telnet input filter and option negotiation                              #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+# Telnet clients send more than what the user typed: IAC commands and
+# option negotiation, the escape sequences of arrow and function keys and
+# backspaces. filter_input() goes over each read once. A read without any
+# control byte is copied as it is. Otherwise one regular expression
+# removes every whole sequence and control byte, and the backspaces are
+# applied to what is left. Only a read that ends in the middle of a
+# sequence, or starts in one, is stepped through from one control byte to
+# the next. Where the filter is inside the sequence is kept in the client,
+# so the rest of it is still removed on the next read.
+#
+# The bytes of the telnet commands removed are collected for the option
+# negotiation, a command cut off by the end of a read is completed by the
+# next one before it is answered. A new telnet connection is asked to edit
+# lines itself (LINEMODE) and to report its window size (NAWS). A client
+# that edits lines sends whole lines and echoes them itself, so there is
+# no prompt to re-print after every message and no prompt for a message
+# to write over.
+#
+# Unlike the usual character mode setup, the server does not offer WILL
+# ECHO and WILL SUPPRESS-GO-AHEAD. It never echoes input, a client that
+# gave the echo to it would have its user type blind, so a client that
+# refuses LINEMODE keeps its own echo and the prompt is re-printed around
+# each message instead. Go-aheads only matter to a client waiting on the
+# server's echo, the server never sends them and grants SUPPRESS-GO-AHEAD
+# when a client asks for it.
+
+import re
+
+from .compression import COMPRESS2
+
+# Telnet commands (RFC 854)
+IAC = 255
+DONT = 254
+DO = 253
+WONT = 252
+WILL = 251
+SB = 250
+SE = 240
+
+# Telnet options
+ECHO = 1               # RFC 857
+SUPPRESS_GO_AHEAD = 3  # RFC 858
+NAWS = 31              # RFC 1073, negotiate about window size
+LINEMODE = 34          # RFC 1184
+MODE = 1               # LINEMODE suboption
+EDIT = 1               # MODE flag, the client edits lines itself
+
+# Options a client may turn on at its end
+CLIENT_OPTIONS = (SUPPRESS_GO_AHEAD, NAWS, LINEMODE)
+
+# Whether new telnet connections are asked for LINEMODE and NAWS
+TELNET_NEGOTIATION = True
+
+# Sent before the welcome message, clients that do not speak telnet
+# never answer it. No WILL ECHO, the server does not echo input
+OFFER = bytes((IAC, DO, LINEMODE, IAC, DO, NAWS))
+
+ESC = 27
+BACKSPACE = 8
+DELETE = 127
+BELL = 7
+NEWLINE = 10
+
+# Where the filter is between reads
+DATA = 0
+COMMAND = 1        # after IAC
+OPTION = 2         # after IAC WILL/WONT/DO/DONT
+SUBNEGOTIATION = 3
+SUBNEGOTIATION_IAC = 4
+ESCAPE = 5         # after ESC
+CSI = 6            # ESC [ parameters... final byte
+SS3 = 7            # ESC O and one more byte
+OSC = 8            # ESC ] text... BEL or ESC \
+OSC_ESCAPE = 9
+
+# Inside a telnet command, its bytes are still being collected
+IN_COMMAND = (COMMAND, OPTION, SUBNEGOTIATION, SUBNEGOTIATION_IAC)
+
+# Most bytes of telnet commands collected for one negotiation, the rest of
+# a subnegotiation that never ends is not answered
+COMMAND_LIMIT = 1024
+
+# Bytes that need a look, everything else is copied as it is
+# Tab, carriage return and newline are kept
+SPECIAL = (bytes(range(0x09)) + b"\x0b\x0c" + bytes(range(0x0e, 0x20)) +
+           b"\x7f\xff")
+
+# translate() tables turning every special byte into 0xff and delete
+# into backspace
+MARKS = bytes(IAC if byte in SPECIAL else byte for byte in range(256))
+BACKSPACES = bytes(BACKSPACE if byte == DELETE else byte
+                   for byte in range(256))
+
+# A whole telnet command or escape sequence. A control byte where an
+# escape sequence needs its final byte, like the carriage return after a
+# stray ESC [, ends the sequence but is not part of it
+SEQUENCE = re.compile(rb"""
+    \xff (?: [\xfb-\xfe] .                         # IAC WILL/WONT/DO/DONT x
+          | \xfa (?: [^\xff] | \xff [^\xf0] )* \xff\xf0  # IAC SB ... IAC SE
+          | [^\xfa-\xfe] )                         # IAC and a command
+    | \x1b (?: \[ [\x20-\x3f]* (?: [\x40-\x7e] | (?=[^\x20-\x3f]) )  # CSI
+          | O (?: [\x20-\x7e] | (?=[^\x20-\x7e]) )  # SS3, like F1
+          | \] [^\x07\x1b]* (?: \x07 | \x1b . )       # OSC, like a title
+          | [\x20-\x4e\x50-\x5a\x5c\x5e-\x7e]       # two bytes, like ESC c
+          | (?=[^\x20-\x7e]) )                   # ESC before a control byte
+    """, re.DOTALL | re.VERBOSE)
+
+# Whole sequences and the control bytes that are dropped, backspaces are
+# applied afterwards
+STRIP = re.compile(SEQUENCE.pattern + rb"""
+    | [\x00-\x07\x0b\x0c\x0e-\x1a\x1c-\x1f]
+    """, re.DOTALL | re.VERBOSE)
+
+# A telnet command with its option, or a subnegotiation with its option
+# and parameters
+NEGOTIATION = re.compile(rb"""
+    \xff (?: ([\xfb-\xfe]) (.)                    # IAC WILL/WONT/DO/DONT x
+          | \xfa (.) ((?: [^\xff] | \xff [^\xf0] )*) \xff\xf0  # IAC SB x ...
+          | . )                                  # IAC and a command
+    """, re.DOTALL | re.VERBOSE)
+
+
+def erase(line):
+    # Remove the last character of the unfinished line, with every byte
+    # of a UTF-8 character, but never a newline already typed
+    index = len(line) - 1
+
+    if index < 0 or line[index] == NEWLINE:
+        return
+
+    while index > 0 and 0x80 <= line[index] < 0xc0:
+        index -= 1
+
+    if line[index] == NEWLINE:
+        index += 1
+
+    del line[index:]
+
+
+def backspace(data, line):
+    # Add filtered bytes to the line, each backspace or delete erasing
+    # the character before it
+    parts = data.translate(BACKSPACES).split(b"\x08")
+
+    line += parts[0]
+
+    for part in parts[1:]:
+        erase(line)
+
+        line += part
+
+
+def filter_input(data, line, state=DATA, commands=None):
+    """
+    Description:
+        Removes telnet commands and terminal escape sequences from what a
+        client sent and applies its backspaces
+    Arguments:
+        The bytes or bytearray that was read
+        The bytearray of the client's unfinished line, the filtered bytes
+        are added to it
+        Where the filter was at the end of the last read
+        A bytearray the bytes of the telnet commands are added to, None
+        if they are not needed
+    Return Value:
+        Where the filter is at the end of this read
+    """
+
+    marked = data.translate(MARKS)
+
+    if state == DATA:
+        # Nothing to remove
+        if marked.find(IAC) == -1:
+            line += data
+
+            return DATA
+
+        removed = []
+
+        # Only reads with a telnet command in them keep what is removed
+        if commands is not None and data.find(IAC) != -1:
+            def remove(match):
+                removed.append(match.group())
+
+                return b""
+
+            stripped = STRIP.sub(remove, data)
+
+        else:
+            stripped = STRIP.sub(b"", data)
+
+        # Every sequence was whole, an ESC or IAC is left over from one
+        # cut off by the end of the read
+        if stripped.find(ESC) == -1 and stripped.find(IAC) == -1:
+            for sequence in removed:
+                if sequence[0] == IAC:
+                    commands += sequence
+
+            backspace(stripped, line)
+
+            return DATA
+
+    position = 0
+    end = len(data)
+
+    while position < end:
+        if state == DATA:
+            start = marked.find(IAC, position)
+
+            # Nothing left to remove
+            if start == -1:
+                line += data[position:]
+
+                return DATA
+
+            line += data[position:start]
+
+            byte = data[start]
+            position = start + 1
+
+            if byte == IAC or byte == ESC:
+                match = SEQUENCE.match(data, start)
+
+                if match is not None:
+                    position = match.end()
+
+                    if byte == IAC and commands is not None:
+                        commands += data[start:position]
+
+                # Cut off by the end of the read
+                elif byte == IAC:
+                    state = COMMAND
+
+                    if commands is not None:
+                        commands.append(IAC)
+
+                else:
+                    state = ESCAPE
+
+            elif byte == BACKSPACE or byte == DELETE:
+                erase(line)
+
+            # Any other control byte is dropped
+
+            continue
+
+        byte = data[position]
+        position += 1
+
+        if commands is not None and state in IN_COMMAND:
+            commands.append(byte)
+
+        if state == COMMAND:
+            if byte == SB:
+                state = SUBNEGOTIATION
+
+            elif DONT >= byte >= WILL:
+                state = OPTION
+
+            # A doubled IAC is a 255 byte, never part of UTF-8 text
+            else:
+                state = DATA
+
+        elif state == OPTION:
+            state = DATA
+
+        elif state == SUBNEGOTIATION:
+            if byte == IAC:
+                state = SUBNEGOTIATION_IAC
+
+        elif state == SUBNEGOTIATION_IAC:
+            state = DATA if byte == SE else SUBNEGOTIATION
+
+        elif state == ESCAPE:
+            if byte == ord('['):
+                state = CSI
+
+            elif byte == ord('O'):
+                state = SS3
+
+            elif byte == ord(']'):
+                state = OSC
+
+            # A two byte sequence like ESC c
+            elif 0x20 <= byte <= 0x7e:
+                state = DATA
+
+            # A stray ESC, the byte after it is read as it is
+            else:
+                state = DATA
+                position -= 1
+
+        elif state == CSI:
+            # Parameter and intermediate bytes until the final byte
+            if 0x40 <= byte <= 0x7e:
+                state = DATA
+
+            # Not part of the sequence, like the Enter after a stray
+            # ESC [, it is read as it is
+            elif not 0x20 <= byte <= 0x3f:
+                state = DATA
+                position -= 1
+
+        elif state == SS3:
+            state = DATA
+
+            if not 0x20 <= byte <= 0x7e:
+                position -= 1
+
+        elif state == OSC:
+            if byte == BELL:
+                state = DATA
+
+            elif byte == ESC:
+                state = OSC_ESCAPE
+
+        elif state == OSC_ESCAPE:
+            state = DATA
+
+    return state
+
+
+###############################################################################
+#                              Server Functions                               #
+###############################################################################
+
+
+def negotiate(self, data, client):
+    """
+    Description:
+        Answers the telnet options a client asked for or agreed to and
+        records what it can do
+    Arguments:
+        A Server object
+        The bytes of whole telnet commands the client sent, collected
+        by filter_input()
+        A client object
+    Return Value:
+        None
+    """
+
+    replies = []
+
+    for match in NEGOTIATION.finditer(data):
+        command, option, sub_option, parameters = match.groups()
+
+        if command is not None:
+            command = command[0]
+            option = option[0]
+
+            # Nothing else is turned on at the client's end
+            if command == WILL and option not in CLIENT_OPTIONS:
+                replies.append(bytes((IAC, DONT, option)))
+
+            elif command == WILL:
+                if client.options is None:
+                    client.options = set()
+
+                # A WILL for an option already on only confirms it
+                if option not in client.options:
+                    client.options.add(option)
+
+                    # The client agreed to edit lines itself, have it
+                    # start now
+                    if option == LINEMODE:
+                        replies.append(bytes((IAC, SB, LINEMODE, MODE, EDIT,
+                                              IAC, SE)))
+
+                        client.line_mode = True
+
+                    # The server only asked for LINEMODE and NAWS
+                    elif option == SUPPRESS_GO_AHEAD:
+                        replies.append(bytes((IAC, DO, option)))
+
+            elif command == WONT:
+                if client.options is not None:
+                    client.options.discard(option)
+
+                # Find out again from how it sends its lines
+                if option == LINEMODE and client.line_mode:
+                    client.line_mode = None
+
+            # The client takes compressed output, offered in
+            # initialize_client() (see compression.py)
+            elif command == DO and option == COMPRESS2 and self.compression:
+                self.start_compression(client)
+
+            elif command == DONT and option == COMPRESS2:
+                self.end_compression(client)
+
+            # The server never sends go-aheads, and leaves the echo to
+            # the client's terminal and everything else off
+            elif command == DO:
+                reply = WILL if option == SUPPRESS_GO_AHEAD else WONT
+
+                replies.append(bytes((IAC, reply, option)))
+
+            # Any other DONT needs no answer, the only other option the
+            # server turns on is not sending go-aheads, which it never
+            # sends either way
+
+        # IAC SB NAWS width width height height IAC SE, a 255 byte is sent
+        # twice
+        elif sub_option is not None and sub_option[0] == NAWS:
+            size = parameters.replace(b"\xff\xff", b"\xff")
+
+            if len(size) == 4:
+                client.window = (int.from_bytes(size[:2], 'big'),
+                                 int.from_bytes(size[2:], 'big'))
+
+    if len(replies) > 0:
+        self.write(b"".join(replies), client)
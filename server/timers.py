@@ -0,0 +1,249 @@
+###############################################################################
+# timers.py                                                                   #
+# The connection timeout functions for the server object                      #
+# by Kenji Takahashi-Rial                                                     #
+###############################################################################
+
+# Every connection has one entry in a hashed timing wheel, a ring of slots
+# of one tick each. Adding and removing an entry is a dictionary operation
+# no matter how many connections there are, and turning the wheel only
+# looks at the one slot that is due. Input does not touch the wheel: the
+# client keeps the time of its last input and the entry is checked when
+# it comes up, then put back for whenever the next deadline really is.
+
+import time
+
+from .jsonlines import frame
+
+# Seconds per slot of the timing wheel, timeouts fire up to one tick late
+TIMER_TICK = 1.0
+
+# Slots in the timing wheel, a bit over an hour of ticks so idle timeouts
+# fit in one lap, deadlines further away wrap around
+TIMER_SLOTS = 4096
+
+# Seconds a connection has to log in
+LOGIN_TIMEOUT = 60
+
+# Seconds without input before a connection is closed, 0 never closes it
+IDLE_TIMEOUT = 3600
+
+# Seconds without input before a probe is sent to find dead connections,
+# 0 sends none
+KEEPALIVE = 0
+
+# Telnet IAC NOP, ignored by telnet clients
+KEEPALIVE_PROBE = b"\xff\xf1"
+
+# The probe sent to JSON lines clients instead
+PING = frame("ping")
+
+
+class TimingWheel():
+    """
+    A hashed timing wheel holding at most one deadline per key
+    """
+
+    def __init__(self, tick=TIMER_TICK, size=TIMER_SLOTS):
+        self.tick = tick
+
+        # Dictionaries with the key as the key and the tick number it is
+        # due on as the value, a key due on tick n is in slot n % size
+        self.slots = [{} for _ in range(size)]
+
+        # A dictionary with the key as the key and its slot as the value
+        self.where = {}
+
+        # The last tick number that was expired
+        self.turned = int(time.monotonic() / tick)
+
+    def __len__(self):
+        return len(self.where)
+
+    def schedule(self, key, due):
+        """
+        Description:
+            Adds a key to the wheel, replacing its earlier deadline
+        Arguments:
+            A TimingWheel object
+            The key
+            The time.monotonic() time it is due at
+        Return Value:
+            None
+        """
+
+        slot = self.where.pop(key, None)
+
+        if slot is not None:
+            del self.slots[slot][key]
+
+        # The first tick at or after the deadline that is still to come
+        number = max(-int(-due // self.tick), self.turned + 1)
+        slot = number % len(self.slots)
+
+        self.slots[slot][key] = number
+        self.where[key] = slot
+
+    def cancel(self, key):
+        slot = self.where.pop(key, None)
+
+        if slot is not None:
+            del self.slots[slot][key]
+
+    def expire(self, now):
+        """
+        Description:
+            Removes every key that is due
+        Arguments:
+            A TimingWheel object
+            The time.monotonic() time
+        Return Value:
+            A list of the keys that were due
+        """
+
+        current = int(now / self.tick)
+        expired = []
+
+        # A late turn only has to look at each slot once
+        for number in range(max(self.turned + 1,
+                                current - len(self.slots) + 1),
+                            current + 1):
+            slot = self.slots[number % len(self.slots)]
+
+            # Keys further away share the slot until their lap comes
+            due = [key for key, key_number in slot.items()
+                   if key_number <= current]
+
+            for key in due:
+                del slot[key]
+                del self.where[key]
+
+            expired += due
+
+        self.turned = max(self.turned, current)
+
+        return expired
+
+
+###############################################################################
+#                              Server Functions                               #
+###############################################################################
+
+
+def watch(self, client):
+    """
+    Description:
+        Puts a client in the timing wheel for its next deadline and
+        starts turning the wheel if it was empty
+    Arguments:
+        A Server object
+        The client object
+    Return Value:
+        None
+    """
+
+    due = next_deadline(self, client)
+
+    if due is None:
+        self.wheel.cancel(client)
+
+        return
+
+    self.wheel.schedule(client, due)
+
+    if not self.wheel_turning:
+        self.wheel_turning = True
+
+        self.call_later(self.wheel.tick, self.turn_wheel)
+
+
+def next_deadline(self, client):
+    # The earliest time anything could be due for the client
+    deadlines = []
+
+    if client.deadline is not None:
+        deadlines.append(client.deadline)
+
+    if self.idle_timeout > 0:
+        deadlines.append(client.active + self.idle_timeout)
+
+    if self.keepalive > 0:
+        deadlines.append(max(client.active, client.probed) + self.keepalive)
+
+    if len(deadlines) == 0:
+        return None
+
+    return min(deadlines)
+
+
+def turn_wheel(self):
+    """
+    Description:
+        Checks every client that is due, then waits one more tick while
+        any client is left in the wheel
+    Arguments:
+        A Server object
+    Return Value:
+        None
+    """
+
+    now = time.monotonic()
+
+    for client in self.wheel.expire(now):
+        if not client.closing:
+            timed_out(self, client, now)
+
+    if len(self.wheel) > 0:
+        self.call_later(self.wheel.tick, self.turn_wheel)
+
+    else:
+        self.wheel_turning = False
+
+
+def timed_out(self, client, now):
+    """
+    Description:
+        Closes or probes a client whose deadline has passed and puts it
+        back in the wheel for the next one
+    Arguments:
+        A Server object
+        The client object taken out of the wheel
+        The time.monotonic() time
+    Return Value:
+        None
+    """
+
+    logged_in = client.username is not None and not client.logging_in
+
+    # A client waiting for a password hash gets its answer soon
+    if (client.deadline is not None and now >= client.deadline and
+            not client.parked):
+        client.deadline = None
+
+        if not logged_in:
+            self.send("Login timed out", client)
+            self.flush(client)
+            self.close_later(client)
+
+            return
+
+        if client.setting_password != 0:
+            client.setting_password = 0
+
+            self.send("Password change timed out", client)
+
+    if self.idle_timeout > 0 and now >= client.active + self.idle_timeout:
+        self.send("Disconnected for being idle", client)
+        self.flush(client)
+        self.close_later(client)
+
+        return
+
+    if (self.keepalive > 0 and
+            now >= max(client.active, client.probed) + self.keepalive):
+        client.probed = now
+
+        # A dead connection fails the next send and is closed
+        self.write(PING if client.json else KEEPALIVE_PROBE, client)
+
+    self.watch(client)